@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Benchmark barcode correction: parse_protocol.get_mismatch_dict expansion vs barcode_correct.BarcodeCorrector.
+
+Reports build time, build memory(tracemalloc peak) and lookup throughput on random whitelists.
+The expansion is skipped when it would exceed --max_expand variants.
+
+Usage:
+    python benchmarks/bench_barcode_correct.py --whitelist_size 384,10000 --length 9,16 --n_mismatch 1,2
+"""
+
+import argparse
+import itertools
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import barcode_correct  # noqa: E402
+import parse_protocol  # noqa: E402
+
+
+def random_whitelist(n, length, rng):
+    whitelist = set()
+    while len(whitelist) < n:
+        whitelist.add("".join(rng.choice("ACGT") for _ in range(length)))
+    return sorted(whitelist)
+
+
+def random_queries(whitelist, n, n_mismatch, rng):
+    queries = []
+    for _ in range(n):
+        seq = list(rng.choice(whitelist))
+        for pos in rng.sample(range(len(seq)), rng.randint(0, n_mismatch + 1)):
+            seq[pos] = rng.choice("ACGTN")
+        queries.append("".join(seq))
+    return queries
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--whitelist_size", default="384,10000")
+    parser.add_argument("--length", default="9,16")
+    parser.add_argument("--n_mismatch", default="1,2")
+    parser.add_argument("--queries", type=int, default=100000)
+    parser.add_argument("--max_expand", type=int, default=20000000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'size':>6} {'len':>4} {'mm':>3} | {'method':<10} {'build s':>8} {'build MB':>9} {'lookups/s':>12}")
+    for size, length, n_mismatch in itertools.product(
+        [int(x) for x in args.whitelist_size.split(",")],
+        [int(x) for x in args.length.split(",")],
+        [int(x) for x in args.n_mismatch.split(",")],
+    ):
+        whitelist = random_whitelist(size, length, rng)
+        queries = random_queries(whitelist, args.queries, n_mismatch, rng)
+        prefix = f"{size:>6} {length:>4} {n_mismatch:>3} |"
+
+        n_variant = size * math.comb(length, n_mismatch) * 5**n_mismatch
+        if n_variant <= args.max_expand:
+            mismatch_dict, build, peak = measure(lambda: parse_protocol.get_mismatch_dict(whitelist, n_mismatch))
+            start = time.perf_counter()
+            for seq in queries:
+                mismatch_dict.get(seq)
+            rate = len(queries) / (time.perf_counter() - start)
+            print(f"{prefix} {'expand':<10} {build:8.2f} {peak / 1e6:9.1f} {rate:12,.0f}")
+            del mismatch_dict
+        else:
+            print(f"{prefix} {'expand':<10} {'skipped, ' + format(n_variant, ',') + ' variants':>31}")
+
+        corrector, build, peak = measure(lambda: barcode_correct.BarcodeCorrector(whitelist, n_mismatch))
+        start = time.perf_counter()
+        for seq in queries:
+            corrector.correct(seq)
+        rate = len(queries) / (time.perf_counter() - start)
+        print(f"{prefix} {corrector.method:<10} {build:8.2f} {peak / 1e6:9.1f} {rate:12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Benchmark paired fastq reading for demultiplexing: pysam.FastxFile against fastq_io.read_pair_blocks.
+
+Both readers produce what split_fastq.py needs from every read pair: the barcode of R1 and the R1/R2 records
+rewritten as name, sequence, "+" and quality. pysam parses each record into str fields, the block reader
+finds the line offsets of large byte blocks with numpy, keeps the records as bytes and joins them per output at once.
+Plain and gzip compressed inputs are read.
+
+Usage:
+    python benchmarks/bench_fastq_reader.py --reads 1000000
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import pysam  # noqa: E402
+
+import fastq_io  # noqa: E402
+from bench_split_fastq import BC_SLICE, WHITELIST  # noqa: E402
+from synthetic import write_plate  # noqa: E402
+
+
+def run_pysam(fq1_fn, fq2_fn):
+    """
+    Return:
+    read pairs, barcode bases, bytes of the rewritten records
+    """
+    n = bc_bases = out_bytes = 0
+    with pysam.FastxFile(fq1_fn, persist=False) as fq1, pysam.FastxFile(fq2_fn, persist=False) as fq2:
+        for entry1, entry2 in zip(fq1, fq2):
+            temp_bc = entry1.sequence[BC_SLICE]
+            record1 = f"@{entry1.name}\n{entry1.sequence}\n+\n{entry1.quality}\n"
+            record2 = f"@{entry2.name}\n{entry2.sequence}\n+\n{entry2.quality}\n"
+            n += 1
+            bc_bases += len(temp_bc)
+            out_bytes += len(record1) + len(record2)
+    return n, bc_bases, out_bytes
+
+
+def run_blocks(fq1_fn, fq2_fn):
+    """
+    Same return value as run_pysam
+    """
+    n = bc_bases = out_bytes = 0
+    for block1, block2, pairs in fastq_io.read_pair_blocks(fq1_fn, fq2_fn):
+        records1 = fastq_io.RecordBlock(block1)
+        records2 = fastq_io.RecordBlock(block2)
+        barcodes = [seq.decode() for seq in records1.fields(1, BC_SLICE)]
+        reads = range(pairs)
+        data1 = records1.join(reads)
+        data2 = records2.join(reads)
+        n += len(barcodes)
+        bc_bases += sum(map(len, barcodes))
+        out_bytes += len(data1) + len(data2)
+    return n, bc_bases, out_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reads", type=int, default=500000)
+    args = parser.parse_args()
+
+    barcodes = [x.strip() for x in open(WHITELIST)]
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {"none": (os.path.join(tmp, "R1.fastq"), os.path.join(tmp, "R2.fastq"))}
+        write_plate(*files["none"], args.reads, barcodes, error_rate=0.1, invalid_rate=0.05)
+        files["gzip"] = tuple(fn + ".gz" for fn in files["none"])
+        for plain, gz in zip(files["none"], files["gzip"]):
+            with open(plain, "rb") as f, gzip.open(gz, "wb", compresslevel=1) as out:
+                shutil.copyfileobj(f, out)
+        size_mb = sum(os.path.getsize(fn) for fn in files["none"]) / 1e6
+
+        print(f"reads: {args.reads}, uncompressed size: {size_mb:.0f} MB")
+        for compression, (fq1, fq2) in files.items():
+            elapsed = {}
+            results = {}
+            for name, func in (("pysam.FastxFile", run_pysam), ("read_pair_blocks", run_blocks)):
+                start = time.perf_counter()
+                results[name] = func(fq1, fq2)
+                elapsed[name] = time.perf_counter() - start
+                assert results[name][0] == args.reads
+            # same barcodes and records from both readers
+            assert results["pysam.FastxFile"] == results["read_pair_blocks"], results
+            for name, seconds in elapsed.items():
+                speedup = elapsed["pysam.FastxFile"] / seconds
+                print(
+                    f"{compression:<5} {name:<17}: {seconds:7.2f} s  {args.reads / seconds:12,.0f} reads/s"
+                    f"  {size_mb / seconds:7.1f} MB/s  speedup {speedup:5.2f} x"
+                )
+
+
+if __name__ == "__main__":
+    main()
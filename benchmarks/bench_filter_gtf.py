@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Benchmark filter_gtf.filter_gtf against the previous full attribute parsing.
+
+An Ensembl-like GTF with --genes genes(gene, transcript, exon and CDS lines) is written to a temporary
+directory and filtered with the default keep_attributes of the pipeline. The outputs of both versions are compared
+byte by byte. The --gene_level mode is timed as well.
+
+Usage:
+    python benchmarks/bench_filter_gtf.py --genes 60000
+"""
+
+import argparse
+import csv
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import filter_gtf  # noqa: E402
+from synthetic import write_gtf  # noqa: E402
+
+KEEP_ATTRIBUTES = "gene_biotype=protein_coding,lncRNA,antisense,IG_LV_gene,IG_V_gene,IG_V_pseudogene,IG_D_gene,IG_J_gene,IG_J_pseudogene,IG_C_gene,IG_C_pseudogene,TR_V_gene,TR_V_pseudogene,TR_D_gene,TR_J_gene,TR_J_pseudogene,TR_C_gene;"
+
+
+def legacy_filter_gtf(gtf_fn, out_fn, allow):
+    gp = filter_gtf.GtfParser(gtf_fn)
+    n_filter = 0
+    with open(out_fn, "w") as f:
+        writer = csv.writer(f, delimiter="\t", quoting=csv.QUOTE_NONE, quotechar=None)
+        for row, grow in gp.gtf_reader_iter():
+            if not grow:
+                writer.writerow(row)
+                continue
+            remove = False
+            if allow:
+                for key, value in grow.attributes.items():
+                    if key in allow and value not in allow[key]:
+                        remove = True
+                        break
+            if not remove:
+                writer.writerow(row)
+            else:
+                n_filter += 1
+    return n_filter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--genes", type=int, default=60000)
+    args = parser.parse_args()
+
+    allow = {}
+    for attr_str in KEEP_ATTRIBUTES.split(";"):
+        if attr_str:
+            attr, val = attr_str.split("=")
+            allow[attr] = set(val.split(","))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        gtf_fn = os.path.join(tmp, "genes.gtf")
+        write_gtf(gtf_fn, args.genes)
+        with open(gtf_fn) as f:
+            n_line = sum(1 for _ in f)
+        print(f"genes: {args.genes:,}, lines: {n_line:,}, file: {os.path.getsize(gtf_fn) / 1e6:,.0f} MB")
+
+        outs = {}
+        base = None
+        rules = filter_gtf.parse_attributes(KEEP_ATTRIBUTES)
+        for name, func in [
+            ("legacy", lambda gtf, out: legacy_filter_gtf(gtf, out, allow)),
+            ("lazy", lambda gtf, out: filter_gtf.filter_gtf(gtf, out, rules)[0]),
+            ("gene_level", lambda gtf, out: filter_gtf.filter_gtf(gtf, out, rules, gene_level=True)[0]),
+        ]:
+            outs[name] = os.path.join(tmp, f"{name}.filtered.gtf")
+            start = time.perf_counter()
+            n_filter = func(gtf_fn, outs[name])
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            print(f"{name:<10}: {elapsed:8.2f} s  {n_line / elapsed:12,.0f} lines/s  speedup {base / elapsed:6.2f} x  filtered {n_filter:,}")
+        print("identical output:", filecmp.cmp(outs["legacy"], outs["lazy"], shallow=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmark the cold-start latency of each script in bin/.
+
+Each script is imported --repeat times in a fresh interpreter with `python -X importtime`. The medians of the total
+import time and of the wall time of `script.py --help` are reported, together with the heaviest direct imports.
+Imports deferred into functions(numpy, pysam, xopen on first use) are not counted, which is the point.
+
+Usage:
+    python benchmarks/bench_import_time.py --repeat 5
+    python benchmarks/bench_import_time.py split_fastq starsolo_summary
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BIN = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+
+def import_time(module):
+    """
+    Return:
+    list of (depth, module, cumulative microseconds) in the order of -X importtime
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=BIN, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise ImportError(proc.stderr.strip().splitlines()[-1])
+    records = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # one space after "|", then two spaces per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        records.append((depth, name.strip(), int(cumulative)))
+    return records
+
+
+def help_time(script):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, "--help"], cwd=BIN, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scripts", nargs="*", help="Script names without .py. Default all scripts in bin/.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=3, help="Number of heaviest direct imports to show.")
+    args = parser.parse_args()
+
+    scripts = args.scripts or sorted(
+        os.path.basename(x)[:-3] for x in glob.glob(os.path.join(BIN, "*.py")) if not x.endswith("__init__.py")
+    )
+    print(f"{'script':<20} {'import ms':>10} {'--help ms':>10}  heaviest direct imports(ms)")
+    for name in scripts:
+        try:
+            runs = [import_time(name) for _ in range(args.repeat)]
+        except ImportError as e:
+            print(f"{name:<20} {'-':>10} {'-':>10}  {e}")
+            continue
+        total = statistics.median(us for run in runs for depth, module, us in run if depth == 0 and module == name)
+        # children are listed before their parent
+        run = runs[-1]
+        end = next(i for i, (depth, module, _) in enumerate(run) if depth == 0 and module == name)
+        start = max((i + 1 for i in range(end) if run[i][0] == 0), default=0)
+        direct = sorted(((us, module) for depth, module, us in run[start:end] if depth == 1), reverse=True)
+        heaviest = ", ".join(f"{module} {us / 1000:.0f}" for us, module in direct[: args.top])
+
+        script = os.path.join(BIN, name + ".py")
+        with open(script) as f:
+            is_cli = '__name__ == "__main__"' in f.read()
+        if is_cli:
+            cli = f"{statistics.median(help_time(script) for _ in range(args.repeat)) * 1000:10.0f}"
+        else:
+            cli = f"{'-':>10}"
+        print(f"{name:<20} {total / 1000:10.1f} {cli}  {heaviest}")
+
+
+if __name__ == "__main__":
+    main()
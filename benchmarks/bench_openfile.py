@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark line reading throughput of utils.openfile per compression format.
+
+A GTF-like text file of about --size_mb MB is written uncompressed, gzip, BGZF, zstd, bzip2 and xz compressed.
+Each file is read line by line with gzip.open(the previous utils.openfile, gzip only), utils.openfile(threads=0,
+in-process) and utils.openfile(default threads, igzip/pigz/zstd processes when available).
+Throughput is reported in MB/s of uncompressed text.
+
+Usage:
+    python benchmarks/bench_openfile.py --size_mb 200
+"""
+
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import utils  # noqa: E402
+from synthetic import write_gtf  # noqa: E402
+
+
+def compress(plain_fn, tmp):
+    with open(plain_fn, "rb") as f:
+        data = f.read()
+    files = {"none": plain_fn}
+    files["gz"] = os.path.join(tmp, "genes.gtf.gz")
+    with gzip.open(files["gz"], "wb") as f:
+        f.write(data)
+    try:
+        from pysam.libcbgzf import BGZFile
+
+        files["bgzf"] = os.path.join(tmp, "genes.bgzf.gtf.gz")
+        with BGZFile(files["bgzf"], "wb") as f:
+            f.write(data)
+    except ImportError:
+        pass
+    if utils.get_xopen() is not None:
+        try:
+            fn = os.path.join(tmp, "genes.gtf.zst")
+            with utils.get_xopen()(fn, "wb", format="zst") as f:
+                f.write(data)
+            files["zst"] = fn
+        except (ImportError, OSError, ValueError):
+            pass
+    files["bz2"] = os.path.join(tmp, "genes.gtf.bz2")
+    with bz2.open(files["bz2"], "wb") as f:
+        f.write(data)
+    files["xz"] = os.path.join(tmp, "genes.gtf.xz")
+    with lzma.open(files["xz"], "wb", preset=1) as f:
+        f.write(data)
+    return files
+
+
+def read_lines(open_func):
+    start = time.perf_counter()
+    with open_func() as f:
+        for _ in f:
+            pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size_mb", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_fn = os.path.join(tmp, "genes.gtf")
+        # about 420 bytes per line, 21 lines per gene
+        write_gtf(plain_fn, max(1, args.size_mb * 1000000 // 8800))
+        size = os.path.getsize(plain_fn)
+        files = compress(plain_fn, tmp)
+        print(f"uncompressed: {size / 1e6:,.0f} MB, xopen: {utils.get_xopen() is not None}")
+        print(f"{'format':<6} {'detected':<9} {'ratio':>6} | {'gzip.open':>10} {'threads=0':>10} {'default':>10}  MB/s")
+        for fmt, fn in files.items():
+            ratio = size / os.path.getsize(fn)
+            rates = []
+            if fmt in ("gz", "bgzf"):
+                rates.append(size / 1e6 / read_lines(lambda: gzip.open(fn, "rt")))
+            else:
+                rates.append(None)
+            rates.append(size / 1e6 / read_lines(lambda: utils.openfile(fn, threads=0)))
+            rates.append(size / 1e6 / read_lines(lambda: utils.openfile(fn)))
+            cells = " ".join(f"{x:10,.0f}" if x else f"{'-':>10}" for x in rates)
+            print(f"{fmt:<6} {str(utils.detect_format(fn)):<9} {ratio:6.1f} | {cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Benchmark barcode routing in split_fastq.py on a synthetic 384-well plate.
+
+Compares the legacy per-sub-sample scan against the precomputed routing table,
+run in-process and with worker processes (--threads).
+Output is discarded so that only the demultiplexing cost is measured.
+
+Usage:
+    python benchmarks/bench_split_fastq.py --reads 1000000 --sub_samples 12 --threads 1,2,4,8
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import pysam  # noqa: E402
+
+import barcode_correct  # noqa: E402
+import demux_stats  # noqa: E402
+import parse_protocol  # noqa: E402
+import split_fastq  # noqa: E402
+from synthetic import ASSETS, write_plate  # noqa: E402
+
+WHITELIST = os.path.join(ASSETS, "whitelist", "AccuraCode-V1", "bclist384")
+BC_SLICE = slice(0, 9)
+
+
+def get_split_dict(n_sub, n_well=384):
+    split_dict = {}
+    wells = list(range(1, n_well + 1))
+    size = n_well // n_sub
+    for i in range(n_sub):
+        split_dict[f"sub{i + 1}"] = wells[i * size:(i + 1) * size]
+    return split_dict
+
+
+class NullFile:
+    """
+    Discards writes, accepts both file.write and fastq_io.BufferedFile.write calls.
+    """
+
+    def write(self, data, records=1):
+        pass
+
+
+def open_handles(split_dict, sink, well_split):
+    fh = {}
+    for i in split_dict:
+        fh[i] = {"sample": sink}
+        if well_split:
+            fh[i]["well"] = {f"well{j}": sink for j in split_dict[i]}
+    return fh
+
+
+def get_legacy_bc(split_dict):
+    """
+    Per-well 1-mismatch expansion that the legacy scan looked barcodes up in.
+    """
+    barcodes = [x.strip() for x in open(WHITELIST)]
+    sub_bc = split_fastq.get_all_bc(WHITELIST, split_dict)
+    for i in split_dict:
+        sub_bc[i]["sample"] = {}
+        for j in split_dict[i]:
+            mismatch_dict = parse_protocol.get_mismatch_dict([barcodes[j - 1]], 1)
+            sub_bc[i]["sample"].update(mismatch_dict)
+    return sub_bc
+
+
+def run_legacy(fq1_fn, fq2_fn, sub_bc, fh_fq1, fh_fq2, well_split):
+    with pysam.FastxFile(fq1_fn, persist=False) as fq1, pysam.FastxFile(fq2_fn, persist=False) as fq2:
+        for entry1, entry2 in zip(fq1, fq2):
+            header1, seq1, qual1 = entry1.name, entry1.sequence, entry1.quality
+            header2, seq2, qual2 = entry2.name, entry2.sequence, entry2.quality
+            temp_bc = seq1[BC_SLICE]
+            for j in sub_bc.keys():
+                if temp_bc in sub_bc[j]["sample"].keys():
+                    fh_fq1[j]["sample"].write(f"@{header1}\n{seq1}\n+\n{qual1}\n")
+                    fh_fq2[j]["sample"].write(f"@{header2}\n{seq2}\n+\n{qual2}\n")
+                    if well_split:
+                        well_num = sub_bc[j]["map"][sub_bc[j]["sample"][temp_bc]]
+                        fh_fq1[j]["well"][well_num].write(f"@{header1}\n{seq1}\n+\n{qual1}\n")
+                        fh_fq2[j]["well"][well_num].write(f"@{header2}\n{seq2}\n+\n{qual2}\n")
+
+
+def run_routed(fq1_fn, fq2_fn, well_route, corrector, threads, sink):
+    args = argparse.Namespace(
+        sample="bench", fq1=fq1_fn, fq2=fq2_fn, protocol="AccuraCode-V1", assets_dir=ASSETS, well=384, threads=threads, chunk_size=50000,
+        checkpoint_dir=None,
+    )
+    runner = split_fastq.Split_Fastq(args)
+    fh = defaultdict(lambda: sink)
+    if threads > 1:
+        runner.demux_parallel(split_fastq.RouteTable(well_route, corrector), fh, fh, demux_stats.DemuxStats())
+    else:
+        runner.demux(split_fastq.RouteTable(well_route, corrector), fh, fh, demux_stats.DemuxStats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reads", type=int, default=200000)
+    parser.add_argument("--sub_samples", type=int, default=12)
+    parser.add_argument("--split_to_well", action="store_true")
+    parser.add_argument("--threads", default="1", help="Comma separated worker counts to run, e.g. 1,2,4,8")
+    args = parser.parse_args()
+
+    barcodes = [x.strip() for x in open(WHITELIST)]
+    split_dict = get_split_dict(args.sub_samples)
+    sink = NullFile()
+    with tempfile.TemporaryDirectory() as tmp:
+        fq1 = os.path.join(tmp, "R1.fastq")
+        fq2 = os.path.join(tmp, "R2.fastq")
+        write_plate(fq1, fq2, args.reads, barcodes, error_rate=0.1, invalid_rate=0.05)
+        fh_fq1 = open_handles(split_dict, sink, args.split_to_well)
+        fh_fq2 = open_handles(split_dict, sink, args.split_to_well)
+        sub_bc = get_legacy_bc(split_dict)
+
+        start = time.perf_counter()
+        run_legacy(fq1, fq2, sub_bc, fh_fq1, fh_fq2, args.split_to_well)
+        legacy = time.perf_counter() - start
+
+        well_route = split_fastq.get_well_route(sub_bc, args.split_to_well)
+        corrector = barcode_correct.BarcodeCorrector(barcodes)
+        routed = {}
+        for threads in [int(x) for x in args.threads.split(",")]:
+            start = time.perf_counter()
+            run_routed(fq1, fq2, well_route, corrector, threads, sink)
+            routed[threads] = time.perf_counter() - start
+
+    print(f"reads: {args.reads}, sub_samples: {args.sub_samples}, split_to_well: {args.split_to_well}")
+    print(f"legacy scan        : {legacy:8.2f} s  {args.reads / legacy:12,.0f} reads/s")
+    for threads, elapsed in routed.items():
+        print(f"routing, threads {threads:<2}: {elapsed:8.2f} s  {args.reads / elapsed:12,.0f} reads/s  speedup {legacy / elapsed:6.2f} x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Benchmark the chunked starsolo_summary.parse_read_stats against the previous whole-file pandas parser.
+
+The chunked parser runs twice: "numpy" converts chunks of at least NUMPY_MIN_ROWS rows with numpy.loadtxt and sorts
+with numpy.argsort, "stdlib" has numpy disabled and splits lines with str.split, like the python-only container of
+STARSOLO_SUMMARY. A synthetic CellReads.stats with --rows barcodes is written to a temporary directory. Each parser runs in a fresh
+process, so the peak RSS(ru_maxrss) of the parsers are not mixed up.
+
+Usage:
+    python benchmarks/bench_starsolo_summary.py --rows 5000000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+sys.path.insert(0, BIN)
+
+import pandas as pd  # noqa: E402
+
+from synthetic import write_read_stats  # noqa: E402
+
+
+def legacy_parse_read_stats(read_stats):
+    dtypes = defaultdict(lambda: "int")
+    dtypes["CB"] = "object"
+    df = pd.read_csv(read_stats, sep="\t", header=0, index_col=0, skiprows=[1], dtype=dtypes)
+    df_bc = df.loc[:, ["nUMIunique", "countedU", "nGenesUnique"]]
+    df_bc.columns = ["UMI", "read", "gene"]
+    df_bc = df_bc.sort_values("UMI", ascending=False)
+    df = df.loc[:, ["cbMatch", "cbPerfect", "genomeU", "genomeM", "exonic", "intronic", "exonicAS", "intronicAS", "countedU"]]
+    s = df.sum()
+    return df_bc, s
+
+
+def run_one(parser_name, fn):
+    start = time.perf_counter()
+    if parser_name == "legacy":
+        df_bc, _ = legacy_parse_read_stats(fn)
+        check = [int(df_bc[col].sum()) for col in ["UMI", "read", "gene"]]
+    else:
+        import starsolo_summary
+
+        if parser_name == "stdlib":
+            starsolo_summary.NUMPY_MIN_ROWS = float("inf")
+        table, _ = starsolo_summary.parse_read_stats(fn)
+        check = [sum(table[col]) for col in ["UMI", "read", "gene"]]
+    elapsed = time.perf_counter() - start
+    # kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({"seconds": elapsed, "peak_rss": peak, "rows": len(df_bc) if parser_name == "legacy" else len(table["CB"]), "check": check}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--run", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--generate", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        run_one(*args.run)
+        return
+    if args.generate:
+        write_read_stats(args.generate, rows=args.rows)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fn = os.path.join(tmp, "CellReads.stats")
+        start = time.perf_counter()
+        # in a child process, Linux keeps the peak RSS of this process in the parsers it runs
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--generate", fn, "--rows", str(args.rows)], check=True)
+        size = os.path.getsize(fn)
+        print(f"rows: {args.rows:,}, file: {size / 1e6:,.0f} MB, generated in {time.perf_counter() - start:.1f} s")
+        res = {}
+        for name in ["legacy", "numpy", "stdlib"]:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run", name, fn], check=True, capture_output=True, text=True
+            ).stdout
+            res[name] = json.loads(out)
+            print(f"{name:<9}: {res[name]['seconds']:8.2f} s  peak RSS {res[name]['peak_rss'] / 1e6:8.0f} MB")
+        same = all(res[name]["check"] == res["legacy"]["check"] and res[name]["rows"] == res["legacy"]["rows"] for name in res)
+        print("identical sums:", same)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""
+Pipeline benchmark suite. Runs offline on synthetic data, STAR is not needed.
+
+A synthetic AccuraCode plate, GTF and CellReads.stats are generated with synthetic.py, then each case is timed
+--repeat times and the median is kept:
+    split_fastq         bin/split_fastq.py on the plate, gzip input and output                  read pairs/s
+    get_mismatch_dict   parse_protocol.get_mismatch_dict of the 384 well whitelist, 1 mismatch  barcodes/s
+    filter_gtf          bin/filter_gtf.py with the keep_attributes default of the pipeline      lines/s
+    parse_read_stats    starsolo_summary.parse_read_stats of an unfiltered CellReads.stats      rows/s
+    multiqc             MultiQC with the multiqc_sgr plugin on --samples copies of the outputs   samples/s
+Scripts and functions run in a fresh process. Peak RSS is taken from the perf.json of the run(see bin/perf.py).
+multiqc is skipped if MultiQC is not installed.
+
+Results are written as JSON to --outdir. --compare prints the ratio of the median times to an earlier result.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scale small
+    python benchmarks/run_benchmarks.py --scale medium --repeat 3 --compare bench_results/20240101-120000_abc1234.json
+    python benchmarks/run_benchmarks.py --cases split_fastq,filter_gtf --reads 5000000 --skew 1.5
+"""
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+from synthetic import ASSETS, BIN
+
+sys.path.insert(0, BIN)
+
+import perf  # noqa: E402
+
+SCALES = {
+    "small": {"reads": 200000, "genes": 2000, "stats_rows": 200000, "samples": 8},
+    "medium": {"reads": 2000000, "genes": 20000, "stats_rows": 2000000, "samples": 96},
+    "large": {"reads": 20000000, "genes": 60000, "stats_rows": 10000000, "samples": 384},
+}
+CASES = ["split_fastq", "get_mismatch_dict", "filter_gtf", "parse_read_stats", "multiqc"]
+PROTOCOL = "AccuraCode-V1"
+KEEP_ATTRIBUTES = "gene_biotype=protein_coding,lncRNA,antisense,IG_LV_gene,IG_V_gene,IG_V_pseudogene,IG_D_gene,IG_J_gene,IG_J_pseudogene,IG_C_gene,IG_C_pseudogene,TR_V_gene,TR_V_pseudogene,TR_D_gene,TR_J_gene,TR_J_pseudogene,TR_C_gene;"
+SAMPLE = "S1"
+# median time ratio reported as slower or faster in --compare
+THRESHOLD = 1.1
+
+
+def generate(config, data_dir):
+    """
+    Write the synthetic inputs of all cases to data_dir.
+    """
+
+    def fn(x):
+        return os.path.join(data_dir, x)
+
+    barcodes = synthetic.plate_barcodes(config["well"])
+    synthetic.write_plate(
+        fn("R1.fastq.gz"), fn("R2.fastq.gz"), config["reads"], barcodes, config["pattern"], config["skew"],
+        config["error_rate"], config["invalid_rate"], seed=config["seed"],
+    )
+    synthetic.write_split_inf(fn("split_inf.tsv"), SAMPLE, config["sub_samples"], config["well"])
+    synthetic.write_gtf(fn("genes.gtf"), config["genes"], config["seed"])
+    synthetic.write_read_stats(fn("CellReads.stats"), rows=config["stats_rows"], seed=config["seed"])
+    synthetic.write_read_stats(
+        fn("plate.CellReads.stats"), barcodes=barcodes, skew=config["skew"],
+        reads_per_barcode=max(1, config["reads"] // len(barcodes)), seed=config["seed"],
+    )
+    synthetic.write_summary(fn("Summary.csv"), config["reads"])
+
+
+def run_command(cmd, cwd, perf_json=None):
+    """
+    Return:
+    wall time, peak RSS and phase times of a script
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        sys.exit(f"{' '.join(cmd)} failed:\n{proc.stderr}")
+    res = {"seconds": seconds}
+    if perf_json:
+        with open(os.path.join(cwd, perf_json)) as f:
+            report = json.load(f)
+        res["peak_rss_mb"] = report["peak_rss_mb"]
+        res["counters"] = report["counters"]
+        res["phases"] = {name: phase["wall_time"] for name, phase in report["phases"].items()}
+    return res
+
+
+def run_function(case, data_dir, workdir):
+    res = run_command([sys.executable, os.path.abspath(__file__), "--run", case, data_dir], workdir, f"{case}.perf.json")
+    res["items"] = res["counters"]["items"]
+    return res
+
+
+def bench_split_fastq(config, data_dir, workdir):
+    cmd = [
+        sys.executable, os.path.join(BIN, "split_fastq.py"), "--sample", SAMPLE,
+        "--fq1", os.path.join(data_dir, "R1.fastq.gz"), "--fq2", os.path.join(data_dir, "R2.fastq.gz"),
+        "--split_inf", os.path.join(data_dir, "split_inf.tsv"), "--assets_dir", ASSETS, "--protocol", PROTOCOL,
+        "--well", str(config["well"]), "--pattern", config["pattern"], "--threads", str(config["threads"]),
+        "--compression", "gzip",
+    ]
+    res = run_command(cmd, workdir, f"{SAMPLE}.bulk_rna.split_fastq.perf.json")
+    res["items"] = config["reads"]
+    return res
+
+
+def bench_filter_gtf(config, data_dir, workdir):
+    gtf = os.path.join(data_dir, "genes.gtf")
+    res = run_command([sys.executable, os.path.join(BIN, "filter_gtf.py"), gtf, KEEP_ATTRIBUTES], workdir, "filter_gtf.perf.json")
+    with open(gtf) as f:
+        res["items"] = sum(1 for _ in f)
+    return res
+
+
+def bench_get_mismatch_dict(config, data_dir, workdir):
+    return run_function("get_mismatch_dict", data_dir, workdir)
+
+
+def bench_parse_read_stats(config, data_dir, workdir):
+    return run_function("parse_read_stats", data_dir, workdir)
+
+
+def bench_multiqc(config, data_dir, workdir):
+    """
+    starsolo_summary.py and split_fastq.py outputs of the plate are copied to --samples samples.
+    """
+    if importlib.util.find_spec("multiqc") is None:
+        return None
+    inputs = os.path.join(workdir, "inputs")
+    os.makedirs(inputs)
+    run_command(
+        [
+            sys.executable, os.path.join(BIN, "starsolo_summary.py"), "--read_stats", os.path.join(data_dir, "plate.CellReads.stats"),
+            "--summary", os.path.join(data_dir, "Summary.csv"), "--sample", SAMPLE, "--assets_dir", ASSETS,
+            "--protocol", PROTOCOL,
+        ],
+        inputs,
+    )
+    # workdir of the split_fastq case, if it was run
+    for fn in glob.glob(os.path.join(os.path.dirname(workdir), "split_fastq", f"{SAMPLE}.*.json")):
+        shutil.copy(fn, inputs)
+    outputs = {}
+    for fn in glob.glob1(inputs, f"{SAMPLE}.*.json"):
+        with open(os.path.join(inputs, fn)) as f:
+            outputs[fn[len(SAMPLE):]] = json.load(f)
+    for i in range(2, config["samples"] + 1):
+        for suffix, data in outputs.items():
+            if suffix.endswith(".perf.json"):
+                data["sample"] = f"S{i}"
+            with open(os.path.join(inputs, f"S{i}{suffix}"), "w") as f:
+                json.dump(data, f)
+    res = run_command([sys.executable, "-m", "multiqc", "-f", "-q", "-o", "multiqc", "inputs"], workdir)
+    res["items"] = config["samples"]
+    return res
+
+
+def run_case(case, data_dir):
+    """
+    Run a function case in this process and write its perf.json to the current directory.
+    """
+    case_perf = perf.Perf(case)
+    if case == "get_mismatch_dict":
+        import parse_protocol
+
+        barcodes = synthetic.plate_barcodes()
+        with case_perf.phase("get_mismatch_dict"):
+            # large enough to time
+            for _ in range(20):
+                parse_protocol.get_mismatch_dict(barcodes, 1)
+                case_perf.count("items", len(barcodes))
+    elif case == "parse_read_stats":
+        import starsolo_summary
+
+        with case_perf.phase("parse_read_stats"):
+            table, _ = starsolo_summary.parse_read_stats(os.path.join(data_dir, "CellReads.stats"))
+            case_perf.count("items", len(table["CB"]))
+    case_perf.write(f"{case}.perf.json")
+
+
+def git_commit():
+    try:
+        proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BIN, capture_output=True, text=True)
+    except OSError:
+        return None
+    return proc.stdout.strip() or None
+
+
+def compare(results, baseline_fn):
+    with open(baseline_fn) as f:
+        baseline = json.load(f)
+    if baseline["config"] != results["config"]:
+        print("Warning: the baseline was run with a different config, ratios are not comparable.")
+    print(f"\ncompared to {baseline_fn} (commit {baseline.get('commit')})")
+    print(f"{'case':<18} {'base s':>9} {'new s':>9} {'ratio':>7}")
+    for case, res in results["cases"].items():
+        base = baseline["cases"].get(case)
+        if not res or not base:
+            continue
+        ratio = res["seconds"] / base["seconds"]
+        flag = "slower" if ratio > THRESHOLD else "faster" if ratio < 1 / THRESHOLD else ""
+        print(f"{case:<18} {base['seconds']:9.2f} {res['seconds']:9.2f} {ratio:7.2f} {flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", default="small", choices=SCALES, help="Preset of the data sizes below.")
+    parser.add_argument("--cases", default=",".join(CASES), help="Comma separated cases to run.")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--reads", type=int, help="Read pairs of the plate.")
+    parser.add_argument("--genes", type=int, help="Genes of the GTF.")
+    parser.add_argument("--stats_rows", type=int, help="Barcodes of the CellReads.stats.")
+    parser.add_argument("--samples", type=int, help="Samples of the MultiQC report.")
+    parser.add_argument("--well", type=int, default=384, choices=[96, 384])
+    parser.add_argument("--pattern", default="C9U12")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of reads per well, 0 is uniform.")
+    parser.add_argument("--error_rate", type=float, default=0.05, help="Fraction of reads with a barcode mismatch.")
+    parser.add_argument("--invalid_rate", type=float, default=0.02, help="Fraction of reads with a random barcode.")
+    parser.add_argument("--sub_samples", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=1, help="split_fastq.py --threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data_dir", help="Keep the synthetic data here and reuse it in later runs with the same config.")
+    parser.add_argument("--outdir", default="bench_results", help="Directory of the result JSON.")
+    parser.add_argument("--compare", help="Result JSON of an earlier run.")
+    parser.add_argument("--run", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--generate", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        run_case(*args.run)
+        return
+    if args.generate:
+        generate(json.loads(args.generate[1]), args.generate[0])
+        return
+
+    config = dict(SCALES[args.scale])
+    for key in config:
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    for key in ["well", "pattern", "skew", "error_rate", "invalid_rate", "sub_samples", "threads", "seed"]:
+        config[key] = getattr(args, key)
+    cases = args.cases.split(",")
+    for case in cases:
+        if case not in CASES:
+            sys.exit(f"Unknown case: {case}. Cases: {','.join(CASES)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.abspath(args.data_dir) if args.data_dir else os.path.join(tmp, "data")
+        config_fn = os.path.join(data_dir, "config.json")
+        data_config = {key: value for key, value in config.items() if key not in ("samples", "threads")}
+        if os.path.exists(config_fn):
+            with open(config_fn) as f:
+                cached = json.load(f) == data_config
+        else:
+            cached = False
+        if not cached:
+            os.makedirs(data_dir, exist_ok=True)
+            start = time.perf_counter()
+            # in a child process, Linux keeps the peak RSS of this process in the scripts it runs
+            run_command([sys.executable, os.path.abspath(__file__), "--generate", data_dir, json.dumps(config)], tmp)
+            with open(config_fn, "w") as f:
+                json.dump(data_config, f)
+            print(f"synthetic data generated in {time.perf_counter() - start:.1f} s")
+
+        results = {}
+        print(f"{'case':<18} {'median s':>9} {'items/s':>14} {'peak RSS MB':>12}")
+        for case in cases:
+            runs = []
+            for _ in range(args.repeat):
+                workdir = os.path.join(tmp, case)
+                shutil.rmtree(workdir, ignore_errors=True)
+                os.makedirs(workdir)
+                res = globals()[f"bench_{case}"](config, data_dir, workdir)
+                if res is None:
+                    break
+                runs.append(res)
+            if not runs:
+                print(f"{case:<18} skipped")
+                results[case] = None
+                continue
+            seconds = statistics.median(res["seconds"] for res in runs)
+            items = runs[0]["items"]
+            results[case] = {
+                "seconds": round(seconds, 3),
+                "runs": [round(res["seconds"], 3) for res in runs],
+                "items": items,
+                "items_per_s": round(items / seconds, 1) if items else None,
+                "peak_rss_mb": max((res["peak_rss_mb"] for res in runs if res.get("peak_rss_mb")), default=None),
+                "phases": runs[-1].get("phases", {}),
+            }
+            rate = f"{results[case]['items_per_s']:14,.0f}" if items else f"{'':>14}"
+            rss = f"{results[case]['peak_rss_mb']:12.1f}" if results[case]["peak_rss_mb"] else f"{'':>12}"
+            print(f"{case:<18} {seconds:9.2f} {rate} {rss}")
+
+    commit = git_commit()
+    data = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": ".".join(map(str, sys.version_info[:3])),
+        "platform": sys.platform,
+        "cpus": os.cpu_count(),
+        "config": config,
+        "cases": results,
+    }
+    os.makedirs(args.outdir, exist_ok=True)
+    out_fn = os.path.join(args.outdir, f"{time.strftime('%Y%m%d-%H%M%S')}_{commit or 'nogit'}.json")
+    with open(out_fn, "w") as f:
+        json.dump(data, f, indent=4)
+    print(f"results written to {out_fn}")
+    if args.compare:
+        compare(data, args.compare)
+
+
+if __name__ == "__main__":
+    main()
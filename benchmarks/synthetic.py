@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+Synthetic inputs for the benchmarks: AccuraCode plates, GTF and STARsolo CellReads.stats/Summary.csv.
+
+Plates are paired fastq files. R1 follows the barcode pattern(C9U12 by default) and ends with poly-T.
+Well barcodes are drawn from the whitelist with a Zipf-like skew, some barcodes get one substitution and some are
+replaced by random sequences. Records have fixed-width names, so whole chunks are built as numpy byte arrays.
+
+Usage:
+    python benchmarks/synthetic.py --outdir synthetic --reads 2000000 --skew 1 --genes 20000
+"""
+
+import argparse
+import gzip
+import os
+import random
+import sys
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BIN = os.path.abspath(os.path.join(BENCH_DIR, "..", "bin"))
+ASSETS = os.path.abspath(os.path.join(BENCH_DIR, "..", "assets"))
+sys.path.insert(0, BIN)
+
+import parse_protocol  # noqa: E402
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+# R1 bases after the pattern
+POLY_T = 30
+# name digits, enough for 1e10 reads
+NAME_DIGITS = 10
+
+BIOTYPES = ["protein_coding"] * 5 + ["lncRNA"] * 4 + ["processed_pseudogene", "misc_RNA", "snRNA", "TR_V_gene"]
+READ_STATS_COLUMNS = [
+    "CB", "cbMatch", "cbPerfect", "exonic", "intronic", "mito", "genomeU", "genomeM", "featureU", "featureM",
+    "cbMMunique", "cbMMmultiple", "exonicAS", "intronicAS", "countedU", "countedM", "nUMIunique", "nGenesUnique",
+    "nUMImulti", "nGenesMulti",
+]
+
+
+def plate_barcodes(well=384, protocol="AccuraCode-V1"):
+    """
+    Return:
+    whitelist barcodes of the plate, in well order
+    """
+    protocol_dict = parse_protocol.get_protocol_dict(ASSETS)
+    with open(protocol_dict[protocol][f"well{well}"]) as f:
+        return [x.strip() for x in f if x.strip()]
+
+
+def well_weights(n_well, skew=0.0, seed=0):
+    """
+    Fraction of reads of each well. Weights are rank^-skew with shuffled ranks, skew 0 is uniform.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.arange(1, n_well + 1, dtype=float) ** -skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def _random_bases(rng, shape):
+    return BASES[rng.integers(0, 4, size=shape)]
+
+
+def _names(first, n):
+    """
+    @r0000000001 style names as a (n, NAME_DIGITS + 2) byte array
+    """
+    index = np.arange(first, first + n, dtype=np.int64)
+    powers = 10 ** np.arange(NAME_DIGITS - 1, -1, -1, dtype=np.int64)
+    digits = (index[:, None] // powers) % 10 + ord("0")
+    names = np.empty((n, NAME_DIGITS + 2), dtype=np.uint8)
+    names[:, 0] = ord("@")
+    names[:, 1] = ord("r")
+    names[:, 2:] = digits
+    return names
+
+
+def _records(names, seq, qual):
+    n = len(names)
+    newline = np.full((n, 1), ord("\n"), dtype=np.uint8)
+    plus = np.frombuffer(b"\n+\n", dtype=np.uint8)[None, :].repeat(n, axis=0)
+    return np.hstack([names, newline, seq, plus, qual, newline]).tobytes()
+
+
+def _open_out(fn):
+    return gzip.open(fn, "wb", compresslevel=1) if fn.endswith(".gz") else open(fn, "wb")
+
+
+def write_plate(
+    fq1, fq2, n_reads, barcodes=None, pattern="C9U12", skew=0.0, error_rate=0.05, invalid_rate=0.02,
+    read2_length=100, seed=0, chunk_size=200000,
+):
+    """
+    Write a synthetic plate. Files ending with .gz are gzip compressed.
+
+    Args:
+        barcodes: well barcodes. Default the 384 well whitelist of AccuraCode-V1.
+        skew: skew of reads per well, see well_weights
+        error_rate: fraction of reads with one substitution(ACGTN) in the barcode
+        invalid_rate: fraction of reads with a random barcode
+
+    Return:
+    reads per well barcode, before errors
+    """
+    if barcodes is None:
+        barcodes = plate_barcodes()
+    pattern_dict = parse_protocol.parse_pattern(pattern)
+    cb_slices = pattern_dict["C"]
+    bc_length = sum(s.stop - s.start for s in cb_slices)
+    if any(len(bc) != bc_length for bc in barcodes):
+        sys.exit(f"Barcode length does not match pattern {pattern}")
+    read1_length = max(s.stop for slices in pattern_dict.values() for s in slices) + POLY_T
+    bc_array = np.frombuffer("".join(barcodes).encode(), dtype=np.uint8).reshape(len(barcodes), bc_length)
+    weights = well_weights(len(barcodes), skew, seed)
+    rng = np.random.default_rng(seed)
+    well_reads = np.zeros(len(barcodes), dtype=np.int64)
+
+    with _open_out(fq1) as f1, _open_out(fq2) as f2:
+        for first in range(0, n_reads, chunk_size):
+            n = min(chunk_size, n_reads - first)
+            wells = rng.choice(len(barcodes), size=n, p=weights)
+            well_reads += np.bincount(wells, minlength=len(barcodes))
+            bc = bc_array[wells]
+            status = rng.random(n)
+            invalid = status < invalid_rate
+            bc[invalid] = _random_bases(rng, (int(invalid.sum()), bc_length))
+            error = (status >= invalid_rate) & (status < invalid_rate + error_rate)
+            rows = np.flatnonzero(error)
+            bc[rows, rng.integers(0, bc_length, size=len(rows))] = np.frombuffer(b"ACGTN", dtype=np.uint8)[
+                rng.integers(0, 5, size=len(rows))
+            ]
+
+            seq1 = np.full((n, read1_length), ord("T"), dtype=np.uint8)
+            offset = 0
+            for s in cb_slices:
+                width = s.stop - s.start
+                seq1[:, s] = bc[:, offset:offset + width]
+                offset += width
+            for letter, slices in pattern_dict.items():
+                for s in slices:
+                    if letter in "UN":
+                        seq1[:, s] = _random_bases(rng, (n, s.stop - s.start))
+                    elif letter == "L":
+                        seq1[:, s] = ord("A")
+            seq2 = _random_bases(rng, (n, read2_length))
+            # mostly high quality
+            qual2 = np.frombuffer(b"FFFFFF:,", dtype=np.uint8)[rng.integers(0, 8, size=(n, read2_length))]
+            names = _names(first, n)
+            f1.write(_records(names, seq1, np.full((n, read1_length), ord("F"), dtype=np.uint8)))
+            f2.write(_records(names, seq2, qual2))
+    return dict(zip(barcodes, well_reads.tolist()))
+
+
+def write_split_inf(fn, sample, n_sub, n_well=384):
+    """
+    split_inf of consecutive well ranges, one per sub-sample
+    """
+    bounds = np.linspace(0, n_well, n_sub + 1).astype(int)
+    with open(fn, "w") as f:
+        f.write("raw_sample\twell\tsub_sample\n")
+        for i in range(n_sub):
+            f.write(f"{sample}\t{bounds[i] + 1}-{bounds[i + 1]}\tsub{i + 1}\n")
+
+
+def write_gtf(fn, n_gene, seed=0):
+    """
+    Ensembl-like GTF with gene, transcript, exon and CDS lines
+    """
+    rng = random.Random(seed)
+    with open(fn, "w") as f:
+        f.write("#!genome-build GRCm39\n#!genome-version GRCm39\n")
+        pos = 1
+        for i in range(n_gene):
+            chrom = str(i * 20 // n_gene + 1)
+            strand = rng.choice("+-")
+            biotype = rng.choice(BIOTYPES)
+            gene = f'gene_id "ENSMUSG{i:011d}"; gene_version "{rng.randint(1, 9)}"; gene_name "Gene{i}"; gene_source "ensembl_havana"; gene_biotype "{biotype}";'
+            start = pos
+            end = pos + rng.randint(1000, 50000)
+            pos = end + rng.randint(100, 10000)
+            f.write(f"{chrom}\tensembl_havana\tgene\t{start}\t{end}\t.\t{strand}\t.\t{gene}\n")
+            for t in range(rng.randint(1, 4)):
+                tx = f'{gene} transcript_id "ENSMUST{i:08d}{t:03d}"; transcript_version "1"; transcript_name "Gene{i}-20{t}"; transcript_source "ensembl"; transcript_biotype "{biotype}"; tag "basic"; transcript_support_level "1";'
+                f.write(f"{chrom}\tensembl_havana\ttranscript\t{start}\t{end}\t.\t{strand}\t.\t{tx}\n")
+                exon_start = start
+                for e in range(rng.randint(1, 10)):
+                    exon_end = min(end, exon_start + rng.randint(50, 500))
+                    exon = f'{tx[:-1]}; exon_number "{e + 1}"; exon_id "ENSMUSE{i:08d}{t:02d}{e:02d}"; exon_version "1";'
+                    for feature in ["exon", "CDS"] if biotype == "protein_coding" else ["exon"]:
+                        f.write(f"{chrom}\tensembl_havana\t{feature}\t{exon_start}\t{exon_end}\t.\t{strand}\t.\t{exon}\n")
+                    exon_start = exon_end + rng.randint(100, 3000)
+                    if exon_start >= end:
+                        break
+
+
+def write_read_stats(fn, rows=None, barcodes=None, skew=0.0, reads_per_barcode=20000, seed=0):
+    """
+    STARsolo CellReads.stats.
+
+    Args:
+        rows: number of random 16 bp barcodes, most with very few reads, like an unfiltered run
+        barcodes: plate barcodes instead of random ones, with about reads_per_barcode reads skewed by skew
+    """
+    rng = np.random.default_rng(seed)
+    with open(fn, "w") as f:
+        f.write("\t".join(READ_STATS_COLUMNS) + "\n")
+        f.write("CBnotInPasslist\t" + "\t".join(["123456"] * (len(READ_STATS_COLUMNS) - 1)) + "\n")
+        total = len(barcodes) if barcodes is not None else rows
+        chunk = 1000000
+        fmt = "\t".join(["%s"] + ["%d"] * (len(READ_STATS_COLUMNS) - 1))
+        for start in range(0, total, chunk):
+            n = min(chunk, total - start)
+            if barcodes is not None:
+                cb = np.array(barcodes[start:start + n], dtype=object)
+                reads = rng.poisson(reads_per_barcode * len(barcodes) * well_weights(len(barcodes), skew, seed)[start:start + n])
+            else:
+                cb = np.array([x.tobytes().decode() for x in _random_bases(rng, (n, 16))], dtype=object)
+                reads = rng.geometric(0.3, size=n) - 1
+            table = np.empty((n, len(READ_STATS_COLUMNS)), dtype=object)
+            table[:, 0] = cb
+            for i, col in enumerate(READ_STATS_COLUMNS[1:], start=1):
+                table[:, i] = reads if col in ("cbMatch", "countedU") else rng.binomial(reads, 0.8)
+            np.savetxt(f, table, fmt=fmt)
+
+
+def write_summary(fn, n_reads, valid_frac=0.95):
+    """
+    STARsolo Summary.csv with the rows read by starsolo_summary.py
+    """
+    with open(fn, "w") as f:
+        f.write(f"Number of Reads,{n_reads}\n")
+        f.write(f"Reads With Valid Barcodes,{valid_frac}\n")
+        f.write("Sequencing Saturation,0.5\n")
+        f.write("Q30 Bases in CB+UMI,0.95\n")
+        f.write("Reads Mapped to Genome: Unique+Multiple,0.9\n")
+        f.write("Reads Mapped to Genome: Unique,0.8\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outdir", required=True)
+    parser.add_argument("--sample", default="S1")
+    parser.add_argument("--reads", type=int, default=1000000)
+    parser.add_argument("--well", type=int, default=384, choices=[96, 384])
+    parser.add_argument("--pattern", default="C9U12")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of reads per well, 0 is uniform.")
+    parser.add_argument("--error_rate", type=float, default=0.05)
+    parser.add_argument("--invalid_rate", type=float, default=0.02)
+    parser.add_argument("--sub_samples", type=int, default=4)
+    parser.add_argument("--genes", type=int, default=20000)
+    parser.add_argument("--stats_rows", type=int, default=0, help="Random barcodes in CellReads.stats. 0 uses the plate.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.outdir, exist_ok=True)
+
+    def out(fn):
+        return os.path.join(args.outdir, fn)
+
+    barcodes = plate_barcodes(args.well)
+    write_plate(
+        out(f"{args.sample}_R1.fastq.gz"), out(f"{args.sample}_R2.fastq.gz"), args.reads, barcodes, args.pattern,
+        args.skew, args.error_rate, args.invalid_rate, seed=args.seed,
+    )
+    write_split_inf(out("split_inf.tsv"), args.sample, args.sub_samples, args.well)
+    write_gtf(out("genes.gtf"), args.genes, args.seed)
+    if args.stats_rows:
+        write_read_stats(out("CellReads.stats"), rows=args.stats_rows, seed=args.seed)
+    else:
+        write_read_stats(
+            out("CellReads.stats"), barcodes=barcodes, skew=args.skew,
+            reads_per_barcode=args.reads // len(barcodes), seed=args.seed,
+        )
+    write_summary(out("Summary.csv"), args.reads)
+    print(f"written to {args.outdir}")
+
+
+if __name__ == "__main__":
+    main()
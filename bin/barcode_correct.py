@@ -0,0 +1,173 @@
+import itertools
+
+EXACT = "exact"
+CORRECTED = "corrected"
+AMBIGUOUS = "ambiguous"
+NO_MATCH = "no_match"
+
+
+def hamming(seq1, seq2):
+    """
+    >>> hamming("ACGT", "ACGA")
+    1
+    """
+    return sum(a != b for a, b in zip(seq1, seq2))
+
+
+def masked_slices(length, positions):
+    """
+    Slices of the positions kept after masking.
+
+    >>> masked_slices(6, (1, 4))
+    [slice(0, 1, None), slice(2, 4, None), slice(5, 6, None)]
+    """
+    slices = []
+    start = 0
+    for pos in positions:
+        if pos > start:
+            slices.append(slice(start, pos))
+        start = pos + 1
+    if start < length:
+        slices.append(slice(start, length))
+    return slices
+
+
+class BarcodeCorrector:
+    """
+    Correct barcodes to a whitelist within n_mismatch(Hamming distance).
+
+    Instead of expanding every mismatch variant over the alphabet, whitelist barcodes are indexed by sub-sequences,
+    so memory does not depend on the alphabet and only a few candidates are compared per lookup.
+    Two sub-sequence indexes are used, whichever needs less work per lookup:
+    - pigeonhole: barcodes are cut into n_mismatch + 1 segments. A barcode within n_mismatch of a whitelist barcode
+      shares at least one segment with it. Good for long barcodes.
+    - masked: one key per combination of n_mismatch masked positions. A barcode within n_mismatch of a whitelist
+      barcode shares the key where the mismatch positions are masked. Good for short barcodes and large whitelists.
+
+    The closest whitelist barcode wins. If several whitelist barcodes are equally close, the barcode is ambiguous
+    and is not corrected.
+
+    >>> corrector = BarcodeCorrector(["AACGTGAT", "AAACATCG"])
+    >>> corrector.correct("AACGTGAA")
+    'AACGTGAT'
+    >>> corrector.lookup("AACGTGAT")
+    ('exact', 'AACGTGAT')
+    >>> corrector.lookup("AACNTGAT")
+    ('corrected', 'AACGTGAT')
+    >>> corrector.lookup("TTTTTTTT")
+    ('no_match', None)
+    >>> BarcodeCorrector(["AAAA", "AATT"]).lookup("AAAT")
+    ('ambiguous', None)
+    >>> BarcodeCorrector(["AAAA", "AATT"], method="masked").lookup("ATAA")
+    ('corrected', 'AAAA')
+    """
+
+    def __init__(self, seq_list, n_mismatch=1, method="auto"):
+        self.n_mismatch = n_mismatch
+        self.whitelist = []
+        seen = set()
+        for seq in seq_list:
+            seq = seq.strip()
+            if seq == "" or seq in seen:
+                continue
+            seen.add(seq)
+            self.whitelist.append(seq)
+        if not self.whitelist:
+            raise ValueError("Empty barcode whitelist")
+        self.length = len(self.whitelist[0])
+        if any(len(seq) != self.length for seq in self.whitelist):
+            raise ValueError("Barcodes in whitelist do not have same length")
+        self.exact = set(self.whitelist)
+
+        n_segment = min(n_mismatch + 1, self.length)
+        bounds = [self.length * i // n_segment for i in range(n_segment + 1)]
+        pigeonhole = [[slice(bounds[i], bounds[i + 1])] for i in range(n_segment)]
+        masked = [masked_slices(self.length, x) for x in itertools.combinations(range(self.length), n_mismatch)]
+        if method == "auto":
+            # expected number of candidates per lookup vs number of keys per lookup
+            n_candidate = sum(len(self.whitelist) / 4 ** (x[0].stop - x[0].start) for x in pigeonhole)
+            method = "pigeonhole" if n_candidate <= len(masked) else "masked"
+        if method not in ("pigeonhole", "masked"):
+            raise ValueError(f"Unknown method: {method}")
+        self.method = method
+        self.key_slices = pigeonhole if method == "pigeonhole" else masked
+
+        self.index = []
+        for slices in self.key_slices:
+            key_index = {}
+            for seq in self.whitelist:
+                key_index.setdefault("".join([seq[x] for x in slices]), []).append(seq)
+            self.index.append(key_index)
+
+    def candidates(self, seq):
+        """
+        Return:
+        whitelist barcodes within n_mismatch of seq. Key: barcode, value: distance
+        """
+        hits = {}
+        for slices, key_index in zip(self.key_slices, self.index):
+            for bc in key_index.get("".join([seq[x] for x in slices]), ()):
+                if bc not in hits:
+                    distance = hamming(seq, bc)
+                    if distance <= self.n_mismatch:
+                        hits[bc] = distance
+        return hits
+
+    def lookup(self, seq):
+        """
+        Return:
+        (status, whitelist barcode). status is one of exact, corrected, ambiguous, no_match.
+        """
+        if seq in self.exact:
+            return EXACT, seq
+        if len(seq) != self.length:
+            return NO_MATCH, None
+        hits = self.candidates(seq)
+        if not hits:
+            return NO_MATCH, None
+        best = min(hits.values())
+        matched = [bc for bc, distance in hits.items() if distance == best]
+        if len(matched) > 1:
+            return AMBIGUOUS, None
+        return CORRECTED, matched[0]
+
+    def correct(self, seq):
+        """
+        Return:
+        corrected whitelist barcode, None if no match or ambiguous
+        """
+        return self.lookup(seq)[1]
+
+    def neighbours(self, alphabet="ACGTN"):
+        """
+        lookup of every sequence over the alphabet within n_mismatch of a whitelist barcode, computed from the
+        whitelist instead of looking up each sequence. Sequences of the alphabet not in it are no match.
+
+        Return:
+        dict. Key: sequence, value: (status, whitelist barcode)
+
+        >>> corrector = BarcodeCorrector(["AA", "CC"])
+        >>> corrector.neighbours("ACG")
+        {'AA': ('exact', 'AA'), 'CA': ('ambiguous', None), 'GA': ('corrected', 'AA'), 'AC': ('ambiguous', None), 'AG': ('corrected', 'AA'), 'CC': ('exact', 'CC'), 'GC': ('corrected', 'CC'), 'CG': ('corrected', 'CC')}
+        >>> all(corrector.lookup(seq) == x for seq, x in corrector.neighbours().items())
+        True
+        """
+        # whitelist barcodes within n_mismatch of each sequence, and their distance
+        hits = {}
+        for bc in self.whitelist:
+            for positions in itertools.combinations(range(self.length), self.n_mismatch):
+                for bases in itertools.product(alphabet, repeat=self.n_mismatch):
+                    seq = list(bc)
+                    for pos, base in zip(positions, bases):
+                        seq[pos] = base
+                    seq = "".join(seq)
+                    hits.setdefault(seq, {})[bc] = hamming(seq, bc)
+        out = {}
+        for seq, seq_hits in hits.items():
+            if seq in self.exact:
+                out[seq] = (EXACT, seq)
+                continue
+            best = min(seq_hits.values())
+            matched = [bc for bc, distance in seq_hits.items() if distance == best]
+            out[seq] = (AMBIGUOUS, None) if len(matched) > 1 else (CORRECTED, matched[0])
+        return out
@@ -0,0 +1,181 @@
+import hashlib
+import math
+from collections import Counter, defaultdict
+
+import barcode_correct
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality estimator. Relative standard error is about 1.04 / sqrt(2 ** p).
+
+    >>> hll = HyperLogLog()
+    >>> for i in range(20000):
+    ...     hll.add(str(i))
+    >>> abs(hll.count() - 20000) < 2000
+    True
+    """
+
+    def __init__(self, p=10):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        if isinstance(value, str):
+            value = value.encode()
+        h = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "little")
+        j = h & (self.m - 1)
+        rank = 64 - self.p - (h >> self.p).bit_length() + 1
+        if rank > self.registers[j]:
+            self.registers[j] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # small range correction
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+def well_r2_summary(length, quality):
+    """
+    Coarse summary of the R2 histograms of one well.
+
+    >>> well_r2_summary(Counter({50: 3, 20: 1}), Counter({30: 2, 36: 2}))
+    {'R2 Sampled Reads': 4, 'R2 Mean Length': 42.5, 'R2 Mean Quality': 33.0}
+    """
+    n = sum(length.values())
+    out = {"R2 Sampled Reads": n, "R2 Mean Length": round(sum(k * v for k, v in length.items()) / n, 1)}
+    if quality:
+        out["R2 Mean Quality"] = round(sum(k * v for k, v in quality.items()) / sum(quality.values()), 1)
+    return out
+
+
+class DemuxStats:
+    """
+    Streaming counters of the demultiplexing pass.
+
+    Reads are counted by barcode status(exact, corrected, ambiguous, no match) and whitelist barcode, which the routing
+    table already gives for each read, so a block only adds one count per route. Whitelist barcodes are assigned to
+    wells once in report.
+    R2 length and mean quality of routed reads are sampled for every sample_every-th read pair of each input file.
+    If umi_slice is set, UMI cardinality of routed reads is estimated with HyperLogLog.
+    Key of the histograms and HyperLogLog: whitelist barcode.
+    The report has the full histograms per sub-sample. Wells only get their sampled reads and mean R2 length and
+    quality, a histogram per well would make the json of a 384-well plate hundreds of times larger.
+    """
+
+    def __init__(self, sample_every=100, umi_slice=None):
+        self.sample_every = sample_every
+        self.umi_slice = umi_slice
+        self.reads = Counter()
+        self.length = defaultdict(Counter)
+        self.quality = defaultdict(Counter)
+        self.umi = {}
+
+    def add_reads(self, status, seq_bc, n):
+        """
+        seq_bc is None if status is ambiguous or no match
+        """
+        self.reads[(status, seq_bc)] += n
+
+    def add_sample(self, seq_bc, seq2, qual2):
+        """
+        seq2 and qual2 are str or bytes
+        """
+        self.length[seq_bc][len(seq2)] += 1
+        if qual2:
+            if isinstance(qual2, str):
+                qual2 = qual2.encode()
+            self.quality[seq_bc][round(sum(qual2) / len(qual2)) - 33] += 1
+
+    def add_umi(self, seq_bc, umi):
+        if seq_bc not in self.umi:
+            self.umi[seq_bc] = HyperLogLog()
+        self.umi[seq_bc].add(umi)
+
+    def merge(self, other):
+        self.reads.update(other.reads)
+        for seq_bc, hist in other.length.items():
+            self.length[seq_bc].update(hist)
+        for seq_bc, hist in other.quality.items():
+            self.quality[seq_bc].update(hist)
+        for seq_bc, hll in other.umi.items():
+            if seq_bc in self.umi:
+                self.umi[seq_bc].merge(hll)
+            else:
+                self.umi[seq_bc] = hll
+
+    def report(self, sub_bc):
+        """
+        Args:
+            sub_bc: output of split_fastq.get_all_bc
+
+        Return:
+        stats dict
+        """
+        well_of = {}
+        for sub_sample in sub_bc:
+            for seq_bc, well_num in sub_bc[sub_sample]["map"].items():
+                well_of[seq_bc] = (sub_sample, well_num)
+
+        status_reads = Counter()
+        not_in_split = 0
+        sub_dict = {}
+        for sub_sample in sub_bc:
+            sub_dict[sub_sample] = {
+                "Reads": 0,
+                "Exact Barcodes": 0,
+                "Corrected Barcodes": 0,
+                "Wells Detected": 0,
+                "R2 Length": Counter(),
+                "R2 Mean Quality": Counter(),
+                "well": {},
+            }
+        for (status, seq_bc), n in self.reads.items():
+            status_reads[status] += n
+            if seq_bc is None:
+                continue
+            if seq_bc not in well_of:
+                not_in_split += n
+                continue
+            sub_sample, well_num = well_of[seq_bc]
+            cur = sub_dict[sub_sample]
+            if well_num not in cur["well"]:
+                cur["well"][well_num] = {"Reads": 0, "Exact Barcodes": 0, "Corrected Barcodes": 0}
+            key = "Exact Barcodes" if status == barcode_correct.EXACT else "Corrected Barcodes"
+            for x in [cur, cur["well"][well_num]]:
+                x["Reads"] += n
+                x[key] += n
+
+        # sampled reads and UMI, once per whitelist barcode
+        for seq_bc, (sub_sample, well_num) in well_of.items():
+            cur = sub_dict[sub_sample]
+            length = self.length.get(seq_bc, {})
+            quality = self.quality.get(seq_bc, {})
+            cur["R2 Length"].update(length)
+            cur["R2 Mean Quality"].update(quality)
+            if length:
+                cur["well"][well_num].update(well_r2_summary(length, quality))
+            if seq_bc in self.umi:
+                cur["well"][well_num]["UMI Estimate"] = self.umi[seq_bc].count()
+        for cur in sub_dict.values():
+            cur["Wells Detected"] = len(cur["well"])
+            for hist in ["R2 Length", "R2 Mean Quality"]:
+                cur[hist] = {str(k): v for k, v in sorted(cur[hist].items())}
+
+        return {
+            "Raw Reads": sum(status_reads.values()),
+            "Exact Barcodes": status_reads[barcode_correct.EXACT],
+            "Corrected Barcodes": status_reads[barcode_correct.CORRECTED],
+            "Ambiguous Barcodes": status_reads[barcode_correct.AMBIGUOUS],
+            "Invalid Barcodes": status_reads[barcode_correct.NO_MATCH],
+            "Wells Not In Split": not_in_split,
+            "sub_sample": sub_dict,
+        }
@@ -0,0 +1,425 @@
+import gzip
+import os
+import sys
+from collections import OrderedDict
+from itertools import islice
+
+import utils
+
+try:
+    from isal import igzip as isal_igzip
+except ImportError:
+    isal_igzip = None
+
+COMPRESSION = ["none", "gzip", "bgzf"]
+
+
+def read_chunks(fq1_file, fq2_file, chunk_size, skip=0):
+    """
+    Args:
+        skip: number of read pairs to skip at the start of the files
+
+    Yield:
+        (R1 text, R2 text) of at most chunk_size read pairs
+    """
+    with utils.openfile(fq1_file) as fq1, utils.openfile(fq2_file) as fq2:
+        for _ in islice(zip(fq1, fq2), 4 * skip):
+            pass
+        while True:
+            lines1 = list(islice(fq1, 4 * chunk_size))
+            lines2 = list(islice(fq2, 4 * chunk_size))
+            if len(lines1) != len(lines2):
+                sys.exit(f'{fq1_file} and {fq2_file} do not have same read number!')
+            if not lines1:
+                break
+            yield "".join(lines1), "".join(lines2)
+
+
+class _RecordBuffer:
+    """
+    Bytes read from one fastq file that are not yet returned, and the number of newlines in them.
+    """
+
+    def __init__(self, f, path):
+        self.f = f
+        self.path = path
+        self.data = b""
+        self.lines = 0
+        self.eof = False
+        self.bytes_read = 0
+        self.records_read = 0
+
+    @property
+    def records(self):
+        return self.lines // 4
+
+    def fill(self, size):
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            if self.data and not self.data.endswith(b"\n"):
+                self.data += b"\n"
+                self.lines += 1
+            if self.lines % 4:
+                sys.exit(f"{self.path} is truncated, the number of lines is not a multiple of 4!")
+            return
+        self.data += chunk
+        self.lines += chunk.count(b"\n")
+        self.bytes_read += len(chunk)
+
+    def bytes_per_record(self):
+        return self.bytes_read / max(1, self.records_read + self.records)
+
+    def take(self, n):
+        """
+        Return:
+        bytes of the first n complete records
+        """
+        # number of newlines after the cut
+        k = self.lines - 4 * n
+        # walk back from the end when few lines are left, splitting creates an object per line
+        if k < 64 or k < n:
+            pos = len(self.data)
+            for _ in range(k + 1):
+                pos = self.data.rfind(b"\n", 0, pos)
+            cut = pos + 1
+        else:
+            cut = len(self.data) - len(self.data.split(b"\n", 4 * n)[-1])
+        block = self.data[:cut]
+        self.data = self.data[cut:]
+        self.lines = k
+        self.records_read += n
+        return block
+
+
+class RecordBlock:
+    """
+    Line offsets of a block of complete fastq records, found with numpy instead of splitting the block into a bytes
+    object per line. Fields are sliced from the block at these offsets.
+    Records are rewritten as the name up to the first whitespace, sequence, bare plus line and quality, as with
+    pysam.FastxFile, by joining a few slices of the block per record.
+
+    >>> records = RecordBlock(b"@r1 1:N\\nACGT\\n+r1\\nFFFF\\n@r2\\nTTG\\n+\\n::F\\n")
+    >>> records.n
+    2
+    >>> records.fields(1, slice(1, 4))
+    [b'CGT', b'TG']
+    >>> records.line(1, 3)
+    b'::F'
+    >>> records.join([1, 0])
+    b'@r2\\nTTG\\n+\\n::F\\n@r1\\nACGT\\n+\\nFFFF\\n'
+    """
+
+    def __init__(self, block):
+        np = utils.optional_import("numpy")
+        self.block = block
+        self.array = np.frombuffer(block, dtype=np.uint8)
+        # blocks end with a newline
+        ends = np.flatnonzero(self.array == ord("\n"))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        self.n = len(ends) // 4
+        # shape (n, 4): start and newline of the 4 lines of each record
+        self.starts = starts.reshape(-1, 4)
+        self.ends = ends.reshape(-1, 4)
+
+        name_end = self.ends[:, 0]
+        # whitespace of bytes.split() other than newline, only names and plus lines can have it
+        space = np.flatnonzero((self.array <= ord(" ")) & (self.array != ord("\n")))
+        space = space[np.isin(self.array[space], list(b" \t\r\x0b\x0c"))]
+        if len(space):
+            first = space[np.minimum(np.searchsorted(space, self.starts[:, 0]), len(space) - 1)]
+            name_end = np.where((first >= self.starts[:, 0]) & (first < name_end), first, name_end)
+        # name, newline + sequence + newline + "+", newline + quality + newline
+        pieces = [
+            [self.starts[:, 0], name_end],
+            [self.ends[:, 0], self.starts[:, 2] + 1],
+            [self.ends[:, 2], self.ends[:, 3] + 1],
+        ]
+        # pieces that are contiguous in every record are sliced at once, plain records are a single slice
+        merged = [pieces[0]]
+        for start, end in pieces[1:]:
+            if np.array_equal(merged[-1][1], start):
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        self.piece_starts = np.stack([x[0] for x in merged], axis=1)
+        self.piece_ends = np.stack([x[1] for x in merged], axis=1)
+
+    def line(self, i, k):
+        """
+        Return:
+        line k of record i without newline
+        """
+        return self.block[int(self.starts[i, k]):int(self.ends[i, k])]
+
+    def fields(self, k, field):
+        """
+        Slice every line k at once, clipped to the line end like bytes slicing.
+        Trailing NUL bytes of a field are dropped, they are not in valid fastq.
+
+        Args:
+            field: slice with start and stop
+
+        Return:
+        list of bytes
+        """
+        np = utils.optional_import("numpy")
+        width = field.stop - field.start
+        if width <= 0:
+            return [b""] * self.n
+        pos = self.starts[:, k, None] + field.start + np.arange(width)
+        values = self.array[np.minimum(pos, len(self.array) - 1)]
+        values[pos >= self.ends[:, k, None]] = 0
+        return values.view(f"S{width}").ravel().tolist()
+
+    def join(self, index):
+        """
+        Return:
+        fastq bytes of the records at index
+        """
+        starts = self.piece_starts[index].ravel().tolist()
+        ends = self.piece_ends[index].ravel().tolist()
+        return b"".join(map(self.block.__getitem__, map(slice, starts, ends)))
+
+
+def _first_name(block, start=0):
+    """
+    Name of the record at start, without comment and /1 or /2
+
+    >>> _first_name(b"@r1/1 1:N:0\\nACGT\\n+\\nFFFF\\n")
+    b'@r1'
+    """
+    name = block[start:block.find(b"\n", start)].split(None, 1)[0]
+    if name[-2:] in (b"/1", b"/2"):
+        name = name[:-2]
+    return name
+
+
+def _last_name(block):
+    """
+    >>> _last_name(b"@r1\\nACGT\\n+\\nFFFF\\n@r2/2\\nAC\\n+\\nFF\\n")
+    b'@r2'
+    >>> _last_name(b"@r1\\nACGT\\n+\\nFFFF\\n")
+    b'@r1'
+    """
+    # the block ends with the newline of the last quality line
+    pos = len(block) - 1
+    for _ in range(4):
+        pos = block.rfind(b"\n", 0, pos)
+    return _first_name(block, pos + 1)
+
+
+def read_pair_blocks(fq1_file, fq2_file, block_size=1 << 22, skip=0):
+    """
+    Read paired fastq files in large blocks of complete records, without parsing each record.
+    R2 is read ahead by its bytes per record, so that both blocks end at the same record.
+    The names of the first and the last read pair of each block are compared, which catches unpaired or unsorted
+    inputs, also when the files only get out of step inside a block.
+
+    Args:
+        skip: number of read pairs to skip at the start of the files
+
+    Yield:
+        (R1 bytes, R2 bytes, number of read pairs). Both blocks end with a newline.
+    """
+    with utils.openfile(fq1_file, "rb") as f1, utils.openfile(fq2_file, "rb") as f2:
+        buf1 = _RecordBuffer(f1, fq1_file)
+        buf2 = _RecordBuffer(f2, fq2_file)
+        while True:
+            if not buf1.eof:
+                buf1.fill(block_size)
+            while buf2.records < buf1.records and not buf2.eof:
+                missing = buf1.records - buf2.records
+                buf2.fill(max(1 << 16, int(missing * buf2.bytes_per_record() * 1.05) if buf2.bytes_read else block_size))
+            if buf2.eof and buf2.records < buf1.records:
+                sys.exit(f'{fq1_file} and {fq2_file} do not have same read number!')
+            n = buf1.records
+            if n == 0:
+                if not buf1.eof:
+                    continue
+                while not buf2.eof and not buf2.data:
+                    buf2.fill(1 << 16)
+                if buf1.data or buf2.data:
+                    sys.exit(f'{fq1_file} and {fq2_file} do not have same read number!')
+                break
+            if skip:
+                m = min(n, skip)
+                buf1.take(m)
+                buf2.take(m)
+                skip -= m
+                continue
+            block1 = buf1.take(n)
+            block2 = buf2.take(n)
+            for get_name in (_first_name, _last_name):
+                name1, name2 = get_name(block1), get_name(block2)
+                if name1 != name2:
+                    sys.exit(f"Read names of {fq1_file} and {fq2_file} do not match: {name1.decode()} {name2.decode()}")
+            yield block1, block2, n
+
+
+def gzip_compress(data, compresslevel=None):
+    """
+    Compress bytes into one gzip member. Concatenated members are a valid gzip file.
+    python-isal is used for compresslevel 0-3, zlib otherwise. Default compresslevel is 1.
+
+    >>> gzip.decompress(gzip_compress(b"@r1\\nACGT\\n") + gzip_compress(b"+\\nFFFF\\n", 6))
+    b'@r1\\nACGT\\n+\\nFFFF\\n'
+    """
+    level = 1 if compresslevel is None else compresslevel
+    if isal_igzip is not None and level <= 3:
+        return isal_igzip.compress(data, level)
+    return gzip.compress(data, level, mtime=0)
+
+
+class BufferedFile:
+    """
+    Write handle returned by FastqWriter.open. Records are kept in memory and flushed in large blocks.
+    """
+
+    def __init__(self, writer, path):
+        self.writer = writer
+        self.path = path
+        self.buffer = []
+        self.size = 0
+        self.started = False
+        self.records = 0
+
+    def write(self, data, records=1):
+        """
+        Args:
+            data: bytes of complete records
+        """
+        self.buffer.append(data)
+        self.size += len(data)
+        self.records += records
+        if self.size >= self.writer.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        handle = self.writer.get_handle(self)
+        handle.write(b"".join(self.buffer))
+        self.buffer = []
+        self.size = 0
+
+
+class FastqWriter:
+    """
+    Buffered writer for many fastq outputs.
+
+    Only max_open files are kept open at the same time. When the limit is reached, the least recently used
+    file is closed and reopened in append mode on its next flush.
+    Gzip output is written as concatenated gzip members, BGZF output as concatenated BGZF blocks, which are both valid.
+
+    Args:
+        compression: none, gzip or bgzf
+        compresslevel: gzip compression level
+        threads: gzip compression threads per file. 0 compresses in-process(python-isal/zlib), >0 uses pigz/igzip.
+        max_open: maximum number of open files
+        max_buffer: maximum number of buffered bytes over all files
+        block_size: maximum number of buffered bytes per file
+    """
+
+    def __init__(self, compression="none", compresslevel=None, threads=0, max_open=256, max_buffer=256 << 20, block_size=4 << 20):
+        if compression not in COMPRESSION:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.threads = threads
+        self.max_open = max(1, max_open)
+        self.max_buffer = max_buffer
+        self.block_size = block_size
+        self.buffer_size = block_size
+        self.files = []
+        self.handles = OrderedDict()
+
+    @property
+    def suffix(self):
+        return "" if self.compression == "none" else ".gz"
+
+    def open(self, path):
+        """
+        Register an output file. The file name should end with the compression suffix.
+
+        Return:
+        BufferedFile
+        """
+        f = BufferedFile(self, path)
+        self.files.append(f)
+        # bound the total buffered size
+        self.buffer_size = max(1 << 16, min(self.block_size, self.max_buffer // len(self.files)))
+        return f
+
+    def _open(self, path, mode):
+        if self.compression == "bgzf":
+            from pysam.libcbgzf import BGZFile
+
+            return BGZFile(path, mode)
+        if self.compression == "gzip":
+            from xopen import xopen
+
+            return xopen(path, mode, compresslevel=self.compresslevel, threads=self.threads, format="gz")
+        return open(path, mode)
+
+    def get_handle(self, f):
+        handle = self.handles.get(f.path)
+        if handle is not None:
+            self.handles.move_to_end(f.path)
+            return handle
+        if len(self.handles) >= self.max_open:
+            _, lru = self.handles.popitem(last=False)
+            lru.close()
+        mode = "ab" if f.started else "wb"
+        f.started = True
+        handle = self._open(f.path, mode)
+        self.handles[f.path] = handle
+        return handle
+
+    def checkpoint(self):
+        """
+        Flush all files and close all handles, so every output ends with a complete gzip member or BGZF block.
+
+        Return:
+        dict. Key: path of started file, value: {"size": bytes on disk, "records": records written}
+        """
+        for f in self.files:
+            f.flush()
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+        return {f.path: {"size": os.path.getsize(f.path), "records": f.records} for f in self.files if f.started}
+
+    def resume(self, state):
+        """
+        Continue from the return value of checkpoint. Bytes written after the checkpoint are truncated,
+        later writes are appended as new gzip members or BGZF blocks.
+
+        Return:
+        False if an output is missing or shorter than at the checkpoint
+        """
+        files = {f.path: f for f in self.files}
+        for path, info in state.items():
+            if path not in files or not os.path.exists(path) or os.path.getsize(path) < info["size"]:
+                return False
+        for path, info in state.items():
+            os.truncate(path, info["size"])
+            files[path].started = True
+            files[path].records = info["records"]
+        return True
+
+    def close(self):
+        for f in self.files:
+            f.flush()
+            # create empty output
+            if not f.started:
+                self.get_handle(f)
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,22 +1,92 @@
 #!/usr/bin/env python
 
+import argparse
 import collections
+import collections.abc
 import csv
-import gzip
 import os
 import re
 import sys
 
+import perf
+import utils
+
 PATTERN = re.compile(r'(\S+?)\s*"(.*?)"')
+# attribute of the form key "value". value has no quote or semicolon.
+ATTR_PATTERN = re.compile(r'\s*[^\s";]+\s*"[^";]*"\s*')
+ATTR_KEY_PATTERN = re.compile(r'[^\s";]+')
 gtf_row = collections.namedtuple("gtf_row", "seqname source feature start end score strand frame attributes")
 
 
-def generic_open(file_name, *args, **kwargs):
-    if file_name.endswith(".gz"):
-        file_obj = gzip.open(file_name, *args, **kwargs)
-    else:
-        file_obj = open(file_name, *args, **kwargs)
-    return file_obj
+class GtfAttributes(collections.abc.Mapping):
+    """
+    Read-only view of a GTF attribute field, parsed on demand.
+
+    get() of a key not in the field is a substring test. Otherwise the key is found by one compiled regex and
+    only the attributes containing the key are checked. Fields that are not of the form key "value"; fall back to
+    GtfParser.get_properties_dict. Results are the same as get_properties_dict: the last value of a duplicate key wins.
+
+    >>> attrs = GtfAttributes('gene_id "g1"; gene_biotype "lncRNA"; tag "a"; tag "b";')
+    >>> attrs.get("gene_biotype"), attrs.get("tag"), attrs.get("gene_name")
+    ('lncRNA', 'b', None)
+    >>> dict(GtfAttributes('gene_id "g1";;level 2; gene_name " A B "'))
+    {'gene_id': 'g1', 'gene_name': 'A B'}
+    """
+
+    key_patterns = {}
+
+    def __init__(self, properties_str):
+        self.properties_str = properties_str
+        self._properties = None
+
+    @classmethod
+    def key_pattern(cls, key):
+        if key not in cls.key_patterns:
+            cls.key_patterns[key] = re.compile(re.escape(key) + r'\s*"([^";]*)"')
+        return cls.key_patterns[key]
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            self._properties = GtfParser.get_properties_dict(self.properties_str)
+        return self._properties
+
+    def get(self, key, default=None):
+        if self._properties is not None:
+            return self._properties.get(key, default)
+        text = self.properties_str
+        if key not in text:
+            return default
+        if not ATTR_KEY_PATTERN.fullmatch(key):
+            return self.properties.get(key, default)
+        value = default
+        n = 0
+        for m in self.key_pattern(key).finditer(text):
+            i = m.start()
+            if i and not (text[i - 1].isspace() or text[i - 1] == ";"):
+                continue
+            start = text.rfind(";", 0, i) + 1
+            end = text.find(";", i)
+            if not ATTR_PATTERN.fullmatch(text, start, len(text) if end == -1 else end):
+                return self.properties.get(key, default)
+            value = m.group(1).strip()
+            n += 1
+        if n != text.count(key):
+            # key is also somewhere else, e.g. in a value
+            return self.properties.get(key, default)
+        return value
+
+    def __getitem__(self, key):
+        return self.properties[key]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        return iter(self.properties)
+
+    def __len__(self):
+        return len(self.properties)
 
 
 class GtfParser:
@@ -27,7 +97,8 @@ class GtfParser:
         self.id_name = {}
         self.id_strand = {}
 
-    def get_properties_dict(self, properties_str):
+    @staticmethod
+    def get_properties_dict(properties_str):
         """
         allow no space after semicolon
         """
@@ -47,13 +118,16 @@ class GtfParser:
 
         return properties
 
-    def gtf_reader_iter(self):
+    def gtf_reader_iter(self, lazy=False):
         """
+        Args:
+            lazy: if True, attributes is a GtfAttributes view parsed on demand
+
         Yield:
             row: list
             gtf_row
         """
-        with generic_open(self.gtf_fn, mode="rt") as f:
+        with utils.openfile(self.gtf_fn, mode="rt") as f:
             reader = csv.reader(f, delimiter="\t")
             for i, row in enumerate(reader, start=1):
                 if len(row) == 0:
@@ -77,63 +151,153 @@ class GtfParser:
                 score = row[5]
                 strand = row[6]
                 frame = row[7]
-                attributes = self.get_properties_dict(row[8])
+                attributes = GtfAttributes(row[8]) if lazy else self.get_properties_dict(row[8])
 
                 yield row, gtf_row(seqname, source, feature, start, end, score, strand, frame, attributes)
 
 
-def filter_gtf(gtf_fn, out_fn, allow):
+class Predicate:
+    """
+    One attribute rule of keep_attributes: [feature:]key OP values
+
+    OP is one of
+        =   value is one of the comma separated values
+        !=  value is not one of the comma separated values
+        ~   value matches the regex(re.search)
+        !~  value does not match the regex
+    The rule passes if the line does not have the key. With feature:, the rule only applies to that feature.
+
+    >>> p = Predicate("gene_biotype=protein_coding,lncRNA")
+    >>> p.passes({"gene_biotype": "lncRNA"}), p.passes({"gene_biotype": "snRNA"}), p.passes({})
+    (True, False, True)
+    >>> p = Predicate("transcript:gene_name!~^mt-")
+    >>> p.feature, p.passes({"gene_name": "mt-Co1"}), p.passes({"gene_name": "Actb"})
+    ('transcript', False, True)
+    """
+
+    PATTERN = re.compile(r"\s*(?:([^\s:=!~]+):)?([^\s:=!~]+)\s*(!?[=~])(.*)")
+
+    def __init__(self, rule):
+        m = self.PATTERN.fullmatch(rule)
+        if not m:
+            sys.exit(f"Invalid attribute rule: {rule}\n")
+        self.feature, self.key, self.op, value = m.groups()
+        self.negate = self.op.startswith("!")
+        if self.op.endswith("="):
+            values = set(value.split(","))
+            self.match = values.__contains__
+        else:
+            try:
+                self.match = re.compile(value).search
+            except re.error as e:
+                sys.exit(f"Invalid regex in attribute rule {rule}: {e}\n")
+
+    def passes(self, attributes):
+        value = attributes.get(self.key)
+        if value is None:
+            return True
+        return bool(self.match(value)) != self.negate
+
+
+def parse_attributes(attributes):
+    """
+    Args:
+        attributes: rules separated by semicolon. e.g. "gene_biotype=protein_coding,lncRNA;exon:tag!=CCDS"
+
+    Return:
+        Key: feature, None for rules of all features. value: list of Predicate
+    """
+    rules = collections.defaultdict(list)
+    for rule in attributes.split(";"):
+        if rule.strip():
+            predicate = Predicate(rule)
+            rules[predicate.feature].append(predicate)
+    return rules
+
+
+def passes(rules, feature, attributes):
+    return all(predicate.passes(attributes) for predicate in rules.get(feature, ()))
+
+
+def filter_gtf(gtf_fn, out_fn, rules, gene_level=False):
     """
     Filter attributes
 
     Args:
-        allow: {
-            "gene_biotype": set("protein_coding", "lncRNA")
-        }
+        rules: output of parse_attributes
+        gene_level: if False, every line is filtered by the rules of all features and the rules of its feature.
+            If True, genes and transcripts are kept or removed with all of their lines.
+            A gene is decided by the rules of all features and the gene: rules on the first line of its gene_id,
+            a transcript by the transcript: rules on the first line of its transcript_id.
+            The other lines also need to pass the rules of their own feature.
+            Only the decisions are kept in memory, one per gene and transcript.
+
+    Return:
+        number of lines filtered, number of genes filtered
     """
     sys.stderr.write("Writing GTF file...\n")
     gp = GtfParser(gtf_fn)
     n_filter = 0
+    gene_keep = {}
+    transcript_keep = {}
 
     with open(out_fn, "w") as f:
         # quotechar='' is not allowed since python3.11
         writer = csv.writer(f, delimiter="\t", quoting=csv.QUOTE_NONE, quotechar=None)
-        for row, grow in gp.gtf_reader_iter():
+        for row, grow in gp.gtf_reader_iter(lazy=True):
             if not grow:
                 writer.writerow(row)
                 continue
 
-            remove = False
-            if allow:
-                for key, value in grow.attributes.items():
-                    if key in allow and value not in allow[key]:
-                        remove = True
-                        break
+            attributes = grow.attributes
+            gene_id = attributes.get("gene_id") if gene_level else None
+            if gene_id is None:
+                keep = passes(rules, None, attributes) and passes(rules, grow.feature, attributes)
+            else:
+                keep = gene_keep.get(gene_id)
+                if keep is None:
+                    keep = gene_keep[gene_id] = passes(rules, None, attributes) and passes(rules, "gene", attributes)
+                transcript_id = attributes.get("transcript_id")
+                if keep and transcript_id is not None:
+                    keep = transcript_keep.get(transcript_id)
+                    if keep is None:
+                        keep = transcript_keep[transcript_id] = passes(rules, "transcript", attributes)
+                if keep and grow.feature not in ("gene", "transcript"):
+                    keep = passes(rules, grow.feature, attributes)
 
-            if not remove:
+            if keep:
                 writer.writerow(row)
             else:
                 n_filter += 1
-    return n_filter
+    n_gene_filter = sum(not keep for keep in gene_keep.values())
+    return n_filter, n_gene_filter
 
 
 if __name__ == "__main__":
-    # args: gtf, attributes
-    gtf_fn = sys.argv[1]
-    attributes = sys.argv[2]
-    out_fn = os.path.basename(gtf_fn).replace(".gtf", ".filtered.gtf")
-
-    allow = {}
-    for attr_str in attributes.split(";"):
-        if attr_str:
-            attr, val = attr_str.split("=")
-            val = set(val.split(","))
-            allow[attr] = val
-
-    n_filter = filter_gtf(gtf_fn, out_fn, allow)
+    parser = argparse.ArgumentParser(description="Filter GTF by attributes")
+    parser.add_argument("gtf", help="GTF file, can be compressed(gzip, bgzip, zstd, bzip2, xz)")
+    parser.add_argument("attributes", help="Attribute rules separated by semicolon. See Predicate for the syntax.")
+    parser.add_argument(
+        "--gene_level",
+        action="store_true",
+        help="Keep or remove whole genes and transcripts instead of single lines.",
+    )
+    args = parser.parse_args()
+    # output is not compressed
+    out_fn = re.sub(r"\.(gz|zst|bz2|xz)$", "", os.path.basename(args.gtf)).replace(".gtf", ".filtered.gtf")
+
+    gtf_perf = perf.Perf("filter_gtf")
+    rules = parse_attributes(args.attributes)
+    with gtf_perf.phase("filter"):
+        n_filter, n_gene_filter = filter_gtf(args.gtf, out_fn, rules, gene_level=args.gene_level)
+        gtf_perf.count("gtf_bytes", os.path.getsize(args.gtf))
+        gtf_perf.count("filtered_lines", n_filter)
     sys.stdout.write(f"Filtered {n_filter} lines\n")
     log_file = "gtf_filter.log"
     with open(log_file, "w") as f:
         f.write(f"Filtered lines: {n_filter}\n")
-        f.write(f"Attributes: {attributes}\n")
+        if args.gene_level:
+            f.write(f"Filtered genes: {n_gene_filter}\n")
+        f.write(f"Attributes: {args.attributes}\n")
         f.write(f"Output file: {out_fn}\n")
+    gtf_perf.write("filter_gtf.perf.json")
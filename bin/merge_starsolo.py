@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Merge the Solo.out of STARsolo runs on shards of one sample, see shard_fastq.py.
+
+Raw matrices of all shards have the same barcodes(the whitelist) and features, and every well is counted in only
+one shard, so the merged matrix is the sum of the shard matrices and equals the matrix of a single run.
+CellReads.stats rows are summed by barcode.
+In Summary.csv, "Number of Reads" is summed, the fractions of reads are averaged weighted by the number of reads,
+and "Sequencing Saturation" is computed from the merged CellReads.stats. Cell calling rows are left out, cells
+called per shard do not add up.
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+
+import perf
+import utils
+import well_matrix
+
+logger = utils.get_logger(__name__)
+
+SATURATION = "Sequencing Saturation"
+# first row about called cells
+CELL_ROWS_START = "Estimated Number of Cells"
+
+
+def mtx_banner(mtx_file):
+    """
+    Header lines before the size line
+    """
+    lines = []
+    with utils.openfile(mtx_file) as f:
+        for line in f:
+            if not line.startswith("%"):
+                return lines
+            lines.append(line)
+    return lines
+
+
+def merge_mtx(mtx_files, out_file):
+    """
+    Sum matrices of the same shape.
+
+    Return:
+    number of non-zero entries
+    """
+    shapes = set()
+    rows, cols, values = [], [], []
+    for fn in mtx_files:
+        data, indices, indptr, shape = well_matrix.read_mtx(fn, real_dtype=np.float64)
+        shapes.add(shape)
+        rows.append(indices)
+        cols.append(np.repeat(np.arange(shape[1], dtype=np.int32), np.diff(indptr)))
+        values.append(data)
+    if len(shapes) != 1:
+        sys.exit(f"Matrices do not have the same shape: {mtx_files}")
+    n_row, n_col = shapes.pop()
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    values = np.concatenate(values)
+    keys = cols.astype(np.int64) * n_row + rows
+    keys, inverse = np.unique(keys, return_inverse=True)
+    summed = np.zeros(len(keys), dtype=np.float64 if values.dtype.kind == "f" else np.int64)
+    np.add.at(summed, inverse, values)
+
+    field = "real" if values.dtype.kind == "f" else "integer"
+    with open(out_file, "w") as f:
+        f.writelines(mtx_banner(mtx_files[0]))
+        f.write(f"{n_row} {n_col} {len(keys)}\n")
+        # MatrixMarket is 1-based, sorted by column like STARsolo
+        table = np.column_stack([keys % n_row + 1, keys // n_row + 1, summed])
+        np.savetxt(f, table, fmt="%d %d %d" if field == "integer" else "%d %d %.10g")
+    return len(keys)
+
+
+def merge_read_stats(read_stats_files, out_file):
+    """
+    Sum CellReads.stats rows by barcode, in order of first appearance.
+
+    Return:
+    per barcode rows {CB: [int, ...]}, header
+    """
+    merged = {}
+    header = None
+    for fn in read_stats_files:
+        with utils.openfile(fn) as f:
+            this_header = f.readline()
+            if header is None:
+                header = this_header
+            elif this_header != header:
+                sys.exit(f"Columns of {fn} differ from {read_stats_files[0]}")
+            for line in f:
+                cb, *values = line.rstrip("\n").split("\t")
+                values = [int(x) for x in values]
+                if cb in merged:
+                    merged[cb] = [a + b for a, b in zip(merged[cb], values)]
+                else:
+                    merged[cb] = values
+    with open(out_file, "w") as f:
+        f.write(header)
+        for cb, values in merged.items():
+            f.write(cb + "\t" + "\t".join(map(str, values)) + "\n")
+    return merged, header.rstrip("\n").split("\t")
+
+
+def merge_summary(summary_files, out_file, read_stats=None):
+    """
+    Args:
+        read_stats: return value of merge_read_stats, to compute the sequencing saturation
+    """
+    rows = [utils.csv2dict(fn) for fn in summary_files]
+    reads = [int(x["Number of Reads"]) for x in rows]
+    total = sum(reads)
+    out = {}
+    for key in rows[0]:
+        if key == CELL_ROWS_START:
+            break
+        if key == "Number of Reads":
+            out[key] = str(total)
+        elif key == SATURATION and read_stats:
+            merged, header = read_stats
+            umi_col, read_col = header.index("nUMIunique") - 1, header.index("countedU") - 1
+            umi = sum(values[umi_col] for cb, values in merged.items() if cb != "CBnotInPasslist")
+            counted = sum(values[read_col] for cb, values in merged.items() if cb != "CBnotInPasslist")
+            out[key] = f"{1 - umi / counted if counted else 0:.6f}"
+        else:
+            weighted = sum(float(x.get(key, 0)) * n for x, n in zip(rows, reads))
+            out[key] = f"{weighted / total if total else 0:.6f}"
+    with open(out_file, "w") as f:
+        for key, value in out.items():
+            f.write(f"{key},{value}\n")
+    return out
+
+
+def read_lines(fn):
+    with utils.openfile(fn) as f:
+        return f.readlines()
+
+
+def raw_file(raw_dir, name):
+    """
+    STARSOLO gzips the raw matrix of GeneFull_Ex50pAS
+    """
+    return os.path.join(raw_dir, name) if os.path.exists(os.path.join(raw_dir, name)) else os.path.join(raw_dir, name + ".gz")
+
+
+def merge_raw(raw_dirs, out_raw):
+    """
+    Merge the raw matrix directories of one feature, e.g. GeneFull_Ex50pAS.
+    Output files are not compressed.
+    """
+    os.makedirs(out_raw, exist_ok=True)
+    for fn in ["barcodes.tsv", "features.tsv"]:
+        lines = read_lines(raw_file(raw_dirs[0], fn))
+        for raw_dir in raw_dirs[1:]:
+            if read_lines(raw_file(raw_dir, fn)) != lines:
+                sys.exit(f"{fn} of {raw_dir} differs from {raw_dirs[0]}")
+        with open(os.path.join(out_raw, fn), "w") as f:
+            f.writelines(lines)
+    names = sorted(os.path.basename(x).removesuffix(".gz") for x in glob.glob(os.path.join(raw_dirs[0], "*.mtx*")))
+    for name in names:
+        nnz = merge_mtx([raw_file(x, name) for x in raw_dirs], os.path.join(out_raw, name))
+        logger.info(f"{out_raw}/{name}: {nnz} non-zero entries")
+
+
+def merge_stats(dirs, out_dir):
+    """
+    Merge CellReads.stats and Summary.csv if all shards have them.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    read_stats = None
+    if all(os.path.exists(os.path.join(x, "CellReads.stats")) for x in dirs):
+        read_stats = merge_read_stats([os.path.join(x, "CellReads.stats") for x in dirs], os.path.join(out_dir, "CellReads.stats"))
+    if all(os.path.exists(os.path.join(x, "Summary.csv")) for x in dirs):
+        merge_summary([os.path.join(x, "Summary.csv") for x in dirs], os.path.join(out_dir, "Summary.csv"), read_stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the Solo.out of STARsolo runs on shards of one sample")
+    parser.add_argument("--sample", required=True)
+    parser.add_argument("--solo_out", required=True, nargs="+", help="Solo.out directories of the shards.")
+    parser.add_argument("--matrix", nargs="+", help="Matrix directories of the shards, in the same order as --solo_out. The raw matrix of GeneFull_Ex50pAS is moved there by STARSOLO.")
+    args = parser.parse_args()
+    if args.matrix and len(args.matrix) != len(args.solo_out):
+        sys.exit("--matrix and --solo_out do not have the same number of shards!")
+
+    merge_perf = perf.Perf("merge_starsolo", args.sample)
+    out_dir = f"{args.sample}.Solo.out"
+    with merge_perf.phase("merge"):
+        for feature in sorted(os.listdir(args.solo_out[0])):
+            dirs = [os.path.join(x, feature) for x in args.solo_out]
+            if not os.path.isdir(dirs[0]):
+                continue
+            if os.path.isdir(os.path.join(dirs[0], "raw")):
+                merge_raw([os.path.join(x, "raw") for x in dirs], os.path.join(out_dir, feature, "raw"))
+            merge_stats(dirs, os.path.join(out_dir, feature))
+        if args.matrix:
+            merge_raw([os.path.join(x, "raw") for x in args.matrix], f"{args.sample}.matrix/raw")
+    merge_perf.write(f"{args.sample}.bulk_rna.merge_starsolo.perf.json")
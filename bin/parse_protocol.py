@@ -93,3 +93,31 @@ def get_mismatch_dict(seq_list, n_mismatch=1):
         for mismatch_seq in findall_mismatch(seq, n_mismatch):
             mismatch_dict[mismatch_seq] = seq
     return mismatch_dict
+
+
+def get_pattern_whitelist(protocol, assets_dir, well=384, pattern=None, whitelist=None):
+    """
+    Pattern and whitelist of the barcode read used by STARsolo.
+
+    Return:
+    pattern, whitelist_str. Multiple whitelists are separated by whitespace, "None" if no whitelist.
+
+    >>> get_pattern_whitelist("AccuraCode-V1", "./assets/", well=96)[0]
+    'C9U12'
+    """
+    if protocol == 'customized':
+        whitelist_str = whitelist
+    else:
+        protocol_dict = get_protocol_dict(assets_dir)
+        whitelist_str = None
+        if protocol == 'AccuraCode-V1':
+            if whitelist:
+                whitelist_str = whitelist
+            elif well == 96:
+                whitelist_str = protocol_dict[protocol].get("well96", [])
+            else:
+                whitelist_str = protocol_dict[protocol].get("well384", [])
+        pattern = protocol_dict[protocol]["pattern"]
+    if not whitelist_str:
+        whitelist_str = whitelist if whitelist else "None"
+    return pattern, whitelist_str
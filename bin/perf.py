@@ -0,0 +1,161 @@
+"""
+Performance telemetry of bin scripts.
+
+Scripts time named phases, count records and bytes, and write a *.perf.json that the multiqc_sgr plugin shows
+in the Performance section.
+
+    perf = Perf("split_fastq", sample)
+    with perf.phase("demux"):
+        ...
+        perf.count("reads", n)
+    perf.write(f"{sample}.bulk_rna.split_fastq.perf.json")
+
+The SGR_PERF environment variable turns on extra telemetry, comma separated:
+    cprofile  profile the whole script with cProfile. The profile is written next to the perf.json as *.prof,
+              and the slowest functions are added to the perf.json.
+    markers   log the start and end of every phase with the unix time, to line up phases with a py-spy record.
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import utils
+
+ENV = "SGR_PERF"
+# number of functions of the cProfile in perf.json
+PROFILE_TOP = 20
+
+logger = utils.get_logger(__name__)
+
+
+def peak_rss_mb(who="self"):
+    """
+    Peak resident set size in MB of this process(self) or of its waited-for child processes(children).
+    None if the platform does not have the resource module.
+    """
+    resource = utils.optional_import("resource")
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KB on Linux, in bytes on macOS
+    scale = 1 << 20 if sys.platform == "darwin" else 1 << 10
+    return round(usage.ru_maxrss / scale, 1)
+
+
+def _rates(counters, seconds):
+    return {f"{key}_per_s": round(value / seconds, 1) for key, value in counters.items() if seconds > 0}
+
+
+class Perf:
+    """
+    Args:
+        script: script name
+        sample: sample name, None for scripts that are not run per sample
+        options: SGR_PERF options, read from the environment by default
+    """
+
+    def __init__(self, script, sample=None, options=None):
+        self.script = script
+        self.sample = sample
+        if options is None:
+            options = os.environ.get(ENV, "")
+        self.options = {x.strip() for x in options.split(",") if x.strip()}
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.phases = {}
+        self.counters = {}
+        self.stack = []
+        self.profiler = None
+        if "cprofile" in self.options:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase. Phases can be nested, a nested phase is named outer/inner.
+        Counts during a phase are added to the phase, to the phases it is nested in and to the total.
+        A phase entered again, e.g. once per input file, is summed.
+        """
+        full_name = "/".join([*self.stack, name])
+        stats = self.phases.setdefault(full_name, {"wall_time": 0.0, "cpu_time": 0.0, "calls": 0, "counters": {}})
+        self.stack.append(name)
+        if "markers" in self.options:
+            logger.info(f"perf phase start {self.script} {full_name} {time.time():.3f}")
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield self
+        finally:
+            stats["wall_time"] += time.perf_counter() - start
+            stats["cpu_time"] += time.process_time() - cpu_start
+            stats["calls"] += 1
+            stats["peak_rss_mb"] = peak_rss_mb()
+            self.stack.pop()
+            if "markers" in self.options:
+                logger.info(f"perf phase end {self.script} {full_name} {time.time():.3f}")
+
+    def count(self, key, n=1):
+        """
+        Add n to a counter, e.g. reads or bytes, of the current phase, of the outer phases and of the total.
+
+        >>> perf = Perf("test", options="")
+        >>> with perf.phase("outer"):
+        ...     with perf.phase("inner"):
+        ...         perf.count("reads", 2)
+        >>> perf.phases["outer"]["counters"], perf.phases["outer/inner"]["counters"], perf.counters
+        ({'reads': 2}, {'reads': 2}, {'reads': 2})
+        """
+        self.counters[key] = self.counters.get(key, 0) + n
+        for i in range(1, len(self.stack) + 1):
+            counters = self.phases["/".join(self.stack[:i])]["counters"]
+            counters[key] = counters.get(key, 0) + n
+
+    def report(self):
+        wall_time = time.perf_counter() - self.start
+        phases = {}
+        for name, stats in self.phases.items():
+            phases[name] = {
+                "wall_time": round(stats["wall_time"], 3),
+                "cpu_time": round(stats["cpu_time"], 3),
+                "calls": stats["calls"],
+                "peak_rss_mb": stats.get("peak_rss_mb"),
+                **stats["counters"],
+                **_rates(stats["counters"], stats["wall_time"]),
+            }
+        return {
+            "script": self.script,
+            "sample": self.sample,
+            "wall_time": round(wall_time, 3),
+            "cpu_time": round(time.process_time() - self.cpu_start, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "children_peak_rss_mb": peak_rss_mb("children"),
+            "cpus": utils.available_cpus(),
+            "python": ".".join(map(str, sys.version_info[:3])),
+            "counters": {**self.counters, **_rates(self.counters, wall_time)},
+            "phases": phases,
+        }
+
+    def write(self, fn):
+        """
+        Write the report to fn. With cprofile, the profile is written to fn with .perf.json replaced by .prof.
+        """
+        data = self.report()
+        if self.profiler is not None:
+            import pstats
+
+            self.profiler.disable()
+            prof_fn = fn[: -len(".perf.json")] + ".prof" if fn.endswith(".perf.json") else fn + ".prof"
+            self.profiler.dump_stats(prof_fn)
+            stats = pstats.Stats(self.profiler).sort_stats("cumulative")
+            data["profile"] = {"file": prof_fn, "functions": []}
+            for func in stats.fcn_list[:PROFILE_TOP]:
+                calls, _, tottime, cumtime, _ = stats.stats[func]
+                data["profile"]["functions"].append(
+                    {"function": pstats.func_std_string(func), "calls": calls, "tottime": round(tottime, 3), "cumtime": round(cumtime, 3)}
+                )
+        utils.write_json(data, fn)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import argparse
+import multiprocessing
+import sys
+from collections import Counter, deque
+
+import barcode_correct
+import fastq_io
+import parse_protocol
+import utils
+
+logger = utils.get_logger(__name__)
+
+_corrector = None
+_bc_slice = slice(0, 0)
+_compresslevel = None
+_keep_removed = False
+_status_cache = {}
+
+
+def init_worker(corrector, bc_slice, compresslevel, keep_removed):
+    global _corrector, _bc_slice, _compresslevel, _keep_removed
+    _corrector = corrector
+    _bc_slice = bc_slice
+    _compresslevel = compresslevel
+    _keep_removed = keep_removed
+
+
+def filter_chunk(chunk, max_cache=1 << 20):
+    """
+    Filter one chunk of read pairs by the barcode in R1. Records are kept unchanged.
+
+    Args:
+        chunk: (R1 text, R2 text)
+
+    Return:
+    gzip member of kept R1, kept R2, removed R1 and removed R2(None if not keep_removed)
+    Counter of barcode status
+    """
+    lines1 = chunk[0].split("\n")
+    lines2 = chunk[1].split("\n")
+    corrector = _corrector
+    bc_slice = _bc_slice
+    cache = _status_cache
+    status_count = Counter()
+    kept1, kept2, removed1, removed2 = [], [], [], []
+    for i in range(0, len(lines1) - 1, 4):
+        temp_bc = lines1[i + 1][bc_slice]
+        status = cache.get(temp_bc)
+        if status is None:
+            status = corrector.lookup(temp_bc)[0]
+            if len(cache) < max_cache:
+                cache[temp_bc] = status
+        status_count[status] += 1
+        if status == barcode_correct.EXACT or status == barcode_correct.CORRECTED:
+            kept1.extend(lines1[i:i + 4])
+            kept2.extend(lines2[i:i + 4])
+        elif _keep_removed:
+            removed1.extend(lines1[i:i + 4])
+            removed2.extend(lines2[i:i + 4])
+
+    def compress(lines):
+        if not lines:
+            return b""
+        lines.append("")
+        return fastq_io.gzip_compress("\n".join(lines).encode(), _compresslevel)
+
+    out = [compress(kept1), compress(kept2)]
+    out += [compress(removed1), compress(removed2)] if _keep_removed else [None, None]
+    return out, status_count
+
+
+class Prefilter:
+    def __init__(self, args):
+        self.args = args
+        self.fq1_list = args.fq1.split(",")
+        self.fq2_list = args.fq2.split(",")
+        if len(self.fq1_list) != len(self.fq2_list):
+            sys.exit('fastq1 and fastq2 do not have same file number!')
+
+        # same barcode definition as protocol_cmd
+        pattern, whitelist_str = parse_protocol.get_pattern_whitelist(
+            args.protocol, args.assets_dir, args.well, args.pattern, args.whitelist
+        )
+        pattern_dict = parse_protocol.parse_pattern(pattern)
+        if len(pattern_dict["C"]) != 1:
+            sys.exit("Barcode prefilter only accepts one barcode position(CB_UMI_Simple)!")
+        if whitelist_str == "None" or " " in whitelist_str.strip():
+            sys.exit("Barcode prefilter requires exactly one whitelist!")
+        self.bc_slice = pattern_dict["C"][0]
+        # STARsolo --soloCBmatchWLtype 1MM
+        self.corrector = barcode_correct.BarcodeCorrector(utils.read_one_col(whitelist_str), n_mismatch=1)
+
+        prefix = args.sample
+        self.out_fq = [f"{prefix}_prefilter_R1.fastq.gz", f"{prefix}_prefilter_R2.fastq.gz"]
+        self.removed_fq = [f"{prefix}_removed_R1.fastq.gz", f"{prefix}_removed_R2.fastq.gz"]
+        self.stats_file = f"{prefix}.bulk_rna.prefilter.stats.json"
+
+    def run(self):
+        init_args = (self.corrector, self.bc_slice, self.args.compresslevel, self.args.keep_removed)
+        out_files = [open(fn, "wb") for fn in self.out_fq]
+        if self.args.keep_removed:
+            out_files += [open(fn, "wb") for fn in self.removed_fq]
+        status_count = Counter()
+
+        def write_out(result):
+            blocks, chunk_count = result
+            for f, block in zip(out_files, blocks):
+                f.write(block)
+            status_count.update(chunk_count)
+
+        if self.args.threads > 1:
+            with multiprocessing.Pool(self.args.threads, initializer=init_worker, initargs=init_args) as pool:
+                # bound the number of chunks in memory
+                pending = deque()
+                for fq1, fq2 in zip(self.fq1_list, self.fq2_list):
+                    for chunk in fastq_io.read_chunks(fq1, fq2, self.args.chunk_size):
+                        if len(pending) >= 2 * self.args.threads:
+                            write_out(pending.popleft().get())
+                        pending.append(pool.apply_async(filter_chunk, (chunk,)))
+                while pending:
+                    write_out(pending.popleft().get())
+        else:
+            init_worker(*init_args)
+            for fq1, fq2 in zip(self.fq1_list, self.fq2_list):
+                for chunk in fastq_io.read_chunks(fq1, fq2, self.args.chunk_size):
+                    write_out(filter_chunk(chunk))
+        for f in out_files:
+            f.close()
+
+        total = sum(status_count.values())
+        removed = status_count[barcode_correct.AMBIGUOUS] + status_count[barcode_correct.NO_MATCH]
+        logger.info(f"Removed {removed} of {total} read pairs")
+        data_dict = {
+            "Prefilter Reads": total,
+            "Prefilter Removed Reads": removed,
+            "Prefilter Removed Fraction": utils.get_frac(removed / total) if total else 0.0,
+            "Prefilter Exact Barcodes": status_count[barcode_correct.EXACT],
+            "Prefilter Corrected Barcodes": status_count[barcode_correct.CORRECTED],
+            "Prefilter Ambiguous Barcodes": status_count[barcode_correct.AMBIGUOUS],
+            "Prefilter Invalid Barcodes": status_count[barcode_correct.NO_MATCH],
+        }
+        utils.write_json(data_dict, self.stats_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Remove read pairs whose barcode can not be matched to the whitelist within 1 mismatch before STARsolo"
+    )
+    parser.add_argument('--sample', required=True)
+    parser.add_argument('--fq1', required=True)
+    parser.add_argument('--fq2', required=True)
+    parser.add_argument('--assets_dir', required=True)
+    parser.add_argument('--protocol', required=True)
+    parser.add_argument('--well', type=int, default=384)
+    parser.add_argument("--whitelist")
+    parser.add_argument("--pattern")
+    parser.add_argument('--keep_removed', action='store_true',
+        help='Write removed read pairs to {sample}_removed_R1/R2.fastq.gz.'
+    )
+    parser.add_argument('--threads', type=int, default=1,
+        help='Number of processes. Each process filters and compresses chunks of read pairs.'
+    )
+    parser.add_argument('--chunk_size', type=int, default=100000,
+        help='Number of read pairs per chunk.'
+    )
+    parser.add_argument('--compresslevel', type=int,
+        help='gzip compression level of the output. Default 1.'
+    )
+    args = parser.parse_args()
+
+    runner = Prefilter(args)
+    runner.run()
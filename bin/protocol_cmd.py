@@ -3,6 +3,7 @@ import sys
 import argparse
 
 import parse_protocol
+import perf
 import utils
 
 logger = utils.get_logger(__name__)
@@ -21,24 +22,10 @@ class Starsolo:
         if str(fq1_list[0]).endswith('.gz'):
             self.read_command = 'zcat'
         
-        if args.protocol == 'customized':
-            pattern = args.pattern
-            whitelist_str = args.whitelist
-        else:
-            protocol = args.protocol
-            protocol_dict = parse_protocol.get_protocol_dict(args.assets_dir)
-            if protocol == 'AccuraCode-V1':
-                if args.whitelist:
-                    whitelist_str = args.whitelist
-                elif args.well == 96:
-                    whitelist_str = protocol_dict[protocol].get("well96", [])
-                else:
-                    whitelist_str = protocol_dict[protocol].get("well384", [])
-            pattern = protocol_dict[protocol]["pattern"]
-        
+        pattern, whitelist_str = parse_protocol.get_pattern_whitelist(
+            args.protocol, args.assets_dir, args.well, args.pattern, args.whitelist
+        )
         pattern_args = Starsolo.get_solo_pattern(pattern)
-        if not whitelist_str:
-            whitelist_str = args.whitelist if args.whitelist else "None"
         self.cb_umi_args = pattern_args + f' --soloCBwhitelist {whitelist_str} '
 
         # out cmd
@@ -87,7 +74,8 @@ class Starsolo:
 
     def write_stats(self, assay):
         fn = f"{self.args.sample}.{assay}.protocol.stats.json"
-        utils.write_json({"Protocol": self.args.protocol}, fn)
+        # plate size for the plate heatmaps of the MultiQC report
+        utils.write_json({"Protocol": self.args.protocol, "Plate Wells": self.args.well}, fn)
 
 if __name__ == "__main__":
     """
@@ -107,6 +95,10 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
 
-    runner = Starsolo(args)
-    runner.write_cmd()
-    runner.write_stats("bulk_rna")
+    cmd_perf = perf.Perf("protocol_cmd", args.sample)
+    with cmd_perf.phase("pattern"):
+        runner = Starsolo(args)
+    with cmd_perf.phase("write"):
+        runner.write_cmd()
+        runner.write_stats("bulk_rna")
+    cmd_perf.write(f"{args.sample}.bulk_rna.protocol_cmd.perf.json")
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+Sequencing saturation and downsampling curves per well, from the CB/UB/GX tagged BAM of STARsolo in one pass.
+
+Reads are counted per molecule(well, gene, UMI). Downsampling keeps each read with probability p, so a molecule with
+c reads is still detected with probability 1-(1-p)^c, and a gene with c reads in a well likewise. The expected UMI and
+gene number of each well at every fraction follow from the read counts, without reading the BAM again.
+
+Molecules are kept as packed integers in numpy arrays: well index, gene index and the UMI in 2 bits per base(hashed
+with blake2b if it is longer than 31 bases or has other bases, so the counts do not depend on PYTHONHASHSEED). Every
+--chunk_size reads, the read buffer is sorted on its own and merged into the sorted molecule counts, so memory scales
+with the number of molecules and the molecules counted so far are not sorted again.
+Several BAM files of one sample, e.g. from --starsolo_shards, are counted together.
+"""
+
+import argparse
+import hashlib
+import statistics
+import sys
+from array import array
+
+import numpy as np
+
+import perf
+import starsolo_summary
+import utils
+
+logger = utils.get_logger(__name__)
+
+FRACTIONS = [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+UMI_TABLE = str.maketrans("ACGT", "0123")
+UMI_DIGITS = set("0123")
+MAX_PACKED_UMI = 31
+HASHED = 1 << 63
+
+
+def pack_umi(umi):
+    """
+    >>> pack_umi("AACT"), pack_umi("T" * 31) == 4 ** 31 - 1, pack_umi("ANCT") >= HASHED
+    (7, True, True)
+    >>> hex(pack_umi("ANCT"))
+    '0xf37ba94dc2b12de0'
+    """
+    digits = umi.translate(UMI_TABLE)
+    if len(umi) <= MAX_PACKED_UMI and set(digits) <= UMI_DIGITS:
+        return int(digits, 4)
+    # stable across processes, unlike hash()
+    digest = hashlib.blake2b(umi.encode(), digest_size=8).digest()
+    return HASHED | (int.from_bytes(digest, "little") & (HASHED - 1))
+
+
+def reduce_counts(wells, genes, umis, counts):
+    """
+    Sum counts of the same (well, gene, umi), sorted by well, gene, umi.
+
+    >>> reduce_counts(np.array([1, 0, 1]), np.array([2, 2, 2]), np.array([5, 5, 5]), np.array([1, 1, 2]))
+    (array([0, 1]), array([2, 2]), array([5, 5]), array([1, 3]))
+    """
+    if len(wells) == 0:
+        return wells, genes, umis, counts
+    order = np.lexsort((umis, genes, wells))
+    wells, genes, umis, counts = wells[order], genes[order], umis[order], counts[order]
+    new = np.ones(len(wells), dtype=bool)
+    new[1:] = (wells[1:] != wells[:-1]) | (genes[1:] != genes[:-1]) | (umis[1:] != umis[:-1])
+    starts = np.flatnonzero(new)
+    return wells[starts], genes[starts], umis[starts], np.add.reduceat(counts, starts)
+
+
+def merge_counts(a, b):
+    """
+    Merge two molecule tables of reduce_counts, summing the counts of molecules in both.
+
+    Each molecule of b is located in a with a binary search on (well, gene) and then on the UMI within the run of its
+    (well, gene), so a is only copied, not sorted again.
+
+    >>> a = (np.array([0, 0, 1]), np.array([2, 2, 0]), np.array([1, 5, 3]), np.array([1, 1, 4]))
+    >>> b = (np.array([0, 0, 2]), np.array([2, 2, 0]), np.array([3, 5, 0]), np.array([2, 2, 1]))
+    >>> [x.tolist() for x in merge_counts(a, b)]
+    [[0, 0, 0, 1, 2], [2, 2, 2, 0, 0], [1, 3, 5, 3, 0], [1, 2, 3, 4, 1]]
+    """
+    a_wells, a_genes, a_umis, a_counts = a
+    b_wells, b_genes, b_umis, b_counts = b
+    if len(a_wells) == 0:
+        return b
+    a_key = (a_wells.astype(np.uint64) << np.uint64(32)) | a_genes.astype(np.uint64)
+    b_key = (b_wells.astype(np.uint64) << np.uint64(32)) | b_genes.astype(np.uint64)
+    lo = np.searchsorted(a_key, b_key, side="left")
+    hi = np.searchsorted(a_key, b_key, side="right")
+    # first position in the (well, gene) run with a UMI not less than the UMI of b
+    last = len(a_umis) - 1
+    while True:
+        active = lo < hi
+        if not active.any():
+            break
+        mid = (lo + hi) // 2
+        right = active & (a_umis[np.minimum(mid, last)] < b_umis)
+        lo = np.where(right, mid + 1, lo)
+        hi = np.where(active & ~right, mid, hi)
+    found = np.minimum(lo, last)
+    same = (lo <= last) & (a_key[found] == b_key) & (a_umis[found] == b_umis)
+    # molecules of b are unique, so each position is added once
+    counts = a_counts.copy()
+    counts[lo[same]] += b_counts[same]
+    new = ~same
+    pos = lo[new]
+    return (
+        np.insert(a_wells, pos, b_wells[new]),
+        np.insert(a_genes, pos, b_genes[new]),
+        np.insert(a_umis, pos, b_umis[new]),
+        np.insert(counts, pos, b_counts[new]),
+    )
+
+
+class MoleculeCounter:
+    """
+    Reads per molecule, added one read at a time.
+    """
+
+    def __init__(self, chunk_size=5000000):
+        self.chunk_size = chunk_size
+        self.well_index = {}
+        self.gene_index = {}
+        self.buffer = (array("I"), array("I"), array("Q"))
+        self.wells = np.empty(0, dtype=np.uint32)
+        self.genes = np.empty(0, dtype=np.uint32)
+        self.umis = np.empty(0, dtype=np.uint64)
+        self.counts = np.empty(0, dtype=np.uint32)
+
+    def add(self, cb, umi, gene):
+        well = self.well_index.setdefault(cb, len(self.well_index))
+        self.buffer[0].append(well)
+        self.buffer[1].append(self.gene_index.setdefault(gene, len(self.gene_index)))
+        self.buffer[2].append(pack_umi(umi))
+        if len(self.buffer[0]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        n = len(self.buffer[0])
+        if n == 0:
+            return
+        chunk = reduce_counts(
+            np.frombuffer(self.buffer[0], dtype=np.uint32),
+            np.frombuffer(self.buffer[1], dtype=np.uint32),
+            np.frombuffer(self.buffer[2], dtype=np.uint64),
+            np.ones(n, dtype=np.uint32),
+        )
+        self.wells, self.genes, self.umis, self.counts = merge_counts(
+            (self.wells, self.genes, self.umis, self.counts), chunk
+        )
+        self.buffer = (array("I"), array("I"), array("Q"))
+
+    def barcodes(self):
+        return list(self.well_index)
+
+
+def downsample(wells, genes, counts, n_well, fractions):
+    """
+    Expected reads, UMI and genes of each well at each fraction of reads.
+
+    Args:
+        wells, genes, counts: molecules sorted by well and gene, see reduce_counts
+
+    Return:
+    dict. Key: reads, UMI, gene. Value: array of shape (len(fractions), n_well)
+
+    >>> out = downsample(np.array([0, 0, 0]), np.array([0, 0, 1]), np.array([1, 3, 2]), 1, [0.5, 1.0])
+    >>> out["reads"].tolist(), out["UMI"].tolist(), out["gene"].tolist()
+    ([[3.0], [6.0]], [[2.125], [3.0]], [[1.6875], [2.0]])
+    """
+    counts = counts.astype(np.float64)
+    # reads per (well, gene)
+    new = np.ones(len(wells), dtype=bool)
+    new[1:] = (wells[1:] != wells[:-1]) | (genes[1:] != genes[:-1])
+    starts = np.flatnonzero(new)
+    gene_wells = wells[starts]
+    gene_counts = np.add.reduceat(counts, starts) if len(starts) else counts
+    reads = np.bincount(wells, weights=counts, minlength=n_well)
+    out = {"reads": [], "UMI": [], "gene": []}
+    for p in fractions:
+        out["reads"].append(reads * p)
+        out["UMI"].append(np.bincount(wells, weights=1 - (1 - p) ** counts, minlength=n_well))
+        out["gene"].append(np.bincount(gene_wells, weights=1 - (1 - p) ** gene_counts, minlength=n_well))
+    return {k: np.array(v) for k, v in out.items()}
+
+
+def count_bam(bam_files, counter, bam_perf):
+    pysam = utils.optional_import("pysam")
+    if pysam is None:
+        sys.exit("pysam is required to read BAM files")
+    for bam_file in bam_files:
+        with pysam.AlignmentFile(bam_file, "rb", check_sq=False) as bam:
+            for read in bam.fetch(until_eof=True):
+                bam_perf.count("alignments")
+                # STARsolo counts unique alignments only
+                if read.is_secondary or read.is_supplementary or read.is_unmapped:
+                    continue
+                try:
+                    cb = read.get_tag("CB")
+                    umi = read.get_tag("UB")
+                    gene = read.get_tag("GX")
+                    if read.get_tag("NH") != 1:
+                        continue
+                except KeyError:
+                    continue
+                if cb == "-" or umi == "-" or gene == "-":
+                    continue
+                counter.add(cb, umi, gene)
+                bam_perf.count("counted_reads")
+    counter.flush()
+
+
+def summarize_curve(curve, fractions, valid):
+    """
+    Per sample curve over the valid wells.
+    """
+    data = {"fraction": fractions, "Mean Reads per Well": [], "Median UMI per Well": [], "Median Genes per Well": [], "Sequencing Saturation": []}
+    for i in range(len(fractions)):
+        reads = curve["reads"][i][valid]
+        umi = curve["UMI"][i][valid]
+        data["Mean Reads per Well"].append(round(float(reads.mean()), 1) if valid.any() else 0)
+        data["Median UMI per Well"].append(round(statistics.median(umi), 1) if valid.any() else 0)
+        data["Median Genes per Well"].append(round(statistics.median(curve["gene"][i][valid]), 1) if valid.any() else 0)
+        data["Sequencing Saturation"].append(utils.get_frac(1 - umi.sum() / reads.sum()) if reads.sum() else 0)
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sequencing saturation and downsampling curves per well from STARsolo BAM")
+    parser.add_argument("--sample", required=True)
+    parser.add_argument("--bam", required=True, nargs="+", help="BAM files with CB, UB, GX and NH tags.")
+    parser.add_argument("--assets_dir", required=True)
+    parser.add_argument("--protocol", required=True)
+    parser.add_argument("--fractions", default=",".join(map(str, FRACTIONS)), help="Comma separated fractions of reads.")
+    parser.add_argument("--umi_cutoff", default=500, type=int, help="Wells with at least this UMI number are summarized.")
+    parser.add_argument("--chunk_size", default=5000000, type=int, help="Reads buffered before they are merged into the molecule counts.")
+    args = parser.parse_args()
+
+    fractions = sorted(set(float(x) for x in args.fractions.split(",")) | {1.0})
+    if fractions[0] <= 0 or fractions[-1] > 1:
+        sys.exit("Fractions must be in (0, 1]")
+
+    saturation_perf = perf.Perf("saturation", args.sample)
+    counter = MoleculeCounter(args.chunk_size)
+    with saturation_perf.phase("count"):
+        count_bam(args.bam, counter, saturation_perf)
+        saturation_perf.count("molecules", len(counter.counts))
+    with saturation_perf.phase("downsample"):
+        barcodes = counter.barcodes()
+        curve = downsample(counter.wells, counter.genes, counter.counts, len(barcodes), fractions)
+
+    with saturation_perf.phase("write"):
+        bc_well = starsolo_summary.get_protocol_bc_well(args.assets_dir, args.protocol) or {}
+        wells = [bc_well.get(x, x) for x in barcodes]
+        with open(f"{args.sample}.bulk_rna.saturation.tsv", "w") as f:
+            f.write("\t".join(["well", "BC", "fraction", "reads", "UMI", "gene", "saturation"]) + "\n")
+            for j in np.argsort(-curve["UMI"][-1], kind="stable"):
+                for i, p in enumerate(fractions):
+                    reads, umi, gene = curve["reads"][i][j], curve["UMI"][i][j], curve["gene"][i][j]
+                    saturation = 1 - umi / reads if reads else 0
+                    f.write(f"{wells[j]}\t{barcodes[j]}\t{p:g}\t{reads:.1f}\t{umi:.1f}\t{gene:.1f}\t{saturation:.4f}\n")
+
+        # same well filter as starsolo_summary
+        valid = curve["UMI"][-1] >= args.umi_cutoff
+        if not valid.any():
+            valid = curve["UMI"][-1] > 0
+        data = summarize_curve(curve, fractions, valid)
+        utils.write_json(data, f"{args.sample}.bulk_rna.saturation.json")
+        # all counted reads, like the Sequencing Saturation of STARsolo
+        saturation = utils.get_frac(1 - len(counter.counts) / counter.counts.sum()) if len(counter.counts) else 0
+        utils.write_json({"Sequencing Saturation": saturation}, f"{args.sample}.bulk_rna.saturation.stats.json")
+    saturation_perf.write(f"{args.sample}.bulk_rna.saturation.perf.json")
+    logger.info(f"{len(barcodes)} wells, {len(counter.counts)} molecules, sequencing saturation {saturation}%")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Shard paired fastq by well for scatter/gather STARsolo.
+
+Read pairs are routed by their barcode, corrected to the whitelist within 1 mismatch like STARsolo
+--soloCBmatchWLtype 1MM. All reads of a well, exact and corrected, are in the same shard, so UMI collapsing in each
+shard sees every read of its wells and the merged counts are the same as from one STARsolo run.
+STARsolo does not count read pairs whose barcode does not match or is ambiguous, they are spread over the shards
+by read index to keep the read metrics. Wells are assigned to shards round-robin in whitelist order.
+"""
+
+import argparse
+import os
+import sys
+
+import barcode_correct
+import fastq_io
+import parse_protocol
+import perf
+import split_fastq
+import utils
+
+logger = utils.get_logger(__name__)
+
+
+def get_route_table(whitelist, n_shard):
+    """
+    >>> route_table = get_route_table(["AACGTGAT", "AAACATCG", "TTTTTTTT"], 2)
+    >>> [route_table.routes(x) for x in [b"AACGTGAA", b"AAACATCG", b"TTTTTTTT", b"GGGGGGGG"]]
+    [(0,), (1,), (0,), ()]
+    """
+    well_route = {bc: (i % n_shard,) for i, bc in enumerate(whitelist)}
+    return split_fastq.RouteTable(well_route, barcode_correct.BarcodeCorrector(whitelist, n_mismatch=1))
+
+
+def shard_block(block1, block2, first, route_table, bc_slice, n_shard):
+    """
+    Args:
+        first: index of the first read pair in the input file
+
+    Return:
+    dict. Key: shard, value: (R1 bytes, R2 bytes, number of read pairs)
+
+    >>> route_table = get_route_table(["AAAA", "CCCC"], 2)
+    >>> out = shard_block(b"@r1\\nCCCCTT\\n+\\nFFFFFF\\n@r2\\nGGGGTT\\n+\\nFFFFFF\\n", b"@r1\\nA\\n+\\nF\\n@r2\\nC\\n+\\nF\\n", 0, route_table, slice(0, 4), 2)
+    >>> out[1][1], out[1][2]
+    (b'@r1\\nA\\n+\\nF\\n@r2\\nC\\n+\\nF\\n', 2)
+    """
+    np = utils.optional_import("numpy")
+    records1 = fastq_io.RecordBlock(block1)
+    records2 = fastq_io.RecordBlock(block2)
+    route_ids = np.fromiter(map(route_table.__getitem__, records1.fields(1, bc_slice)), dtype=np.intp, count=records1.n)
+    # first shard of each route id, -1 if not routed
+    route_shard = np.array([routes[0] if routes else -1 for routes, _status, _seq_bc in route_table.info])
+    shards = route_shard[route_ids]
+    not_routed = shards < 0
+    shards[not_routed] = (first + np.flatnonzero(not_routed)) % n_shard
+    out = {}
+    for shard in np.unique(shards).tolist():
+        reads = np.flatnonzero(shards == shard)
+        out[shard] = (records1.join(reads), records2.join(reads), len(reads))
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shard paired fastq by well for scatter/gather STARsolo")
+    parser.add_argument("--sample", required=True)
+    parser.add_argument("--fq1", required=True, help="Comma separated R1 files.")
+    parser.add_argument("--fq2", required=True, help="Comma separated R2 files.")
+    parser.add_argument("--shards", required=True, type=int)
+    parser.add_argument("--assets_dir", required=True)
+    parser.add_argument("--protocol", required=True)
+    parser.add_argument("--well", type=int, default=384)
+    parser.add_argument("--pattern")
+    parser.add_argument("--whitelist")
+    parser.add_argument("--compression", default="gzip", choices=fastq_io.COMPRESSION, help="Compression of output fastq.")
+    parser.add_argument("--chunk_size", type=int, default=100000, help="Approximate number of read pairs per block, assuming 200 bytes per read pair.")
+    args = parser.parse_args()
+
+    fq1_list = args.fq1.split(",")
+    fq2_list = args.fq2.split(",")
+    if len(fq1_list) != len(fq2_list):
+        sys.exit("fastq1 and fastq2 do not have same file number!")
+    pattern, whitelist_str = parse_protocol.get_pattern_whitelist(args.protocol, args.assets_dir, args.well, args.pattern, args.whitelist)
+    pattern_dict = parse_protocol.parse_pattern(pattern)
+    # CB_UMI_Complex uses EditDist_2 matching over several whitelists
+    if len(pattern_dict["C"]) != 1 or whitelist_str == "None" or " " in whitelist_str:
+        sys.exit("Sharding needs one barcode position and one whitelist!")
+    bc_slice = pattern_dict["C"][0]
+
+    shard_perf = perf.Perf("shard_fastq", args.sample)
+    with shard_perf.phase("setup"):
+        route_table = get_route_table(utils.read_one_col(whitelist_str), args.shards)
+        writer = fastq_io.FastqWriter(compression=args.compression)
+        fh = {}
+        for shard in range(args.shards):
+            out_dir = f"{args.sample}.shard{shard + 1}"
+            os.makedirs(out_dir, exist_ok=True)
+            fh[shard] = [writer.open(os.path.join(out_dir, f"{args.sample}_R{r}.fastq{writer.suffix}")) for r in (1, 2)]
+    with shard_perf.phase("shard"):
+        for fq1, fq2 in zip(fq1_list, fq2_list):
+            first = 0
+            for block1, block2, n in fastq_io.read_pair_blocks(fq1, fq2, args.chunk_size * 200):
+                shard_perf.count("read_pairs", n)
+                shard_perf.count("fastq_bytes", len(block1) + len(block2))
+                for shard, (data1, data2, records) in shard_block(block1, block2, first, route_table, bc_slice, args.shards).items():
+                    fh[shard][0].write(data1, records)
+                    fh[shard][1].write(data2, records)
+                first += n
+    with shard_perf.phase("close"):
+        writer.close()
+    reads = {f"shard{shard + 1}": fh[shard][0].records for shard in range(args.shards)}
+    utils.write_json(reads, f"{args.sample}.bulk_rna.shard.json")
+    shard_perf.write(f"{args.sample}.bulk_rna.shard_fastq.perf.json")
+    logger.info(reads)
@@ -1,20 +1,26 @@
 #!/usr/bin/env python
 
 import argparse
+import csv
+import json
+import multiprocessing
+import pickle
+import shutil
 import sys
 import os
-from collections import Counter
+from collections import Counter, defaultdict, deque
 from itertools import chain
 
-import pandas as pd
-import pysam
-from xopen import xopen
-
-
+import barcode_correct
+import demux_stats
+import fastq_io
+import perf
 import utils
 import parse_protocol
 
 logger = utils.get_logger(__name__)
+# bases of the precomputed barcode neighbours in RouteTable
+ALPHABET = "ACGTN"
 
 def splitInf_to_dict(file,sample):
     """
@@ -23,17 +29,19 @@ def splitInf_to_dict(file,sample):
             sampleX	    56,64,85,21,12  sampleB
     output:{'SampleA': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11], 'sampleB': [56, 64, 85, 21, 12]}
     """
-    df = pd.read_csv(file,sep="\t",header=0)
-    if '_'.join(df.columns) != "raw_sample_well_sub_sample":
-        sys.exit(f'Wrong file,header should be:raw_sample\\twell\\tsub_sample')
-    if sample not in df["raw_sample"].values:
+    with utils.openfile(file) as f:
+        rows = list(csv.reader(f, delimiter="\t"))
+    if not rows or '_'.join(rows[0]) != "raw_sample_well_sub_sample":
+        sys.exit('Wrong file,header should be:raw_sample\\twell\\tsub_sample')
+    rows = [dict(zip(rows[0], row)) for row in rows[1:] if row]
+    if sample not in [row["raw_sample"] for row in rows]:
         sys.exit(f"{sample} doesn't in split csv")
-    df = df[df["raw_sample"]==sample]
-    if df["sub_sample"].nunique() != df.shape[0]:
+    rows = [row for row in rows if row["raw_sample"]==sample]
+    if len(set(row["sub_sample"] for row in rows)) != len(rows):
         sys.exit("Pleas merge the same sub_sample row")
         
     split_dict = {}
-    for index,row in df.iterrows():
+    for row in rows:
         well_list = []
         sub_sample = row['sub_sample']
         wells = row['well'].split(",")
@@ -55,21 +63,250 @@ def splitInf_to_dict(file,sample):
             sys.exit("Duplicate well exists")
     return split_dict
 
-def get_all_bc(file,well_dict,well_split=False):
+def get_all_bc(file,well_dict):
     """
-    get raw barcode and mismatch barcode
+    get whitelist barcode of each well. Mismatch barcodes are routed by RouteTable.
     """
     barcodes = utils.read_one_col(file)
     all_bc ={}
     for i in well_dict.keys(): 
-        all_bc[i]= {"map":{},"sample":{},"well":{}}
+        all_bc[i]= {"map":{}}
         for j in well_dict[i]:
             all_bc[i]["map"][barcodes[j-1]] = f'well{j}'
-            all_bc[i]["sample"].update(parse_protocol.get_mismatch_dict([barcodes[j-1]], 1))
-            if well_split:
-                all_bc[i]["well"][f'well{j}']=parse_protocol.get_mismatch_dict([barcodes[j-1]], 1)
     return all_bc
 
+def get_well_route(sub_bc, well_split=False):
+    """
+    Return:
+    route dict. Key: whitelist barcode, value: tuple of output keys the read pair is written to.
+    Output key is (sub_sample, "sample") or (sub_sample, well).
+    """
+    well_route = {}
+    for i in sub_bc.keys():
+        for seq_bc, well_num in sub_bc[i]["map"].items():
+            routes = ((i, "sample"),)
+            if well_split:
+                routes += ((i, well_num),)
+            well_route[seq_bc] = routes
+    return well_route
+
+def get_well_bc(sub_bc, route_table, well_split=False):
+    """
+    Barcodes routed to each sub-sample, from a routing table before demultiplexing: the whitelist barcodes and their
+    1-mismatch neighbours over ACGTN that are not ambiguous.
+
+    Return:
+    sub_bc with "sample" dict added. Key: barcode, value: whitelist barcode.
+    With well_split, "well" dict is added too. Key: well, value: dict of barcode to whitelist barcode
+    """
+    well_of = {}
+    for i in sub_bc.keys():
+        for seq_bc, well_num in sub_bc[i]["map"].items():
+            well_of[seq_bc] = (i, well_num)
+    well_bc = {}
+    for i in sub_bc.keys():
+        well_bc[i] = {"map": sub_bc[i]["map"], "sample": {}}
+        if well_split:
+            well_bc[i]["well"] = {well_num: {} for well_num in sub_bc[i]["map"].values()}
+    for temp_bc, route_id in route_table.items():
+        seq_bc = route_table.info[route_id][2]
+        if seq_bc not in well_of:
+            continue
+        i, well_num = well_of[seq_bc]
+        well_bc[i]["sample"][temp_bc.decode()] = seq_bc
+        if well_split:
+            well_bc[i]["well"][well_num][temp_bc.decode()] = seq_bc
+    return well_bc
+
+class RouteTable(dict):
+    """
+    Barcode routing table, so that each read pair only needs one lookup.
+    Key: raw barcode bytes in read, value: route id. info[route id] is (routes, status, whitelist barcode), routes is
+    the tuple of outputs the read pair is written to, empty if not routed. status and whitelist barcode are from
+    BarcodeCorrector.lookup, so the demultiplexing stats are counted per route id instead of per raw barcode.
+
+    The whitelist barcodes and their mismatch neighbours over ACGTN are routed up front. Other barcodes of the whitelist
+    length and alphabet are no match without a lookup, barcodes with other characters are corrected. Both are cached
+    on first use, up to max_size barcodes.
+    """
+
+    def __init__(self, well_route, corrector, max_size=1 << 20):
+        super().__init__()
+        self.well_route = well_route
+        self.corrector = corrector
+        self.info = []
+        self.route_ids = {}
+        for seq, (status, seq_bc) in corrector.neighbours(ALPHABET).items():
+            self[seq.encode()] = self.route_id(status, seq_bc)
+        self.no_match = self.route_id(barcode_correct.NO_MATCH, None)
+        self.max_size = max(max_size, len(self))
+
+    def route_id(self, status, seq_bc):
+        key = (status, seq_bc)
+        if key not in self.route_ids:
+            self.route_ids[key] = len(self.info)
+            self.info.append((self.well_route.get(seq_bc, ()), status, seq_bc))
+        return self.route_ids[key]
+
+    def routes(self, temp_bc):
+        """
+        Return:
+        tuple of outputs of a raw barcode
+        """
+        return self.info[self[temp_bc]][0]
+
+    def __missing__(self, temp_bc):
+        if len(temp_bc) == self.corrector.length and not temp_bc.translate(None, ALPHABET.encode()):
+            route_id = self.no_match
+        else:
+            route_id = self.route_id(*self.corrector.lookup(temp_bc.decode(errors="replace")))
+        if len(self) < self.max_size:
+            self[temp_bc] = route_id
+        return route_id
+
+_route_table = {}
+_bc_slice = slice(0, 0)
+_stats_args = (100, None)
+
+def init_worker(route_table, bc_slice, stats_args):
+    global _route_table, _bc_slice, _stats_args
+    _route_table = route_table
+    _bc_slice = bc_slice
+    _stats_args = stats_args
+
+def demux_block(block1, block2, first, route_table, bc_slice, stats):
+    """
+    Demultiplex one block of read pairs. Records and barcodes stay bytes, sliced at line offsets found with numpy.
+    Route ids are sorted once, so the reads of each route id come in input order and their count is the read count of
+    the stats. Each output is then joined at once.
+    Record names are truncated at the first whitespace and the plus line is written bare, as with pysam.FastxFile.
+
+    Args:
+        block1, block2: bytes of the same complete records in R1 and R2
+        first: index of the first read pair in the input file
+        stats: DemuxStats, updated in place
+
+    Return:
+    out dict. Key: output key, value: (R1 bytes, R2 bytes, number of read pairs)
+    """
+    np = utils.optional_import("numpy")
+    records1 = fastq_io.RecordBlock(block1)
+    records2 = fastq_io.RecordBlock(block2)
+    route_ids = np.fromiter(map(route_table.__getitem__, records1.fields(1, bc_slice)), dtype=np.intp, count=records1.n)
+    info = route_table.info
+    counts = np.bincount(route_ids, minlength=len(info))
+    # read indexes of each route id, in input order
+    order = np.argsort(route_ids.astype(np.min_scalar_type(len(info))), kind="stable")
+    bounds = np.cumsum(counts).tolist()
+    by_route = {}
+    for route_id in np.flatnonzero(counts).tolist():
+        by_route[route_id] = order[bounds[route_id] - counts[route_id]:bounds[route_id]]
+        stats.add_reads(*info[route_id][1:], int(counts[route_id]))
+
+    sampled = range(-first % stats.sample_every, records1.n, stats.sample_every)
+    for i, route_id in zip(sampled, route_ids[sampled.start::sampled.step].tolist()):
+        routes, _status, seq_bc = info[route_id]
+        if routes:
+            stats.add_sample(seq_bc, records2.line(i, 1), records2.line(i, 3))
+    if stats.umi_slice:
+        umis = records1.fields(1, stats.umi_slice)
+        for route_id, reads in by_route.items():
+            routes, _status, seq_bc = info[route_id]
+            if routes:
+                for i in reads.tolist():
+                    stats.add_umi(seq_bc, umis[i])
+
+    index = defaultdict(list)
+    for route_id, reads in by_route.items():
+        for key in info[route_id][0]:
+            index[key].append(reads)
+    out = {}
+    for key, groups in index.items():
+        # back to input order
+        reads = np.sort(np.concatenate(groups)) if len(groups) > 1 else groups[0]
+        out[key] = (records1.join(reads), records2.join(reads), len(reads))
+    return out
+
+def demux_chunk(chunk):
+    """
+    demux_block in a worker process.
+
+    Args:
+        chunk: (R1 bytes, R2 bytes, index of the first read pair in the input file)
+
+    Return:
+    output of demux_block
+    DemuxStats of the chunk
+    """
+    stats = demux_stats.DemuxStats(*_stats_args)
+    return demux_block(chunk[0], chunk[1], chunk[2], _route_table, _bc_slice, stats), stats
+
+class Checkpoint:
+    """
+    Resume state of split_fastq, saved in a directory outside of the task directory so that a retried task finds it.
+    The outputs are written in the same directory and moved to the working directory when the run is finished.
+
+    checkpoint.json: fingerprint of the run, input position(file index, read pairs done) and size/record count of
+    each output. stats.pkl: DemuxStats at the same position.
+    The input position is a read pair count rather than a byte offset, since gzip input can not be seeked. On resume
+    the processed read pairs are decompressed and skipped, which is much faster than demultiplexing them.
+    """
+
+    def __init__(self, directory, fingerprint, every):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.every = every
+        self.json_file = os.path.join(directory, "checkpoint.json")
+        self.stats_file = os.path.join(directory, "stats.pkl")
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        """
+        Return:
+        checkpoint dict, or None if there is no checkpoint of the same run
+        """
+        try:
+            with open(self.json_file) as f:
+                data = json.load(f)
+            with open(self.stats_file, "rb") as f:
+                data["stats"] = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        if data["fingerprint"] != self.fingerprint:
+            logger.warning(f"Checkpoint in {self.directory} is from a different run, start over")
+            return None
+        return data
+
+    def save(self, file_index, pairs, writer, stats):
+        outputs = writer.checkpoint()
+        data = {"fingerprint": self.fingerprint, "file_index": file_index, "pairs": pairs, "outputs": outputs}
+        # stats first, checkpoint.json is the commit point
+        for fn, mode, dump in [(self.stats_file, "wb", lambda f: pickle.dump(stats, f)), (self.json_file, "w", lambda f: json.dump(data, f))]:
+            with open(fn + ".tmp", mode) as f:
+                dump(f)
+            os.replace(fn + ".tmp", fn)
+        logger.info(f"Checkpoint: file {file_index + 1}, {pairs} read pairs")
+
+    def clear(self):
+        for fn in [self.json_file, self.stats_file]:
+            if os.path.exists(fn):
+                os.remove(fn)
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+def input_fingerprint(args, fq1_list, fq2_list):
+    """
+    Arguments that change the output, and the real path and size of each input file
+    """
+    files = [args.split_inf] + fq1_list + fq2_list
+    keys = ["sample", "split_to_well", "protocol", "well", "pattern", "whitelist", "umi_hll", "qc_sample_every", "compression", "compresslevel"]
+    return {
+        "args": {key: getattr(args, key) for key in keys},
+        "files": [[os.path.realpath(fn), os.path.getsize(fn)] for fn in files],
+    }
+
 class Split_Fastq:
     def __init__(self, args):
         self.args = args
@@ -79,6 +316,8 @@ class Split_Fastq:
         fq2_number = len(self.fq2_list)
         if self.fq1_number != fq2_number:
             sys.exit('fastq1 and fastq2 do not have same file number!')
+        # about 200 bytes per read pair
+        self.block_size = args.chunk_size * 200
         
         # pattern and whitlist
         if args.protocol == 'customized':
@@ -102,71 +341,153 @@ class Split_Fastq:
         if " " in self.whitelist_str:
             sys.exit("Only accept one whitelist")
 
+        self.perf = perf.Perf("split_fastq", args.sample)
+        self.checkpoint = None
+        self.out_dir = "."
+        if args.checkpoint_dir:
+            fingerprint = input_fingerprint(args, self.fq1_list, self.fq2_list)
+            self.checkpoint = Checkpoint(args.checkpoint_dir, fingerprint, args.checkpoint_every)
+            self.out_dir = args.checkpoint_dir
+
     def run(self):
         raw_sample = self.args.sample
-        # subsample wells
-        split_dict = splitInf_to_dict(self.args.split_inf, raw_sample)
-
-        # output file define
-        out_dict = {}
-        for i in split_dict.keys():
-            os.makedirs(f'{raw_sample}/{i}', exist_ok=True)
-            out_dict[i] = {"sample":{"out_R1":f'{raw_sample}/{i}/{i}_R1.fastq',"out_R2":f'{raw_sample}/{i}/{i}_R2.fastq'}}
-            if self.args.split_to_well:
-                out_dict[i]["well"] = {}
-                os.makedirs(f'{raw_sample}/{i}/well', exist_ok=True)
-                for j in split_dict[i]:
-                    well_name = "well"+str(j)
-                    out_dict[i]["well"][well_name] = {"out_R1":f'{raw_sample}/{i}/well/{well_name}_R1.fastq',"out_R2":f'{raw_sample}/{i}/well/{well_name}_R2.fastq'}
-        
-        # open output file
-        fh_fq1 = {}
-        fh_fq2 = {}
-        for i in out_dict.keys():
-            fh_fq1[i] = {"sample":{}}
-            fh_fq1[i]["sample"] = xopen(out_dict[i]["sample"]["out_R1"],"w")
-            fh_fq2[i] = {"sample":{}}
-            fh_fq2[i]["sample"] = xopen(out_dict[i]["sample"]["out_R2"],"w")
-            if self.args.split_to_well:
-                fh_fq1[i]["well"]={}
-                fh_fq2[i]["well"]={}
-                for j in out_dict[i]['well'].keys():
-                    fh_fq1[i]["well"][j]= xopen(out_dict[i]["well"][j]["out_R1"],"w")
-                    fh_fq2[i]["well"][j]= xopen(out_dict[i]["well"][j]["out_R2"],"w")
-        
-        # fastq
-        sub_bc = get_all_bc(self.whitelist_str,split_dict,self.args.split_to_well)
-        for i in range(self.fq1_number):
-            with pysam.FastxFile(self.fq1_list[i], persist=False) as fq1,pysam.FastxFile(self.fq2_list[i], persist=False) as fq2:
-                for entry1, entry2 in zip(fq1, fq2):
-                    header1, seq1, qual1 = entry1.name, entry1.sequence, entry1.quality
-                    header2, seq2, qual2 = entry2.name, entry2.sequence, entry2.quality
-                    temp_bc = seq1[self.pattern_dict["C"][0].start:self.pattern_dict["C"][0].stop]
-                    for j in sub_bc.keys():
-                        if temp_bc in sub_bc[j]["sample"].keys():
-                            fh_fq1[j]["sample"].write(f'@{header1}\n{seq1}\n+\n{qual1}\n')
-                            fh_fq2[j]["sample"].write(f'@{header2}\n{seq2}\n+\n{qual2}\n')
-                            if self.args.split_to_well:
-                                seq_bc = sub_bc[j]["sample"][temp_bc]
-                                well_num = sub_bc[j]["map"][seq_bc]
-                                fh_fq1[j]["well"][well_num].write(f'@{header1}\n{seq1}\n+\n{qual1}\n')
-                                fh_fq2[j]["well"][well_num].write(f'@{header2}\n{seq2}\n+\n{qual2}\n')
-        # close files
-        for i in out_dict.keys():
-            fh_fq1[i]["sample"].close()
-            fh_fq2[i]["sample"].close()
-            if self.args.split_to_well:
-                for j in fh_fq1[i]["well"]:
-                    fh_fq1[i]["well"][j].close()
-                    fh_fq2[i]["well"][j].close()
-        out_json = raw_sample + ".bulk_rna.well_bc.json"
-        utils.write_json(sub_bc,out_json)
-        out_json = raw_sample + ".bulk_rna.fastq_inf.json"
-        utils.write_json(out_dict,out_json)
-        
+        with self.perf.phase("setup"):
+            # subsample wells
+            split_dict = splitInf_to_dict(self.args.split_inf, raw_sample)
+
+            # output file define
+            writer = fastq_io.FastqWriter(
+                compression=self.args.compression,
+                compresslevel=self.args.compresslevel,
+                threads=self.args.compress_threads,
+                max_open=self.args.max_open_files,
+            )
+            suffix = writer.suffix
+            state = self.checkpoint.load() if self.checkpoint else None
+            if self.checkpoint and state is None:
+                # outputs of an unfinished different run
+                shutil.rmtree(os.path.join(self.out_dir, raw_sample), ignore_errors=True)
+            out_dict = {}
+            for i in split_dict.keys():
+                os.makedirs(os.path.join(self.out_dir, f'{raw_sample}/{i}'), exist_ok=True)
+                out_dict[i] = {"sample":{"out_R1":f'{raw_sample}/{i}/{i}_R1.fastq{suffix}',"out_R2":f'{raw_sample}/{i}/{i}_R2.fastq{suffix}'}}
+                if self.args.split_to_well:
+                    out_dict[i]["well"] = {}
+                    os.makedirs(os.path.join(self.out_dir, f'{raw_sample}/{i}/well'), exist_ok=True)
+                    for j in split_dict[i]:
+                        well_name = "well"+str(j)
+                        out_dict[i]["well"][well_name] = {"out_R1":f'{raw_sample}/{i}/well/{well_name}_R1.fastq{suffix}',"out_R2":f'{raw_sample}/{i}/well/{well_name}_R2.fastq{suffix}'}
+
+            # open output file
+            fh_fq1 = {}
+            fh_fq2 = {}
+            def out_path(fn):
+                return os.path.join(self.out_dir, fn)
+
+            for i in out_dict.keys():
+                fh_fq1[(i, "sample")] = writer.open(out_path(out_dict[i]["sample"]["out_R1"]))
+                fh_fq2[(i, "sample")] = writer.open(out_path(out_dict[i]["sample"]["out_R2"]))
+                if self.args.split_to_well:
+                    for j in out_dict[i]['well'].keys():
+                        fh_fq1[(i, j)] = writer.open(out_path(out_dict[i]["well"][j]["out_R1"]))
+                        fh_fq2[(i, j)] = writer.open(out_path(out_dict[i]["well"][j]["out_R2"]))
+
+            # fastq
+            sub_bc = get_all_bc(self.whitelist_str,split_dict)
+            well_route = get_well_route(sub_bc, self.args.split_to_well)
+            corrector = barcode_correct.BarcodeCorrector(utils.read_one_col(self.whitelist_str), n_mismatch=1)
+            route_table = RouteTable(well_route, corrector)
+            well_bc = get_well_bc(sub_bc, route_table, self.args.split_to_well)
+            umi_slice = self.pattern_dict["U"][0] if self.args.umi_hll and "U" in self.pattern_dict else None
+            stats = demux_stats.DemuxStats(self.args.qc_sample_every, umi_slice)
+            start = (0, 0)
+            if state is not None and writer.resume(state["outputs"]):
+                stats = state["stats"]
+                start = (state["file_index"], state["pairs"])
+                logger.info(f"Resume from file {start[0] + 1}, {start[1]} read pairs")
+            self.writer = writer
+        with self.perf.phase("demux"):
+            if self.args.threads > 1:
+                self.demux_parallel(route_table, fh_fq1, fh_fq2, stats, start)
+            else:
+                self.demux(route_table, fh_fq1, fh_fq2, stats, start)
+        with self.perf.phase("close"):
+            # flush and close files
+            writer.close()
+            if self.checkpoint:
+                if os.path.exists(raw_sample):
+                    shutil.rmtree(raw_sample)
+                shutil.move(os.path.join(self.out_dir, raw_sample), raw_sample)
+                self.checkpoint.clear()
+        with self.perf.phase("report"):
+            out_json = raw_sample + ".bulk_rna.demux.json"
+            utils.write_json(stats.report(sub_bc), out_json)
+            out_json = raw_sample + ".bulk_rna.well_bc.json"
+            utils.write_json(well_bc,out_json)
+            out_json = raw_sample + ".bulk_rna.fastq_inf.json"
+            utils.write_json(out_dict,out_json)
+        self.perf.write(raw_sample + ".bulk_rna.split_fastq.perf.json")
+
         logger.info(out_dict)
         logger.info("Analysis finish!")
 
+    def demux(self, route_table, fh_fq1, fh_fq2, stats, start=(0, 0)):
+        """
+        Args:
+            start: (index of the first input file, read pairs of the file already done)
+        """
+        bc_slice = self.pattern_dict["C"][0]
+        every = self.checkpoint.every if self.checkpoint else 0
+        for i in range(start[0], self.fq1_number):
+            end = start[1] if i == start[0] else 0
+            for block1, block2, n in fastq_io.read_pair_blocks(self.fq1_list[i], self.fq2_list[i], self.block_size, skip=end):
+                self.perf.count("read_pairs", n)
+                self.perf.count("fastq_bytes", len(block1) + len(block2))
+                out = demux_block(block1, block2, end, route_table, bc_slice, stats)
+                for key, (data1, data2, records) in out.items():
+                    fh_fq1[key].write(data1, records)
+                    fh_fq2[key].write(data2, records)
+                if every and (end + n) // every != end // every:
+                    self.checkpoint.save(i, end + n, self.writer, stats)
+                end += n
+
+    def demux_parallel(self, route_table, fh_fq1, fh_fq2, stats, start=(0, 0)):
+        """
+        Demultiplex blocks of read pairs in worker processes.
+        Blocks are written in input order, so the output is the same as demux.
+        At most 2 * threads blocks are in flight to bound memory.
+        Checkpoints are saved between written blocks.
+        """
+        every = self.checkpoint.every if self.checkpoint else 0
+        # position of the last written block
+        last = [start]
+
+        def write_out(item):
+            file_index, end, result = item
+            out, chunk_stats = result.get()
+            for key, (data1, data2, records) in out.items():
+                fh_fq1[key].write(data1, records)
+                fh_fq2[key].write(data2, records)
+            stats.merge(chunk_stats)
+            last_end = last[0][1] if last[0][0] == file_index else 0
+            if every and end // every != last_end // every:
+                self.checkpoint.save(file_index, end, self.writer, stats)
+            last[0] = (file_index, end)
+
+        pending = deque()
+        with multiprocessing.Pool(self.args.threads, initializer=init_worker, initargs=(route_table, self.pattern_dict["C"][0], (stats.sample_every, stats.umi_slice))) as pool:
+            for i in range(start[0], self.fq1_number):
+                end = start[1] if i == start[0] else 0
+                for block1, block2, n in fastq_io.read_pair_blocks(self.fq1_list[i], self.fq2_list[i], self.block_size, skip=end):
+                    self.perf.count("read_pairs", n)
+                    self.perf.count("fastq_bytes", len(block1) + len(block2))
+                    if len(pending) >= 2 * self.args.threads:
+                        write_out(pending.popleft())
+                    pending.append((i, end + n, pool.apply_async(demux_chunk, ((block1, block2, end),))))
+                    end += n
+            while pending:
+                write_out(pending.popleft())
+
 if __name__ == "__main__":
     """
     Split fastq based on information provided by the user.
@@ -182,6 +503,23 @@ if __name__ == "__main__":
     parser.add_argument('--well', required=True,type=int,default=384)
     parser.add_argument("--pattern")
     parser.add_argument("--whitelist")
+    parser.add_argument('--umi_hll', action='store_true', help='Estimate UMI number per well with HyperLogLog.')
+    parser.add_argument('--qc_sample_every', type=int, default=100,
+        help='R2 length and quality histograms are sampled every N read pairs.'
+    )
+    parser.add_argument('--threads', type=int, default=1, help='Number of demultiplexing worker processes. 1 demultiplexes in the main process.')
+    parser.add_argument('--chunk_size', type=int, default=100000, help='Approximate number of read pairs per block, assuming 200 bytes per read pair.')
+    parser.add_argument('--compression', default='none', choices=fastq_io.COMPRESSION, help='Compression of output fastq.')
+    parser.add_argument('--compresslevel', type=int, help='Gzip compression level.')
+    parser.add_argument('--compress_threads', type=int, default=0,
+        help='Compression threads per output file. 0 compresses in-process, >0 uses pigz/igzip.'
+    )
+    parser.add_argument('--max_open_files', type=int, default=256, help='Maximum number of output files kept open.')
+    parser.add_argument('--checkpoint_dir',
+        help='Write outputs and checkpoints in this directory and resume from its last checkpoint. '
+        'Outputs are moved to the working directory when finished. Should be outside of the task directory.'
+    )
+    parser.add_argument('--checkpoint_every', type=int, default=20000000, help='Save a checkpoint every N read pairs of an input file.')
     parser.add_argument('--version', action='version', version='1.0')
     args = parser.parse_args()
     
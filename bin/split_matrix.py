@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Split the STARsolo results of a sample into sub-samples by well, without splitting fastq and aligning again.
+
+The well to sub-sample mapping is the split_inf file of split_fastq.py, well n is the n-th barcode of the whitelist.
+For each sub-sample, the columns of its wells are taken from the raw matrix, and the rows of its wells from
+CellReads.stats. The json and counts files are the same as starsolo_summary.py writes for a sample, with the reads of
+the wells of the sub-sample as raw reads.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import parse_protocol
+import perf
+import split_fastq
+import starsolo_summary
+import utils
+import well_matrix
+
+logger = utils.get_logger(__name__)
+
+
+def sub_sample_columns(split_dict, whitelist, barcodes):
+    """
+    Return:
+    sub_samples, column sub-sample index of each barcode(-1 if not in any sub-sample)
+
+    >>> sub_sample_columns({"A": [1, 3], "B": [2]}, ["AA", "CC", "GG"], np.array(["GG", "AA", "CC"]))
+    (['A', 'B'], array([0, 0, 1]))
+    """
+    bc_col = {bc: i for i, bc in enumerate(barcodes)}
+    sub_samples = list(split_dict)
+    col_sub = np.full(len(barcodes), -1, dtype=np.int64)
+    for i, sub_sample in enumerate(sub_samples):
+        for well in split_dict[sub_sample]:
+            if well > len(whitelist):
+                sys.exit(f"well{well} of {sub_sample} is not in the whitelist")
+            bc = whitelist[well - 1]
+            if bc in bc_col:
+                col_sub[bc_col[bc]] = i
+    return sub_samples, col_sub
+
+
+def select_columns(data, indices, indptr, cols):
+    """
+    Columns of a CSC matrix, in the given order.
+
+    >>> data, indices, indptr = np.array([1, 2, 3]), np.array([0, 1, 0]), np.array([0, 2, 2, 3])
+    >>> select_columns(data, indices, indptr, np.array([2, 0]))
+    (array([3, 1, 2]), array([0, 0, 1]), array([0, 1, 3]))
+    """
+    nnz_col = indptr[cols + 1] - indptr[cols]
+    new_indptr = np.zeros(len(cols) + 1, dtype=np.int64)
+    np.cumsum(nnz_col, out=new_indptr[1:])
+    # position of each entry in the original arrays
+    pos = np.repeat(indptr[cols] - new_indptr[:-1], nnz_col) + np.arange(new_indptr[-1])
+    return data[pos], indices[pos], new_indptr
+
+
+def pseudo_bulk(data, indices, indptr, col_sub, n_sub, n_row):
+    """
+    Sum of each gene over the wells of each sub-sample.
+
+    Return:
+    array of shape (n_row, n_sub)
+
+    >>> data, indices, indptr = np.array([1, 2, 3]), np.array([0, 1, 0]), np.array([0, 2, 2, 3])
+    >>> pseudo_bulk(data, indices, indptr, np.array([0, -1, 0]), 1, 2).tolist()
+    [[4], [2]]
+    """
+    cols = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    subs = col_sub[cols]
+    keep = subs >= 0
+    counts = np.bincount(
+        subs[keep] * n_row + indices[keep], weights=data[keep].astype(np.float64), minlength=n_sub * n_row
+    )
+    return counts.reshape(n_sub, n_row).T.astype(np.int64)
+
+
+def write_mtx(fn, data, indices, indptr, shape):
+    """
+    MatrixMarket coordinate file, same header as STARsolo
+    """
+    cols = np.repeat(np.arange(shape[1]), np.diff(indptr))
+    field = "real" if data.dtype.kind == "f" else "integer"
+    with open(fn, "w") as f:
+        f.write(f"%%MatrixMarket matrix coordinate {field} general\n%\n")
+        f.write(f"{shape[0]} {shape[1]} {len(data)}\n")
+        np.savetxt(f, np.column_stack([indices + 1, cols + 1, data]), fmt="%d %d %d" if field == "integer" else "%d %d %.10g")
+
+
+def read_stats_table(read_stats):
+    """
+    Columns needed by starsolo_summary, CBnotInPasslist is dropped.
+    """
+    cols = list(dict.fromkeys(["CB"] + starsolo_summary.SUM_COLUMNS + list(starsolo_summary.BC_COLUMNS)))
+    df = pd.read_csv(read_stats, sep="\t", usecols=cols, dtype={"CB": str}, keep_default_na=False)
+    return df[df["CB"] != "CBnotInPasslist"]
+
+
+def split_read_stats(df, sub_samples, col_sub, barcodes, bc_well=None):
+    """
+    Return:
+    dict. Key: sub-sample, value: (per barcode table, mapping metrics, number of reads with valid barcodes)
+    """
+    bc_sub = pd.Series(col_sub, index=barcodes)
+    df = df.assign(sub=bc_sub.reindex(df["CB"]).fillna(-1).to_numpy(dtype=np.int64))
+    df = df[df["sub"] >= 0]
+    sums = df.groupby("sub")[starsolo_summary.SUM_COLUMNS].sum()
+    out = {}
+    for i, sub_df in df.groupby("sub", sort=False):
+        # stable, ties keep the order of CellReads.stats
+        sub_df = sub_df.sort_values("nUMIunique", ascending=False, kind="stable")
+        table = {"CB": sub_df["CB"].tolist()}
+        for col, name in starsolo_summary.BC_COLUMNS.items():
+            table[name] = sub_df[col].tolist()
+        if bc_well is not None:
+            table = starsolo_summary.well_bctonum(table, bc_well=bc_well)
+        s = {col: int(sums.loc[i, col]) for col in starsolo_summary.SUM_COLUMNS}
+        out[sub_samples[i]] = (table, starsolo_summary.mapping_metrics(s), s["cbMatch"])
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split the STARsolo raw matrix and CellReads.stats into sub-samples by well")
+    parser.add_argument("--sample", required=True)
+    parser.add_argument("--matrix_dir", required=True, help="STARsolo raw matrix directory")
+    parser.add_argument("--read_stats", required=True, help="CellReads.stats file")
+    parser.add_argument("--split_inf", required=True, help="Tab separated file with header raw_sample, well, sub_sample.")
+    parser.add_argument("--assets_dir", required=True)
+    parser.add_argument("--protocol", required=True)
+    parser.add_argument("--well", type=int, default=384)
+    parser.add_argument("--pattern")
+    parser.add_argument("--whitelist")
+    parser.add_argument("--umi_cutoff", default=500, type=int)
+    parser.add_argument("--read_cutoff", default=0, type=int)
+    parser.add_argument("--gene_cutoff", default=0, type=int)
+    args = parser.parse_args()
+
+    def find(name):
+        for fn in [name + ".gz", name]:
+            path = os.path.join(args.matrix_dir, fn)
+            if os.path.exists(path):
+                return path
+        sys.exit(f"{name} not found in {args.matrix_dir}")
+
+    split_perf = perf.Perf("split_matrix", args.sample)
+    with split_perf.phase("read"):
+        split_dict = split_fastq.splitInf_to_dict(args.split_inf, args.sample)
+        _pattern, whitelist_str = parse_protocol.get_pattern_whitelist(args.protocol, args.assets_dir, args.well, args.pattern, args.whitelist)
+        if whitelist_str == "None" or " " in whitelist_str:
+            sys.exit("Only accept one whitelist")
+        whitelist = utils.read_one_col(whitelist_str)
+        features = utils.read_one_col(find("features.tsv"))
+        barcodes = np.array(utils.read_one_col(find("barcodes.tsv")))
+        data, indices, indptr, shape = well_matrix.read_mtx(find("matrix.mtx"))
+        if shape != (len(features), len(barcodes)):
+            sys.exit(f"Matrix shape {shape} does not match features and barcodes")
+        read_stats = read_stats_table(args.read_stats)
+        split_perf.count("non_zero_entries", len(data))
+
+    sub_samples, col_sub = sub_sample_columns(split_dict, whitelist, barcodes)
+    # sub-sample names can repeat across raw samples, the outputs are prefixed with the raw sample
+    out_names = [f"{args.sample}_{sub_sample}" for sub_sample in sub_samples]
+    with split_perf.phase("matrix"):
+        for i, sub_sample in enumerate(sub_samples):
+            cols = np.flatnonzero(col_sub == i)
+            out_dir = os.path.join(f"{args.sample}.split", f"{out_names[i]}.matrix", "raw")
+            os.makedirs(out_dir, exist_ok=True)
+            sub_data, sub_indices, sub_indptr = select_columns(data, indices, indptr, cols)
+            write_mtx(os.path.join(out_dir, "matrix.mtx"), sub_data, sub_indices, sub_indptr, (shape[0], len(cols)))
+            with open(os.path.join(out_dir, "barcodes.tsv"), "w") as f:
+                f.writelines(bc + "\n" for bc in barcodes[cols])
+            with open(os.path.join(out_dir, "features.tsv"), "w") as f:
+                f.writelines(x + "\n" for x in features)
+        counts = pseudo_bulk(data, indices, indptr, col_sub, len(sub_samples), shape[0])
+        feature_cols = [x.split("\t") for x in features]
+        df = pd.DataFrame(counts, columns=out_names)
+        df.insert(0, "gene_name", [x[1] if len(x) > 1 else x[0] for x in feature_cols])
+        df.insert(0, "gene_id", [x[0] for x in feature_cols])
+        df.to_csv(f"{args.sample}.bulk_rna.pseudo_bulk.tsv", sep="\t", index=False)
+
+    with split_perf.phase("summary"):
+        bc_well = starsolo_summary.get_protocol_bc_well(args.assets_dir, args.protocol)
+        cutoffs = {"umi_cutoff": args.umi_cutoff, "read_cutoff": args.read_cutoff, "gene_cutoff": args.gene_cutoff}
+        split_stats = split_read_stats(read_stats, sub_samples, col_sub, barcodes, bc_well)
+        for sub_sample, out_name in zip(sub_samples, out_names):
+            if sub_sample not in split_stats:
+                logger.warning(f"No reads in the wells of {out_name}")
+                continue
+            table, data_dict, valid_reads = split_stats[sub_sample]
+            # all reads of a sub-sample have valid barcodes, as in the fastq of split_fastq.py
+            starsolo_summary.write_sample(out_name, table, data_dict, valid_reads, 1.0, **cutoffs)
+            # same as protocol_cmd.py writes for a sample
+            utils.write_json({"Protocol": args.protocol, "Plate Wells": args.well}, f"{out_name}.bulk_rna.protocol.stats.json")
+    split_perf.write(f"{args.sample}.bulk_rna.split_matrix.perf.json")
+    logger.info(f"{len(sub_samples)} sub-samples")
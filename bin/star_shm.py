@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+Keep STAR genomes in shared memory per node for concurrent STARSOLO tasks.
+
+STARSOLO runs STAR with `--genomeLoad LoadAndKeep`: the first STAR of a node loads the genome into a System V shared
+memory segment, the others attach to it, and the segment is kept after STAR exits. This script runs on the host,
+before and after the task(Nextflow beforeScript and afterScript), so the STAR container needs no python.
+`acquire` records the task as a holder. `release` drops it and records the genome of the task, and after the last
+holder of the node removes the shared memory of the recorded genomes, unless --keep is given.
+
+The state is kept in a json file in --state_dir, changed under an exclusive flock.
+A holder is the shell running the task(parent of this process). Holders whose process is gone, e.g. killed tasks,
+are dropped, so they do not keep the genomes loaded forever. Processes are only checked in the same pid namespace
+on the same host, holders in other namespaces are kept.
+
+    star_shm.py acquire --state_dir /tmp/bulk_rna_star_shm
+    STAR --genomeDir index --genomeLoad LoadAndKeep --limitBAMsortRAM 10000000000 ...
+    star_shm.py release --genome_dir index --state_dir /tmp/bulk_rna_star_shm
+"""
+
+import argparse
+import ctypes
+import fcntl
+import json
+import os
+import socket
+import sys
+from contextlib import contextmanager
+
+import utils
+
+logger = utils.get_logger(__name__)
+
+# STAR identifies the shared memory of a genome by ftok(genomeDir, SHM_projectID)
+SHM_PROJECT_ID = 23
+IPC_RMID = 0
+
+
+def process_id(pid):
+    """
+    Return:
+    dict identifying a process, including its start time so that a reused pid is not mistaken for it
+    """
+    with open(f"/proc/{pid}/stat") as f:
+        # the command name may contain spaces, fields after it are space separated
+        start_time = f.read().rsplit(")", 1)[1].split()[19]
+    return {
+        "pid": pid,
+        "start_time": start_time,
+        "host": socket.gethostname(),
+        "pidns": os.readlink("/proc/self/ns/pid"),
+    }
+
+
+def is_alive(holder):
+    """
+    False only if the holder can be checked from this process and is gone.
+    """
+    if holder["host"] != socket.gethostname() or holder["pidns"] != os.readlink("/proc/self/ns/pid"):
+        return True
+    try:
+        return process_id(holder["pid"])["start_time"] == holder["start_time"]
+    except (FileNotFoundError, ProcessLookupError):
+        return False
+
+
+def shm_key(genome_dir):
+    """
+    System V key of the shared memory of a genome, as computed by ftok() of glibc.
+    Bind mounts keep the device and inode of the directory, so the key is the same inside the container.
+    """
+    st = os.stat(genome_dir)
+    return (st.st_ino & 0xFFFF) | ((st.st_dev & 0xFF) << 16) | ((SHM_PROJECT_ID & 0xFF) << 24)
+
+
+def shm_segments():
+    """
+    Return:
+    shared memory segments of this IPC namespace {key: {"shmid": int, "size": int, "nattch": int}}
+    """
+    segments = {}
+    with open("/proc/sysvipc/shm") as f:
+        header = f.readline().split()
+        for line in f:
+            row = dict(zip(header, line.split()))
+            segments[int(row["key"])] = {x: int(row[x]) for x in ["shmid", "size", "nattch"]}
+    return segments
+
+
+def remove_segment(shmid):
+    """
+    Same as `STAR --genomeLoad Remove`. The memory is freed when the last attached process detaches.
+
+    Return:
+    True if removed
+    """
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.shmctl(shmid, IPC_RMID, None) != 0:
+        logger.warning(f"Can not remove shared memory {shmid}: {os.strerror(ctypes.get_errno())}")
+        return False
+    return True
+
+
+class ShmState:
+    """
+    Holders and genomes in shared memory of one node.
+
+    Args:
+        state_dir: node-local directory shared by all tasks
+    """
+
+    def __init__(self, state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_file = os.path.join(state_dir, "star_shm.json")
+        self.lock_file = os.path.join(state_dir, "star_shm.lock")
+        self.data = None
+
+    @contextmanager
+    def locked(self):
+        """
+        Read the state under an exclusive lock, write it back on exit.
+        """
+        with open(self.lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.state_file):
+                    with open(self.state_file) as f:
+                        self.data = json.load(f)
+                else:
+                    self.data = {"holders": [], "genomes": {}}
+                alive = [holder for holder in self.data["holders"] if is_alive(holder)]
+                if len(alive) < len(self.data["holders"]):
+                    logger.warning(f"Dropped {len(self.data['holders']) - len(alive)} holders that are gone")
+                self.data["holders"] = alive
+                yield self.data
+                tmp = self.state_file + ".tmp"
+                utils.write_json(self.data, tmp)
+                os.replace(tmp, self.state_file)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def remove(genomes):
+        """
+        Remove the shared memory of genomes {genome_dir: key}, and drop those removed or not loaded.
+        """
+        segments = shm_segments()
+        for genome_dir, key in list(genomes.items()):
+            if key not in segments:
+                logger.info(f"{genome_dir} is not in shared memory")
+            elif remove_segment(segments[key]["shmid"]):
+                logger.info(f"Removed {genome_dir} from shared memory, {segments[key]['size']} bytes")
+            else:
+                continue
+            del genomes[genome_dir]
+
+    def acquire(self, holder):
+        with self.locked() as data:
+            data["holders"].append(holder)
+            logger.info(f"{len(data['holders'])} holders")
+
+    def release(self, holder, genome_dir=None, keep=False):
+        with self.locked() as data:
+            if holder in data["holders"]:
+                data["holders"].remove(holder)
+            if genome_dir:
+                data["genomes"][genome_dir] = shm_key(genome_dir)
+            logger.info(f"{len(data['holders'])} holders")
+            if not data["holders"] and not keep:
+                self.remove(data["genomes"])
+
+    def unload(self, genome_dir=None, force=False):
+        with self.locked() as data:
+            if data["holders"] and not force:
+                sys.exit(f"{len(data['holders'])} tasks still use the shared memory. Use --force to remove anyway.")
+            genomes = {genome_dir: shm_key(genome_dir)} if genome_dir else data["genomes"]
+            self.remove(genomes)
+            if genome_dir and not genomes:
+                data["genomes"].pop(genome_dir, None)
+
+    def status(self):
+        with self.locked() as data:
+            segments = shm_segments()
+            genomes = {x: segments.get(key) for x, key in data["genomes"].items()}
+            json.dump({"holders": data["holders"], "genomes": genomes}, sys.stdout, indent=4)
+            sys.stdout.write("\n")
+
+
+def genome_path(genome_dir):
+    """
+    Symlinks are resolved, STAR identifies the shared memory by the directory.
+    """
+    path = os.path.realpath(genome_dir)
+    if not os.path.isfile(os.path.join(path, "SA")):
+        sys.exit(f"{genome_dir} is not a STAR genome directory!")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=["acquire", "release", "unload", "status"])
+    parser.add_argument("--state_dir", required=True, help="Node-local directory shared by all tasks.")
+    parser.add_argument("--genome_dir", help="STAR genome directory of the task. release: recorded to be removed after the last holder. unload: only remove this genome.")
+    parser.add_argument("--holder_pid", type=int, help="Process holding the genome. Default the parent process.")
+    parser.add_argument("--keep", action="store_true", help="release: keep the genomes loaded after the last holder.")
+    parser.add_argument("--force", action="store_true", help="unload: remove the genomes even if there are holders.")
+    args = parser.parse_args()
+
+    state = ShmState(args.state_dir)
+    genome_dir = genome_path(args.genome_dir) if args.genome_dir else None
+    holder = process_id(args.holder_pid or os.getppid())
+    if args.action == "acquire":
+        state.acquire(holder)
+    elif args.action == "release":
+        state.release(holder, genome_dir, args.keep)
+    elif args.action == "unload":
+        state.unload(genome_dir, args.force)
+    else:
+        state.status()
@@ -1,39 +1,171 @@
 #!/usr/bin/env python
 
 import argparse
-from collections import defaultdict
-
-import pandas as pd
+import csv
+import json
+import statistics
+import sys
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from itertools import accumulate, islice
 
+import perf
 import utils
 import parse_protocol
 
-def parse_read_stats(read_stats):
-    dtypes = defaultdict(lambda: "int")
-    dtypes["CB"] = "object"
-    df = pd.read_csv(
-        read_stats, sep="\t", header=0, index_col=0, skiprows=[1], dtype=dtypes
-    )
-    df_bc = df.loc[:,["nUMIunique",'countedU','nGenesUnique']]
-    df_bc.columns = ['UMI', 'read', 'gene']
-    df_bc = df_bc.sort_values('UMI', ascending=False)
-
-    df = df.loc[
-        :, ["cbMatch", "cbPerfect", "genomeU", "genomeM", "exonic", "intronic", "exonicAS", "intronicAS", "countedU"]
-    ]
-    s = df.sum()
-    # json does not recognize NumPy data types. TypeError: Object of type int64 is not JSON serializable
-    valid = int(s["cbMatch"])
-    perfect = int(s["cbPerfect"])
+logger = utils.get_logger(__name__)
+
+# columns of CellReads.stats summed over all barcodes
+SUM_COLUMNS = ["cbMatch", "cbPerfect", "genomeU", "genomeM", "exonic", "intronic", "exonicAS", "intronicAS", "countedU"]
+# per barcode columns
+BC_COLUMNS = {"nUMIunique": "UMI", "countedU": "read", "nGenesUnique": "gene"}
+
+# chunks with at least this many rows are converted with numpy if it is installed
+NUMPY_MIN_ROWS = 10000
+
+def int_columns(lines, indices):
+    """
+    Convert columns of tab separated lines to unsigned 32-bit integers.
+
+    Return:
+    list of array("I"), one per index
+
+    >>> int_columns(["a\\t1\\t2\\n", "b\\t3\\t4\\n"], [2, 1])
+    [array('I', [2, 4]), array('I', [1, 3])]
+    """
+    np = utils.optional_import("numpy") if len(lines) >= NUMPY_MIN_ROWS else None
+    if np is not None:
+        arr = np.loadtxt(lines, delimiter="\t", usecols=indices, dtype=np.uint32, ndmin=2)
+        return [array("I", arr[:, i].tobytes()) for i in range(len(indices))]
+    rows = [line.rstrip("\n").split("\t") for line in lines]
+    return [array("I", [int(row[i]) for row in rows]) for i in indices]
+
+def descending_order(values, counts):
+    """
+    Stable order of values from large to small, by counting sort into an array instead of a list of indices.
+
+    Args:
+        values: array of int
+        counts: Counter of values
+
+    >>> descending_order(array("I", [1, 3, 1, 2]), Counter([1, 3, 1, 2]))
+    array('I', [1, 3, 0, 2])
+    """
+    np = utils.optional_import("numpy") if len(values) >= NUMPY_MIN_ROWS else None
+    if np is not None:
+        # stable sort of the negated values keeps ties in order
+        order = np.argsort(-np.frombuffer(values, dtype=np.uint32).astype(np.int64), kind="stable")
+        return array("I", order.astype(np.uint32).tobytes())
+    # first position of each value
+    pos = {}
+    total = 0
+    for value in sorted(counts, reverse=True):
+        pos[value] = total
+        total += counts[value]
+    order = array("I", bytes(4 * total))
+    for i, value in enumerate(values):
+        order[pos[value]] = i
+        pos[value] += 1
+    return order
+
+class StrColumn:
+    """
+    Column of str kept as one str per chunk and the end offset of each row, instead of a str object per row.
+    If order is set, row i is the order[i]-th appended row.
+
+    >>> col = StrColumn()
+    >>> col.extend(["AC", "G"])
+    >>> col.extend(["TTT"])
+    >>> list(col), len(col)
+    (['AC', 'G', 'TTT'], 3)
+    >>> col.order = array("I", [2, 0, 1])
+    >>> list(col)
+    ['TTT', 'AC', 'G']
+    """
+
+    def __init__(self):
+        self.chunks = []
+        # index of the first row of each chunk
+        self.first = []
+        self.ends = array("I")
+        self.order = None
+
+    def extend(self, values):
+        self.first.append(len(self.ends))
+        self.chunks.append("".join(values))
+        self.ends.extend(accumulate(map(len, values)))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        if self.order is not None:
+            i = self.order[i]
+        c = bisect_right(self.first, i) - 1
+        start = self.ends[i - 1] if i > self.first[c] else 0
+        return self.chunks[c][start:self.ends[i]]
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+def parse_read_stats(read_stats, chunksize=200000):
+    """
+    Only the needed columns are converted, chunksize rows at a time. Each chunk is reduced to the sums of the mapping
+    columns, the per barcode columns in uint32 arrays, its barcodes in a StrColumn and a UMI histogram, so no object
+    is kept per row. Rows are ordered with the histogram by descending_order.
+    Large chunks are converted with numpy if it is installed, so the script does not depend on it.
+
+    Return:
+    per barcode table {"CB": StrColumn, "UMI": array, "read": array, "gene": array} sorted by UMI descending
+    dict of mapping metrics
+    """
+    s = dict.fromkeys(SUM_COLUMNS, 0)
+    table = {"CB": StrColumn()}
+    table.update({col: array("I") for col in BC_COLUMNS.values()})
+    umi_counts = Counter()
+    int_cols = list(dict.fromkeys(SUM_COLUMNS + list(BC_COLUMNS)))
+    with utils.openfile(read_stats) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        indices = [header.index(col) for col in int_cols]
+        # CBnotInPasslist
+        f.readline()
+        while True:
+            lines = list(islice(f, chunksize))
+            if not lines:
+                break
+            cols = dict(zip(int_cols, int_columns(lines, indices)))
+            for col in SUM_COLUMNS:
+                s[col] += sum(cols[col])
+            table["CB"].extend([line[:line.index("\t")] for line in lines])
+            for col, name in BC_COLUMNS.items():
+                table[name].extend(cols[col])
+            umi_counts.update(cols["nUMIunique"])
+
+    # stable, ties keep the order of CellReads.stats
+    order = descending_order(table["UMI"], umi_counts)
+    table["CB"].order = order
+    for name in BC_COLUMNS.values():
+        table[name] = array("I", map(table[name].__getitem__, order))
+
+    return table, mapping_metrics(s)
+
+def mapping_metrics(s):
+    """
+    Args:
+        s: SUM_COLUMNS summed over barcodes
+    """
+    valid = s["cbMatch"]
+    perfect = s["cbPerfect"]
     corrected = valid - perfect
-    genome_uniq = int(s["genomeU"])
-    genome_multi = int(s["genomeM"])
+    genome_uniq = s["genomeU"]
+    genome_multi = s["genomeM"]
     mapped = genome_uniq + genome_multi
-    exonic = int(s["exonic"])
-    intronic = int(s["intronic"])
-    antisense = int(s["exonicAS"] + s["intronicAS"])
+    exonic = s["exonic"]
+    intronic = s["intronic"]
+    antisense = s["exonicAS"] + s["intronicAS"]
     intergenic = mapped - exonic - intronic - antisense
-    counted_uniq = int(s["countedU"])
+    counted_uniq = s["countedU"]
     data_dict = {
         "Corrected Barcodes": corrected / valid,
         "Reads Mapped To Unique Loci": genome_uniq / valid,
@@ -46,19 +178,186 @@ def parse_read_stats(read_stats):
     }
     for k in data_dict:
         data_dict[k] = utils.get_frac(data_dict[k])
+    return data_dict
 
-    return df_bc, data_dict
-
-def well_bctonum(df, file):
+def get_bc_well(file):
+    """
+    Return:
+    Key: barcode in whitelist file, value: well{n}, n is the 1-based line number
+    """
     barcodes = utils.read_one_col(file)
     n = 1
     data = {}
     for i in barcodes:
         data[i] = f"well{n}"
         n += 1
-    df["BC"] = df.index
-    df.index = df.index.map(data)
-    return(df)
+    return data
+
+class RenamedColumn:
+    """
+    View of a column with values renamed by a dict, values not in it are kept.
+
+    >>> list(RenamedColumn(["AC", "GT"], {"AC": "well1"}))
+    ['well1', 'GT']
+    """
+
+    def __init__(self, column, names):
+        self.column = column
+        self.names = names
+
+    def __len__(self):
+        return len(self.column)
+
+    def __getitem__(self, i):
+        value = self.column[i]
+        return self.names.get(value, value)
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+def well_bctonum(table, file=None, bc_well=None):
+    """
+    Rename barcodes to wells. The barcodes are moved to the BC column. Barcodes not in the whitelist are kept.
+    """
+    data = bc_well if bc_well is not None else get_bc_well(file)
+    table["BC"] = table["CB"]
+    table["CB"] = RenamedColumn(table["BC"], data)
+    return table
+
+def write_table(table, fn, rows=None):
+    """
+    Tab separated, first column is CB
+    """
+    if rows is None:
+        rows = range(len(table["CB"]))
+    cols = list(table)
+    with open(fn, "w", newline="") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(cols)
+        writer.writerows([table[col][i] for col in cols] for i in rows)
+
+def get_protocol_bc_well(assets_dir, protocol):
+    """
+    Return:
+    barcode to well mapping of the protocol, None if wells are not named
+    """
+    if protocol == 'AccuraCode-V1':
+        protocol_dict = parse_protocol.get_protocol_dict(assets_dir)
+        return get_bc_well(protocol_dict[protocol]["well384"])
+    return None
+
+def write_sample(sample, table, data_dict, raw_reads, valid_frac, umi_cutoff=500, read_cutoff=0, gene_cutoff=0):
+    """
+    Write the json and counts files of one sample.
+
+    Args:
+        table: per barcode table, see parse_read_stats
+        data_dict: mapping metrics
+        valid_frac: fraction of raw reads with valid barcodes
+    """
+    # out file
+    read_stats_file = sample + ".bulk_rna.read.stats.json"
+    summary_file = sample + ".bulk_rna.starsolo.stats.json"
+
+    raw_count_file = sample + '.bulk_rna.counts.txt'
+    marked_count_file = sample + '.bulk_rna.counts_report.txt'
+    marked_count_json = sample + '.bulk_rna.counts_report.json'
+
+    utils.write_json(data_dict, read_stats_file)
+
+    # Detailed information per Well
+    write_table(table, raw_count_file)
+    umi, read, gene = table["UMI"], table["read"], table["gene"]
+    all_rows = range(len(umi))
+    valid_rows = [i for i in all_rows if umi[i]>=umi_cutoff and read[i]>=read_cutoff and gene[i]>=gene_cutoff]
+    if not valid_rows:
+        valid_rows = [i for i in all_rows if umi[i]>0 and read[i]>0 and gene[i]>0]
+    write_table(table, marked_count_file, valid_rows)
+    cols = [col for col in table if col != "CB"]
+    utils.write_json({table["CB"][i]: {col: table[col][i] for col in cols} for i in valid_rows}, marked_count_json)
+
+    def describe(col, func):
+        return int(func([table[col][i] for i in valid_rows])) if valid_rows else 0
+
+    data_dict = {
+        "Raw Reads" : raw_reads,
+        "Valid Reads" : utils.get_frac(valid_frac),
+        "Median Reads per Well" : describe("read", statistics.median),
+        "Median UMI per Well" : describe("UMI", statistics.median),
+        "Median Genes per Well" : describe("gene", statistics.median),
+        "Mean Reads per Well" : describe("read", statistics.fmean),
+        "Mean UMI per Well" : describe("UMI", statistics.fmean),
+        "Mean Genes per Well" : describe("gene", statistics.fmean),
+    }
+    # summary
+    utils.write_json(data_dict, summary_file)
+
+def summarize(sample, read_stats, summary, bc_well=None, umi_cutoff=500, read_cutoff=0, gene_cutoff=0, prefilter_stats=None):
+    """
+    Write the json and counts files of one sample.
+    """
+    summary_perf = perf.Perf("starsolo_summary", sample)
+    with summary_perf.phase("read_stats"):
+        table, data_dict = parse_read_stats(read_stats)
+        if bc_well is not None:
+            table = well_bctonum(table, bc_well=bc_well)
+        summary_perf.count("barcodes", len(table["CB"]))
+
+    with summary_perf.phase("write"):
+        data_summary = utils.csv2dict(summary)
+        raw_reads = int(data_summary['Number of Reads'])
+        valid_frac = float(data_summary["Reads With Valid Barcodes"])
+        if prefilter_stats:
+            # STARsolo only saw the reads kept by the prefilter
+            with open(prefilter_stats) as f:
+                removed = json.load(f)["Prefilter Removed Reads"]
+            if raw_reads + removed:
+                valid_frac = valid_frac * raw_reads / (raw_reads + removed)
+            raw_reads += removed
+        write_sample(sample, table, data_dict, raw_reads, valid_frac, umi_cutoff, read_cutoff, gene_cutoff)
+    summary_perf.write(sample + ".bulk_rna.starsolo_summary.perf.json")
+    return sample
+
+_bc_well = None
+_cutoffs = {}
+
+def init_worker(bc_well, cutoffs):
+    global _bc_well, _cutoffs
+    _bc_well = bc_well
+    _cutoffs = cutoffs
+
+def summarize_row(row):
+    return summarize(
+        row["sample"], row["read_stats"], row["summary"], _bc_well, prefilter_stats=row.get("prefilter_stats"), **_cutoffs
+    )
+
+def read_manifest(manifest):
+    """
+    tab separated file with header: sample, read_stats, summary and optional prefilter_stats
+    """
+    with open(manifest, newline="") as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+    for row in rows:
+        for col in ["sample", "read_stats", "summary"]:
+            if not row.get(col):
+                sys.exit(f"Missing {col} in manifest {manifest}: {row}")
+    return rows
+
+def run_batch(rows, bc_well, cutoffs, threads=1):
+    """
+    Summarize many samples in one process, or a pool of processes. The whitelist mapping is read once.
+    """
+    init_args = (bc_well, cutoffs)
+    if threads > 1 and len(rows) > 1:
+        import multiprocessing
+
+        with multiprocessing.Pool(min(threads, len(rows)), initializer=init_worker, initargs=init_args) as pool:
+            for sample in pool.imap_unordered(summarize_row, rows):
+                logger.info(f"{sample} done")
+    else:
+        init_worker(*init_args)
+        for row in rows:
+            logger.info(f"{summarize_row(row)} done")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Starsolo summary")
@@ -76,45 +375,23 @@ if __name__ == "__main__":
     parser.add_argument('--read_cutoff', default=0, type=int,
         help='If the read number exceeds the threshold, it is considered a valid well and reported.'
     )
+    parser.add_argument('--prefilter_stats',
+        help='prefilter_barcode.py stats json. Removed reads are added back to Raw Reads and Valid Reads.'
+    )
+    parser.add_argument('--manifest',
+        help='Batch mode. Tab separated file with header sample, read_stats, summary and optional prefilter_stats. '
+        'Each sample writes the same files as a single run. --read_stats, --summary, --sample and --prefilter_stats are ignored.'
+    )
+    parser.add_argument('--threads', default=1, type=int,
+        help='Number of processes in batch mode.'
+    )
     args = parser.parse_args()
 
-
-    df_well, data_dict = parse_read_stats(args.read_stats)
-
-    if args.protocol == 'AccuraCode-V1':
-        protocol_dict = parse_protocol.get_protocol_dict(args.assets_dir)
-        whitelist_str = protocol_dict[args.protocol].get("well384", [])
-        df_well = well_bctonum(df_well,whitelist_str)
-
-    # out file
-    read_stats_file = args.sample + ".bulk_rna.read.stats.json"
-    summary_file = args.sample + ".bulk_rna.starsolo.stats.json"
-
-    raw_count_file = args.sample + '.bulk_rna.counts.txt'
-    marked_count_file = args.sample + '.bulk_rna.counts_report.txt'
-    marked_count_json = args.sample + '.bulk_rna.counts_report.json'
-    
-    utils.write_json(data_dict, read_stats_file)
-
-    # Detailed information per Well
-    df_well.to_csv(raw_count_file, sep='\t')
-    df_well_valid = df_well[ (df_well['UMI']>=args.umi_cutoff) & (df_well['read']>=args.read_cutoff) & (df_well['gene']>=args.gene_cutoff) ]
-    if df_well_valid.shape[0]==0:
-        df_well_valid = df_well[ (df_well['UMI']>0) & (df_well['read']>0) & (df_well['gene']>0) ]
-    df_well_valid.to_csv(marked_count_file, sep='\t')
-    utils.write_json(df_well_valid.to_dict('index'), marked_count_json)
-    
-    data_summary = utils.csv2dict(args.summary)
-    stats = df_well_valid.describe()
-    data_dict = {
-        "Raw Reads" : int(data_summary['Number of Reads']),
-        "Valid Reads" : utils.get_frac(data_summary["Reads With Valid Barcodes"]),
-        "Median Reads per Well" : int(stats.loc['50%',"read"]),
-        "Median UMI per Well" : int(stats.loc['50%',"UMI"]),
-        "Median Genes per Well" : int(stats.loc['50%',"gene"]),
-        "Mean Reads per Well" : int(stats.loc["mean","read"]),
-        "Mean UMI per Well" : int(stats.loc["mean","UMI"]),
-        "Mean Genes per Well" : int(stats.loc["mean","gene"])
-    }
-    # summary
-    utils.write_json(data_dict, summary_file)
\ No newline at end of file
+    bc_well = get_protocol_bc_well(args.assets_dir, args.protocol)
+    cutoffs = {"umi_cutoff": args.umi_cutoff, "read_cutoff": args.read_cutoff, "gene_cutoff": args.gene_cutoff}
+    if args.manifest:
+        run_batch(read_manifest(args.manifest), bc_well, cutoffs, args.threads)
+    else:
+        if not (args.read_stats and args.summary and args.sample):
+            sys.exit("--read_stats, --summary and --sample are required without --manifest")
+        summarize(args.sample, args.read_stats, args.summary, bc_well, prefilter_stats=args.prefilter_stats, **cutoffs)
@@ -1,9 +1,36 @@
+import bz2
 import csv
+import functools
+import importlib
 import json
 import logging
 import gzip
+import lzma
+import os
+import stat
 import sys
 
+@functools.lru_cache(maxsize=None)
+def optional_import(name):
+    """
+    Import an optional module on first use, so scripts that do not need it start fast.
+
+    Return:
+        the module or None if it is not installed
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+def get_xopen():
+    """
+    Return:
+        xopen.xopen or None if xopen is not installed
+    """
+    module = optional_import("xopen")
+    return module.xopen if module else None
+
 def get_logger(name, level=logging.INFO):
     """out to stderr"""
     logger = logging.getLogger(name)
@@ -33,10 +60,72 @@ def read_one_col(fn):
     with openfile(fn) as f:
         return [x.strip() for x in f]
 
-def openfile(file_name, mode="rt", **kwargs):
-    """open gzip or plain file"""
-    if file_name.endswith(".gz"):
-        file_obj = gzip.open(file_name, mode=mode, **kwargs)
+# magic bytes of compressed files
+MAGIC = [
+    (b"\x1f\x8b", "gz"),
+    (b"\x28\xb5\x2f\xfd", "zst"),
+    (b"\x42\x5a\x68", "bz2"),
+    (b"\xfd\x37\x7a\x58\x5a\x00", "xz"),
+]
+EXTENSIONS = {".gz": "gz", ".zst": "zst", ".bz2": "bz2", ".xz": "xz"}
+READ_BUFFER_SIZE = 1 << 20
+
+def detect_format(file_name):
+    """
+    Detect compression by magic bytes.
+    Bytes read from a pipe(FIFO) are lost to the reader opened after, so the compression of a pipe is detected by
+    the file extension instead.
+
+    Return:
+        gz, bgzf, zst, bz2, xz or None for uncompressed files
+    """
+    if stat.S_ISFIFO(os.stat(file_name).st_mode):
+        return EXTENSIONS.get(os.path.splitext(file_name)[1])
+    with open(file_name, "rb") as f:
+        head = f.read(18)
+    for magic, fmt in MAGIC:
+        if head.startswith(magic):
+            # BGZF is gzip with a BC extra subfield
+            if fmt == "gz" and len(head) >= 14 and head[3] & 4 and head[12:14] == b"BC":
+                return "bgzf"
+            return fmt
+    return None
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def openfile(file_name, mode="rt", threads=None, **kwargs):
+    """
+    open plain or compressed file.
+
+    When reading, compression is detected by magic bytes instead of file extension. Compressed files are
+    decompressed by xopen, which uses igzip/pigz/zstd processes or python-isal when available.
+    When writing, files ending with .gz are gzip compressed.
+
+    Args:
+        threads: passed to xopen. 0 decompresses in-process. None uses xopen's default if more than one CPU is
+            available, else 0, since a decompression process competing for a single CPU is slower than python-isal.
+    """
+    if "r" in mode:
+        fmt = detect_format(file_name)
     else:
-        file_obj = open(file_name, mode=mode, **kwargs)
-    return file_obj
\ No newline at end of file
+        fmt = "gz" if file_name.endswith(".gz") else None
+    if fmt is None:
+        return open(file_name, mode=mode, buffering=READ_BUFFER_SIZE, **kwargs)
+    # BGZF is read as multi-member gzip
+    fmt = "gz" if fmt == "bgzf" else fmt
+    xopen = get_xopen()
+    if xopen is not None:
+        if threads is None and available_cpus() < 2:
+            threads = 0
+        return xopen(file_name, mode=mode, threads=threads, format=fmt, **kwargs)
+    if fmt == "gz":
+        return gzip.open(file_name, mode=mode, **kwargs)
+    if fmt == "bz2":
+        return bz2.open(file_name, mode=mode, **kwargs)
+    if fmt == "xz":
+        return lzma.open(file_name, mode=mode, **kwargs)
+    sys.exit(f"xopen is required to open {fmt} file: {file_name}")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+import parse_protocol
+import starsolo_summary
+import utils
+
+logger = utils.get_logger(__name__)
+
+MITO_PATTERN = re.compile(r"^mt-", re.IGNORECASE)
+
+
+def read_mtx_header(mtx_file):
+    """
+    Return:
+    field(integer or real), (n_row, n_col, nnz), number of header lines
+    """
+    with utils.openfile(mtx_file) as f:
+        banner = f.readline()
+        if not banner.startswith("%%MatrixMarket matrix coordinate"):
+            sys.exit(f"Not a MatrixMarket coordinate file: {mtx_file}")
+        field = banner.split()[3]
+        n_header = 1
+        for line in f:
+            n_header += 1
+            if not line.startswith("%"):
+                shape = tuple(int(x) for x in line.split())
+                return field, shape, n_header
+    sys.exit(f"No size line in {mtx_file}")
+
+
+def read_mtx(mtx_file, chunksize=5000000, real_dtype=np.float32):
+    """
+    Read MatrixMarket coordinate file in chunks into a CSC matrix.
+
+    Args:
+        real_dtype: dtype of real values. float32 halves the memory of the well metrics, sums that are written back
+            need float64.
+
+    Return:
+    data, indices(0-based row), indptr, shape
+    """
+    field, (n_row, n_col, nnz), n_header = read_mtx_header(mtx_file)
+    value_dtype = real_dtype if field == "real" else np.uint32
+    rows = np.empty(nnz, dtype=np.int32)
+    cols = np.empty(nnz, dtype=np.int32)
+    data = np.empty(nnz, dtype=value_dtype)
+    n = 0
+    reader = pd.read_csv(
+        mtx_file,
+        sep=" ",
+        header=None,
+        skiprows=n_header,
+        names=["row", "col", "value"],
+        dtype={"row": np.int32, "col": np.int32, "value": value_dtype},
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        end = n + len(chunk)
+        if end > nnz:
+            sys.exit(f"More entries than the size line of {mtx_file}")
+        # MatrixMarket is 1-based
+        rows[n:end] = chunk["row"].to_numpy() - 1
+        cols[n:end] = chunk["col"].to_numpy() - 1
+        data[n:end] = chunk["value"].to_numpy()
+        n = end
+    if n != nnz:
+        sys.exit(f"Expected {nnz} entries in {mtx_file}, found {n}")
+
+    order = np.lexsort((rows, cols))
+    indices = rows[order]
+    data = data[order]
+    indptr = np.zeros(n_col + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cols, minlength=n_col), out=indptr[1:])
+    return data, indices, indptr, (n_row, n_col)
+
+
+def well_metrics(data, indices, indptr, gene_names, top_n=10):
+    """
+    Per column metrics of a CSC matrix, vectorized over all non-zero entries.
+
+    >>> data = np.array([5, 1, 3, 4], dtype=np.uint32)
+    >>> indices = np.array([0, 2, 1, 2], dtype=np.int32)
+    >>> indptr = np.array([0, 2, 2, 4])
+    >>> df = well_metrics(data, indices, indptr, np.array(["A", "B", "mt-C"]), top_n=1)
+    >>> df["UMI"].tolist(), df["gene"].tolist(), df["top_gene"].tolist(), df["top_gene_fraction"].tolist()
+    ([6, 0, 7], [2, 0, 2], ['A', '', 'mt-C'], [83.33, 0.0, 57.14])
+    """
+    n_col = len(indptr) - 1
+    nnz_col = np.diff(indptr)
+    cols = np.repeat(np.arange(n_col), nnz_col)
+    values = data.astype(np.float64)
+    umi = np.bincount(cols, weights=values, minlength=n_col)
+    genes = np.bincount(cols, weights=values > 0, minlength=n_col)
+    is_mito = np.array([bool(MITO_PATTERN.match(x)) for x in gene_names])
+    mito = np.bincount(cols, weights=values * is_mito[indices], minlength=n_col)
+
+    # rank of each entry in its column, by value descending
+    order = np.lexsort((-values, cols))
+    rank = np.arange(len(order)) - indptr[cols[order]]
+    top_sum = np.bincount(cols[order], weights=values[order] * (rank < top_n), minlength=n_col)
+    first = order[indptr[:-1][nnz_col > 0]]
+    top_gene = np.full(n_col, "", dtype=object)
+    top_gene[nnz_col > 0] = gene_names[indices[first]]
+    top_value = np.zeros(n_col)
+    top_value[nnz_col > 0] = values[first]
+
+    def frac(x):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.round(np.where(umi > 0, x / umi, 0.0) * 100, 2)
+
+    return pd.DataFrame(
+        {
+            "UMI": umi.astype(np.int64),
+            "gene": genes.astype(np.int64),
+            "top_gene": top_gene,
+            "top_gene_fraction": frac(top_value),
+            f"top{top_n}_fraction": frac(top_sum),
+            "mito_fraction": frac(mito),
+        }
+    )
+
+
+def save_npz(fn, data, indices, indptr, shape, **arrays):
+    """
+    Same layout as scipy.sparse.save_npz(compressed=False), so the matrix can be loaded with
+    scipy.sparse.load_npz(fn), or with numpy only. Extra arrays(gene ids, wells) are saved alongside.
+    """
+    np.savez(
+        fn,
+        data=data,
+        indices=indices,
+        indptr=indptr,
+        format=np.array(b"csc"),
+        shape=np.array(shape),
+        **arrays,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per well metrics and binary matrix from STARsolo raw matrix")
+    parser.add_argument("--matrix_dir", required=True, help="STARsolo raw matrix directory")
+    parser.add_argument("--sample", required=True)
+    parser.add_argument("--assets_dir", required=True)
+    parser.add_argument("--protocol", required=True)
+    parser.add_argument("--top_n", type=int, default=10, help="Fraction of UMI in the top n genes of each well.")
+    args = parser.parse_args()
+
+    def find(name):
+        for fn in [name + ".gz", name]:
+            path = os.path.join(args.matrix_dir, fn)
+            if os.path.exists(path):
+                return path
+        sys.exit(f"{name} not found in {args.matrix_dir}")
+
+    features = [x.split("\t") for x in utils.read_one_col(find("features.tsv"))]
+    gene_ids = np.array([x[0] for x in features])
+    gene_names = np.array([x[1] if len(x) > 1 else x[0] for x in features])
+    barcodes = np.array(utils.read_one_col(find("barcodes.tsv")))
+    data, indices, indptr, shape = read_mtx(find("matrix.mtx"))
+    if shape != (len(gene_ids), len(barcodes)):
+        sys.exit(f"Matrix shape {shape} does not match features and barcodes")
+
+    # same well names as starsolo_summary
+    wells = barcodes
+    if args.protocol == "AccuraCode-V1":
+        protocol_dict = parse_protocol.get_protocol_dict(args.assets_dir)
+        bc_well = starsolo_summary.get_bc_well(protocol_dict[args.protocol]["well384"])
+        wells = np.array([bc_well.get(x, x) for x in barcodes])
+
+    df = well_metrics(data, indices, indptr, gene_names, args.top_n)
+    df.insert(0, "BC", barcodes)
+    df.index = pd.Index(wells, name="well")
+    df.to_csv(f"{args.sample}.bulk_rna.well_metrics.tsv", sep="\t")
+    save_npz(
+        f"{args.sample}.bulk_rna.matrix.npz",
+        data,
+        indices,
+        indptr,
+        shape,
+        gene_ids=gene_ids,
+        gene_names=gene_names,
+        barcodes=barcodes,
+        wells=wells,
+    )
+    logger.info(f"{shape[1]} wells, {shape[0]} genes, {len(data)} non-zero entries")
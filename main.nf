@@ -29,12 +29,14 @@ include { PIPELINE_COMPLETION     } from './subworkflows/local/utils_nfcore_bulk
 workflow SINGLERONRD_BULK_RNA {
 
     take:
-    samplesheet // channel: samplesheet read in from --input
+    samplesheet   // channel: samplesheet read in from --input, or sub-samples from split_fastq
+    multiqc_files // channel: extra files for MultiQC
 
     main:
     // WORKFLOW: Run pipeline
     BULK_RNA (
-        samplesheet
+        samplesheet,
+        multiqc_files
     )
 
     emit:
@@ -49,6 +51,10 @@ workflow PIPELINE_SPLITFASTQ{
 
     main:
     SPLITFASTQ (samplesheet)
+
+    emit:
+    reads         = SPLITFASTQ.out.reads         // channel: [ val(meta), [ reads ] ] of each sub-sample
+    multiqc_files = SPLITFASTQ.out.multiqc_files // channel: demux and perf json
 }
 
 
@@ -72,14 +78,26 @@ workflow {
     )
 
     // choose which workflow
+    ch_bulk_rna = null
+    ch_multiqc_extra = Channel.empty()
     if (params.run_splitfastq){
         PIPELINE_SPLITFASTQ(
             PIPELINE_INITIALISATION.out.samplesheet
         )
+        if (params.split_run_bulk_rna) {
+            // each sub-sample goes through the main workflow as a sample
+            ch_bulk_rna = PIPELINE_SPLITFASTQ.out.reads
+            ch_multiqc_extra = PIPELINE_SPLITFASTQ.out.multiqc_files
+        }
     } else {
+        ch_bulk_rna = PIPELINE_INITIALISATION.out.samplesheet
+    }
+
+    if (ch_bulk_rna) {
         // WORKFLOW: Run main workflow
         SINGLERONRD_BULK_RNA (
-            PIPELINE_INITIALISATION.out.samplesheet
+            ch_bulk_rna,
+            ch_multiqc_extra
             )
         
         // SUBWORKFLOW: Run completion tasks
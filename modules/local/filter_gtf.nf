@@ -16,11 +16,13 @@ process FILTER_GTF {
     output:
     path "*.filtered.gtf", emit: filtered_gtf
     path "gtf_filter.log", emit: log_file
+    path "*.perf.json", emit: perf
+    path "*.prof", optional: true, emit: profile
 
     script:
     def args = task.ext.args ?: ''
 
     """
-    filter_gtf.py ${gtf} \"${attributes}\"
+    filter_gtf.py ${gtf} \"${attributes}\" $args
     """
 }
\ No newline at end of file
@@ -0,0 +1,35 @@
+process GENOME_CACHE_PUBLISH {
+    tag "$key"
+    label 'process_single'
+
+    conda 'conda-forge::python==3.12'
+    container "biocontainers/python:3.12"
+
+    input:
+    path index
+    // staged as a link to the cache root, so that it is mounted in the container
+    path cache_root, stageAs: 'genome_cache'
+    val key
+    val info
+
+    output:
+    val key, emit: key
+
+    script:
+    // renamed to the key, which is atomic on the same file system, so other runs never see a partial index
+    def tmp = "genome_cache/.tmp.${key}.${workflow.sessionId}"
+    """
+    rm -rf ${tmp}
+    cp -rL ${index} ${tmp}
+    cat <<-'END_INFO' > ${tmp}/cache_key.json
+    ${info}
+    END_INFO
+    if python -c 'import os, sys; os.rename(sys.argv[1], sys.argv[2])' ${tmp} genome_cache/${key}; then
+        echo "STAR genome published to cache: ${key}"
+    else
+        # published by another run in the meantime
+        rm -rf ${tmp}
+    fi
+    rm -f genome_cache/${key}.lock
+    """
+}
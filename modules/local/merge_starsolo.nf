@@ -0,0 +1,33 @@
+process MERGE_STARSOLO {
+    tag "$meta.id"
+    label 'process_medium'
+
+    conda 'conda-forge::pandas==2.2.1'
+    container "biocontainers/pandas:2.2.1"
+
+    input:
+    // Solo.out and matrix directories of all shards of a sample, in shard order
+    tuple val(meta), path(solo_out, stageAs: "shard?/*"), path(matrix, stageAs: "shard?/*")
+
+    output:
+    tuple val(meta), path("${meta.id}.matrix/")    , emit: matrix
+    tuple val(meta), path("${meta.id}.Solo.out")   , emit: solo_out
+    tuple val(meta), path("${meta.id}.Solo.out/GeneFull_Ex50pAS/Summary.csv")    , emit: summary
+    tuple val(meta), path("${meta.id}.Solo.out/GeneFull_Ex50pAS/CellReads.stats"), emit: read_stats
+    path "*.perf.json"                             , emit: perf
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    """
+    merge_starsolo.py \\
+        --sample ${meta.id} \\
+        --solo_out ${solo_out.join(' ')} \\
+        --matrix ${matrix.join(' ')} \\
+        $args
+
+    gzip ${meta.id}.matrix/raw/*
+    """
+}
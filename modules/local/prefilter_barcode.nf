@@ -0,0 +1,43 @@
+process PREFILTER_BARCODE {
+    tag "$meta.id"
+    label 'process_medium'
+
+    conda 'conda-forge::pandas==2.2.1 bioconda::pysam==0.22.1 conda-forge::xopen==2.0.1'
+    container "qaqlans/sgrdocker_accura_tools1"
+
+    input:
+    //
+    // Input reads are expected to come as: [ meta, [ pair1_read1, pair1_read2, pair2_read1, pair2_read2 ] ]
+    //
+    tuple val(meta), path(reads)
+    path assets_dir
+    val protocol
+
+    output:
+    tuple val(meta), path("${meta.id}_prefilter_R{1,2}.fastq.gz"), emit: reads
+    tuple val(meta), path("*.json")                               , emit: json
+    tuple val(meta), path("${meta.id}_removed_R{1,2}.fastq.gz")  , optional:true, emit: removed
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def prefix = "${meta.id}"
+    def (forward, reverse) = reads.collate(2).transpose()
+    def args = task.ext.args ?: ''
+    def pattern = params.pattern ? "--pattern ${params.pattern}" : ""
+    def whitelist = params.whitelist ? "--whitelist \'${params.whitelist}\'" : ""
+    """
+    prefilter_barcode.py \\
+        --sample ${prefix} \\
+        --fq1 ${forward.join( "," )} \\
+        --fq2 ${reverse.join( "," )} \\
+        --assets_dir ${assets_dir} \\
+        --protocol ${protocol} \\
+        --well ${params.well} \\
+        --threads ${task.cpus} \\
+        $pattern \\
+        $whitelist \\
+        $args
+    """
+}
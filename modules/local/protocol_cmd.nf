@@ -17,6 +17,7 @@ process PROTOCOL_CMD {
     output:
     tuple val(meta), path("${meta.id}.protocol_cmd.txt"), emit: protocol_cmd
     tuple val(meta), path('*.json'),  emit: json
+    tuple val(meta), path('*.prof'),  optional: true, emit: profile
 
     when:
     task.ext.when == null || task.ext.when
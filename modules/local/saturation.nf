@@ -0,0 +1,33 @@
+process SATURATION {
+    tag "$meta.id"
+    label 'process_medium'
+
+    conda 'conda-forge::numpy==1.26.4 bioconda::pysam==0.22.1'
+    container "qaqlans/sgrdocker_accura_tools1"
+
+    input:
+    // BAM files of a sample, one per shard with --starsolo_shards
+    tuple val(meta), path(bam, stageAs: "bam?/*")
+    path assets_dir
+    val protocol
+
+    output:
+    tuple val(meta), path("*.saturation.tsv"), emit: tsv
+    path "*.saturation*.json"                , emit: json
+    path "*.perf.json"                       , emit: perf
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    """
+    saturation.py \\
+        --sample ${meta.id} \\
+        --bam ${bam.join(' ')} \\
+        --assets_dir ${assets_dir} \\
+        --protocol ${protocol} \\
+        --umi_cutoff ${params.umi_cutoff} \\
+        $args
+    """
+}
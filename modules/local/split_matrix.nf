@@ -0,0 +1,46 @@
+process SPLIT_MATRIX {
+    tag "$meta.id"
+    label 'process_low'
+
+    conda 'conda-forge::pandas==2.2.1'
+    container "biocontainers/pandas:2.2.1"
+
+    input:
+    tuple val(meta), path(matrix), path(read_stats)
+    path assets_dir
+    val protocol
+    path split_inf
+
+    output:
+    tuple val(meta), path("${meta.id}.split/*.matrix"), emit: matrix
+    tuple val(meta), path("*.pseudo_bulk.tsv")         , emit: pseudo_bulk
+    path "*.bulk_rna.*.json"                           , emit: json
+    path "*.counts*.txt"                               , emit: counts
+    path "*.perf.json"                                 , emit: perf
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    def pattern = params.pattern ? "--pattern ${params.pattern}" : ""
+    def whitelist = params.whitelist ? "--whitelist \'${params.whitelist}\'" : ""
+    """
+    split_matrix.py \\
+        --sample ${meta.id} \\
+        --matrix_dir ${matrix}/raw \\
+        --read_stats ${read_stats} \\
+        --split_inf ${split_inf} \\
+        --assets_dir ${assets_dir} \\
+        --protocol ${protocol} \\
+        --well ${params.well} \\
+        --umi_cutoff ${params.umi_cutoff} \\
+        --read_cutoff ${params.read_cutoff} \\
+        --gene_cutoff ${params.gene_cutoff} \\
+        $pattern \\
+        $whitelist \\
+        $args
+
+    gzip ${meta.id}.split/*.matrix/raw/*
+    """
+}
@@ -35,6 +35,13 @@ process STARSOLO {
     def prefix = "${meta.id}"
     def (forward, reverse) = reads.collate(2).transpose()
     def args = task.ext.args ?: ''
+    // one genome in shared memory per node, counted on the host by the beforeScript and afterScript, see bin/star_shm.py
+    def genome_load = ''
+    if (params.star_shared_memory) {
+        // sorted BAM output needs an explicit sort memory with a shared genome
+        def sort_ram = task.memory ? task.memory.toBytes().intdiv(2) : 10000000000
+        genome_load = "--genomeLoad LoadAndKeep --limitBAMsortRAM ${sort_ram}"
+    }
 
     """
     STAR \\
@@ -43,6 +50,7 @@ process STARSOLO {
         --genomeDir $index \\
         --outFileNamePrefix $prefix. \\
         --runThreadN ${task.cpus} \\
+        $genome_load \\
         $args
     
     mkdir ${prefix}.matrix
@@ -2,11 +2,11 @@ process STARSOLO_SUMMARY {
     tag "$meta.id"
     label 'process_low'
 
-    conda 'conda-forge::pandas==1.5.2'
-    container "biocontainers/pandas:1.5.2"
+    conda 'conda-forge::python==3.12'
+    container "biocontainers/python:3.12"
 
     input:
-    tuple val(meta), path(read_stats), path(summary)
+    tuple val(meta), path(read_stats), path(summary), path(prefilter_stats)
     path assets_dir
     val protocol
     val umi_cutoff
@@ -17,8 +17,10 @@ process STARSOLO_SUMMARY {
     tuple val(meta), path("*.json"), emit: json
     tuple val(meta), path("*.counts.txt"), emit: raw_count
     tuple val(meta), path("*.counts_report.txt"), emit: filter_count
+    tuple val(meta), path("*.prof"), optional: true, emit: profile
 
     script:
+    def prefilter = prefilter_stats ? "--prefilter_stats ${prefilter_stats}" : ""
     """
     starsolo_summary.py \\
         --read_stats ${read_stats} \\
@@ -28,6 +30,7 @@ process STARSOLO_SUMMARY {
         --protocol ${protocol} \\
         --umi_cutoff ${umi_cutoff} \\
         --read_cutoff ${read_cutoff} \\
-        --gene_cutoff ${gene_cutoff}
+        --gene_cutoff ${gene_cutoff} \\
+        $prefilter
     """
 }
\ No newline at end of file
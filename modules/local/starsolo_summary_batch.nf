@@ -0,0 +1,46 @@
+process STARSOLO_SUMMARY_BATCH {
+    tag "${samples.size()} samples"
+    label 'process_medium'
+
+    conda 'conda-forge::python==3.12'
+    container "biocontainers/python:3.12"
+
+    input:
+    val samples
+    // every sample has the same file names, stage them in numbered directories
+    path read_stats, stageAs: "read_stats/?/*"
+    path summary, stageAs: "summary/?/*"
+    path prefilter_stats
+    path assets_dir
+    val protocol
+    val umi_cutoff
+    val read_cutoff
+    val gene_cutoff
+
+    output:
+    path("*.json"), emit: json
+    path("*.counts.txt"), emit: raw_count
+    path("*.counts_report.txt"), emit: filter_count
+    path("*.prof"), optional: true, emit: profile
+
+    script:
+    // a single staged file is not a list
+    def as_list = { it instanceof List ? it : [it] }
+    def prefilter = prefilter_stats ? as_list(prefilter_stats) : samples.collect{ '' }
+    def rows = [samples, as_list(read_stats), as_list(summary), prefilter].transpose().collect{ it.join('\t') }
+    """
+    cat <<-END_MANIFEST > manifest.tsv
+    sample\tread_stats\tsummary\tprefilter_stats
+    ${rows.join('\n    ')}
+    END_MANIFEST
+
+    starsolo_summary.py \\
+        --manifest manifest.tsv \\
+        --assets_dir ${assets_dir} \\
+        --protocol ${protocol} \\
+        --umi_cutoff ${umi_cutoff} \\
+        --read_cutoff ${read_cutoff} \\
+        --gene_cutoff ${gene_cutoff} \\
+        --threads ${task.cpus}
+    """
+}
@@ -0,0 +1,27 @@
+process WELL_MATRIX {
+    tag "$meta.id"
+    label 'process_low'
+
+    conda 'conda-forge::pandas==2.2.1'
+    container "biocontainers/pandas:2.2.1"
+
+    input:
+    tuple val(meta), path(matrix)
+    path assets_dir
+    val protocol
+
+    output:
+    tuple val(meta), path("*.well_metrics.tsv"), emit: metrics
+    tuple val(meta), path("*.matrix.npz")      , emit: npz
+
+    script:
+    def args = task.ext.args ?: ''
+    """
+    well_matrix.py \\
+        --matrix_dir ${matrix}/raw \\
+        --sample ${meta.id} \\
+        --assets_dir ${assets_dir} \\
+        --protocol ${protocol} \\
+        $args
+    """
+}
@@ -5,5 +5,8 @@ def multiqc_sgr_config():
     sgr_search_patterns = {
         "bulk_rna/stats": {"fn": "*bulk_rna.*stats.json"},
         "bulk_rna/well_count": {"fn": "*bulk_rna.counts_report.json"},
+        "bulk_rna/demux": {"fn": "*bulk_rna.demux.json"},
+        "bulk_rna/saturation": {"fn": "*bulk_rna.saturation.json"},
+        "bulk_rna/perf": {"fn": "*.perf.json"},
     }
     config.update_dict(config.sp, sgr_search_patterns)
\ No newline at end of file
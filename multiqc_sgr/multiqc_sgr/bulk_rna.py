@@ -1,13 +1,73 @@
 import json
 import logging
+import re
 from collections import defaultdict
 
+import numpy as np
+from multiqc import config
 from multiqc.base_module import BaseMultiqcModule, ModuleNoSamplesFound
-from multiqc.plots import table
+from multiqc.plots import bargraph, box, heatmap, linegraph, table
 
 # Initialise the logger
 log = logging.getLogger("multiqc")
 ASSAY = "bulk_rna"
+WELL_METRICS = ["UMI", "read", "gene"]
+# plate rows and columns by number of wells
+PLATES = {96: (8, 12), 384: (16, 24)}
+WELL_PATTERN = re.compile(r"^well(\d+)$")
+# values per sample in the distribution plot
+DIST_POINTS = 200
+
+
+def plate_layout(wells, plate_wells=None):
+    """
+    Return:
+    (rows, cols) of the plate for wells named well{n}, None if the wells are not named so.
+    plate_wells is the plate size of the run(--well). Without it, or if a well does not fit on it, the smallest plate
+    that holds the largest reported well is used.
+
+    >>> plate_layout(["well1", "well96"]), plate_layout(["well97"]), plate_layout(["AACGTGAT"])
+    ((8, 12), (16, 24), None)
+    >>> plate_layout(["well1", "well20"], 384), plate_layout(["well1", "well20"], 96), plate_layout(["well97"], 96)
+    ((16, 24), (8, 12), (16, 24))
+    """
+    numbers = [WELL_PATTERN.match(x) for x in wells]
+    if not numbers or not all(numbers):
+        return None
+    n_max = max(int(x.group(1)) for x in numbers)
+    if plate_wells in PLATES and n_max <= plate_wells:
+        return PLATES[plate_wells]
+    for n_well, layout in sorted(PLATES.items()):
+        if n_max <= n_well:
+            return layout
+    return None
+
+
+def plate_rows(well_data, metric, layout):
+    """
+    Values of a metric in plate layout, well{n} is the n-th well in row-major order. Wells not reported are None.
+
+    >>> plate_rows({"well2": {"UMI": 5}}, "UMI", (2, 2))
+    [[None, 5], [None, None]]
+    """
+    n_row, n_col = layout
+    rows = [[None] * n_col for _ in range(n_row)]
+    for well, data in well_data.items():
+        i = int(WELL_PATTERN.match(well).group(1)) - 1
+        rows[i // n_col][i % n_col] = data.get(metric)
+    return rows
+
+
+def downsample_values(values, n=DIST_POINTS):
+    """
+    Evenly spaced quantiles, so that the plot size does not grow with the number of wells.
+
+    >>> downsample_values([3, 1, 2]), downsample_values(list(range(101)), 3)
+    ([3, 1, 2], [0.0, 50.0, 100.0])
+    """
+    if len(values) <= n:
+        return list(values)
+    return np.quantile(np.array(values, dtype=float), np.linspace(0, 1, n)).tolist()
 
 class MultiqcModule(BaseMultiqcModule):
     def __init__(self):
@@ -19,8 +79,11 @@ class MultiqcModule(BaseMultiqcModule):
         log.info(f"Running module: {ASSAY}")
         
         stat_data = self.parse_json(ASSAY, "stats")
-        well_data = self.parse_json(ASSAY, "well_count")
-        if all(len(x) == 0 for x in [stat_data,well_data]):
+        well_data = self.parse_json(ASSAY, "well_count", write_data=False)
+        demux_data = self.parse_json(ASSAY, "demux", write_data=False)
+        saturation_data = self.parse_json(ASSAY, "saturation")
+        perf_data = self.parse_perf(ASSAY)
+        if all(len(x) == 0 for x in [stat_data,well_data,demux_data,saturation_data,perf_data]):
             raise ModuleNoSamplesFound
         
         sample_list = list(stat_data.keys())
@@ -28,20 +91,31 @@ class MultiqcModule(BaseMultiqcModule):
         # Basic Stats Table
         self.general_stats_table(stat_data)
 
-        # well detail
-        helptext = """
-        The rowname of the table is the well barcode sequence number. Only output wells that meet the conditions(default: UMI>=500).  
-        If no well pass the filter,output wells that UMI,read and gene > 0.
-        """
-        for sample in sample_list:
-            self.add_section(name = f"{sample} - per well", anchor = f'{sample}_well_table',helptext=helptext,plot = self.well_table(well_data[sample],sample))
+        # well detail, the full tables are in multiqc_data
+        if well_data:
+            self.write_well_data(well_data)
+            self.add_well_distribution(well_data)
+            for sample in sorted(well_data):
+                self.add_plate_heatmaps(well_data[sample], sample, stat_data.get(sample, {}).get("Plate Wells"))
+
+        # saturation curves
+        if saturation_data:
+            self.add_saturation_section(saturation_data)
+
+        # demultiplexing
+        if demux_data:
+            self.add_demux_sections(demux_data)
+
+        # performance of the bin scripts
+        if perf_data:
+            self.add_perf_sections(perf_data)
 
         # Superfluous function call to confirm that it is used in this module
         # Replace None with actual version if it is available
         
         self.add_software_version(None)
     
-    def parse_json(self, assay, seg):
+    def parse_json(self, assay, seg, write_data=True):
         data_dict = defaultdict(dict)
         n = 0
         for f in self.find_log_files(f"{assay}/{seg}"):
@@ -59,10 +133,28 @@ class MultiqcModule(BaseMultiqcModule):
         data_dict = self.ignore_samples(data_dict)
 
         log.info(f"Found {n} {assay} {seg} reports")
-        # Write parsed report data to a file
-        self.write_data_file(data_dict, f"multiqc_{assay}_{seg}")
+        # Write parsed report data to a file, no empty tables
+        if write_data and data_dict:
+            self.write_data_file(data_dict, f"multiqc_{assay}_{seg}")
         return data_dict
         
+    def parse_perf(self, assay):
+        """
+        *.perf.json written by bin/perf.py. Key: "sample - script", or script for scripts not run per sample.
+        """
+        data_dict = {}
+        for f in self.find_log_files(f"{assay}/perf"):
+            parsed_data = json.loads(f["f"])
+            if not parsed_data or "script" not in parsed_data:
+                continue
+            name = parsed_data["script"]
+            if parsed_data.get("sample"):
+                name = f"{parsed_data['sample']} - {name}"
+            self.add_data_source(f, s_name=name, section="perf")
+            data_dict[name] = parsed_data
+        log.info(f"Found {len(data_dict)} {assay} perf reports")
+        return self.ignore_samples(data_dict)
+
     def general_stats_table(self, summary_data):
         headers = {
             "Protocol": {
@@ -71,6 +163,13 @@ class MultiqcModule(BaseMultiqcModule):
                 "scale": "purple",
                 "hidden": True
             },
+            "Plate Wells": {
+                "title": "Plate Wells",
+                "description": "Number of wells of the plate(--well)",
+                "scale": "purple",
+                "format": "{:,.0f}",
+                "hidden": True
+            },
             "Raw Reads": {
                 "title": "Raw Reads",
                 "description": "Number of reads in the input file",
@@ -87,6 +186,22 @@ class MultiqcModule(BaseMultiqcModule):
                 "scale": "green",
                 "hidden": False
             },
+            "Prefilter Removed Fraction": {
+                "title": "Prefilter Removed",
+                "description": "Percent of reads removed by the barcode prefilter before alignment",
+                "max": 100,
+                "min": 0,
+                "suffix": "%",
+                "scale": "red",
+                "hidden": False
+            },
+            "Prefilter Removed Reads": {
+                "title": "Prefilter Removed Reads",
+                "description": "Number of reads removed by the barcode prefilter before alignment",
+                "scale": "blue",
+                "format": "{:,.0f}",
+                "hidden": True
+            },
             "Corrected Barcodes": {
                 "title": "Corrected Barcodes",
                 "description": "Percent of corrected barcodes",
@@ -159,6 +274,15 @@ class MultiqcModule(BaseMultiqcModule):
                 "scale": "green",
                 "hidden": True
             },
+            "Sequencing Saturation": {
+                "title": "Saturation",
+                "description": "Sequencing saturation, 1 - UMI / reads of the counted reads",
+                "max": 100,
+                "min": 0,
+                "suffix": "%",
+                "scale": "RdYlGn",
+                "hidden": False
+            },
             "Median Reads per Well": {
                 "title": "Median Reads",
                 "description": "Median number of reads per well",
@@ -203,29 +327,185 @@ class MultiqcModule(BaseMultiqcModule):
         }
         self.general_stats_addcols(summary_data, headers=headers)
 
-    def well_table(self,well_data,sample):
-        table_config = {
-            "id": f"{sample}_Well_table",
-            "namespace": f"{sample}",
-            "title": "Detailed information per Well",
-            "col1_header": "Well",
-            "sort_rows":False
+    def write_well_data(self, well_data):
+        """
+        One row per well of each sample
+        """
+        rows = {}
+        for sample, wells in sorted(well_data.items()):
+            for well, data in wells.items():
+                rows[f"{sample} - {well}"] = {"Sample": sample, "Well": well, **data}
+        self.write_data_file(rows, f"multiqc_{ASSAY}_well_count")
+
+    def add_well_distribution(self, well_data):
+        data = []
+        for metric in WELL_METRICS:
+            data.append({
+                sample: downsample_values([x[metric] for x in wells.values() if metric in x])
+                for sample, wells in sorted(well_data.items())
+            })
+        self.add_section(
+            name = "Wells",
+            anchor = f"{ASSAY}_well_distribution",
+            description = "UMI, reads and genes of the reported wells of all samples. The values of each well are in multiqc_data.",
+            helptext = """
+            Only wells that meet the conditions(default: UMI>=500) are reported.
+            If no well pass the filter, wells that UMI, read and gene > 0 are reported.
+            Samples with more than 200 wells are shown by 200 evenly spaced quantiles.
+            """,
+            plot = box.plot(data, pconfig={
+                "id": f"{ASSAY}_well_distribution_plot",
+                "title": "Wells",
+                "data_labels": [{"name": x, "ylab": x} for x in WELL_METRICS],
+            }),
+        )
+
+    def add_plate_heatmaps(self, well_data, sample, plate_wells=None):
+        """
+        One heatmap per metric in `bulk_rna_plate_metrics` of the MultiQC config, default WELL_METRICS.
+        Wells not named well{n}, e.g. of customized whitelists, are not placed on a plate.
+        plate_wells is the Plate Wells of the protocol stats of the sample.
+        """
+        layout = plate_layout(list(well_data), plate_wells)
+        if layout is None:
+            return
+        metrics = getattr(config, f"{ASSAY}_plate_metrics", WELL_METRICS)
+        n_row, n_col = layout
+        for metric in metrics:
+            self.add_section(
+                name = f"{sample} - plate {metric}",
+                anchor = f"{ASSAY}_{sample}_plate_{metric}",
+                helptext = "Wells are numbered along the rows. Empty wells are not reported, see the Wells section.",
+                plot = heatmap.plot(
+                    plate_rows(well_data, metric, layout),
+                    xcats = [str(x + 1) for x in range(n_col)],
+                    ycats = [chr(ord("A") + x) for x in range(n_row)],
+                    pconfig = {
+                        "id": f"{ASSAY}_{sample}_plate_{metric}_plot",
+                        "title": f"{sample}: {metric} per well",
+                        "xlab": "Column",
+                        "ylab": "Row",
+                        "zlab": metric,
+                        "tt_decimals": 0,
+                        "angled_xticks": False,
+                        "display_values": False,
+                    },
+                ),
+            )
+
+    def add_saturation_section(self, saturation_data):
+        """
+        Downsampling curves of each sample, x is the mean reads per well
+        """
+        plots = {
+            "Median UMI per Well": "Median UMI",
+            "Median Genes per Well": "Median Genes",
+            "Sequencing Saturation": "Saturation (%)",
         }
+        data = []
+        for key in plots:
+            data.append({
+                sample: dict(zip(d["Mean Reads per Well"], d[key])) for sample, d in sorted(saturation_data.items())
+            })
+        self.add_section(
+            name = "Saturation",
+            anchor = f"{ASSAY}_saturation",
+            description = "Expected median UMI and genes of the wells, and sequencing saturation, when the reads are downsampled.",
+            helptext = """
+            Computed from the reads per molecule(well, gene, UMI) in the STARsolo BAM. A molecule with c reads is kept with
+            probability 1-(1-p)^c when a fraction p of the reads is kept. Only wells passing the UMI cutoff are included.
+            A curve that is still rising at the full depth means more sequencing would detect more molecules.
+            """,
+            plot = linegraph.plot(data, pconfig={
+                "id": f"{ASSAY}_saturation_plot",
+                "title": "Saturation",
+                "xlab": "Mean Reads per Well",
+                "data_labels": [{"name": name, "ylab": ylab} for name, ylab in zip(plots, plots.values())],
+            }),
+        )
+
+    def add_demux_sections(self, demux_data):
+        status = ["Exact Barcodes", "Corrected Barcodes", "Ambiguous Barcodes", "Invalid Barcodes", "Wells Not In Split"]
+        bar_data = {sample: {k: data[k] for k in status} for sample, data in demux_data.items()}
+        sub_data = {}
+        for sample, data in demux_data.items():
+            for sub_sample, sub in data["sub_sample"].items():
+                sub_data[f"{sample} - {sub_sample}"] = {k: sub[k] for k in ["Reads", "Exact Barcodes", "Corrected Barcodes", "Wells Detected"]}
+        self.write_data_file(bar_data, f"multiqc_{ASSAY}_demux")
+        self.write_data_file(sub_data, f"multiqc_{ASSAY}_demux_sub_sample")
+
+        self.add_section(
+            name = "Demultiplexing barcodes",
+            anchor = f"{ASSAY}_demux_barcodes",
+            description = "Reads by barcode status, counted by split_fastq while demultiplexing.",
+            plot = bargraph.plot(bar_data, {k: {"name": k} for k in status}, pconfig={
+                "id": f"{ASSAY}_demux_barcodes_plot",
+                "title": "Demultiplexing barcodes",
+                "ylab": "Reads",
+            }),
+        )
         headers = {
-            "UMI": {
-                "title": "UMI",
-                'description':"UMI counts",
-                "format": "{:,.0f}"
-            },
-            "read": {
-                "title": "read",
-                'description':"read counts",
-                "format": "{:,.0f}"
-            },
-            "gene": {
-                "title": "gene",
-                'description':"gene counts",
-                "format": "{:,.0f}"
-            },
+            "Reads": {"title": "Reads", "description": "Reads of the sub-sample", "format": "{:,.0f}"},
+            "Exact Barcodes": {"title": "Exact", "description": "Reads with barcodes in the whitelist", "format": "{:,.0f}"},
+            "Corrected Barcodes": {"title": "Corrected", "description": "Reads with corrected barcodes", "format": "{:,.0f}"},
+            "Wells Detected": {"title": "Wells", "description": "Wells with at least one read", "format": "{:,.0f}"},
         }
-        return table.plot(well_data,pconfig=table_config,headers=headers)
\ No newline at end of file
+        self.add_section(
+            name = "Demultiplexing sub-samples",
+            anchor = f"{ASSAY}_demux_sub_sample",
+            plot = table.plot(sub_data, headers=headers, pconfig={
+                "id": f"{ASSAY}_demux_sub_sample_table",
+                "title": "Demultiplexing sub-samples",
+                "col1_header": "Sub-sample",
+            }),
+        )
+
+    def add_perf_sections(self, perf_data):
+        table_data = {}
+        phase_data = {}
+        data_file = {}
+        for name, data in sorted(perf_data.items()):
+            table_data[name] = {
+                "Wall Time": data["wall_time"],
+                "CPU Time": data["cpu_time"],
+                "Peak RSS": data["peak_rss_mb"],
+                "Workers Peak RSS": data.get("children_peak_rss_mb"),
+            }
+            # nested phases are part of their top level phase
+            phase_data[name] = {k: v["wall_time"] for k, v in data["phases"].items() if "/" not in k}
+            data_file[name] = {**table_data[name], **data["counters"]}
+            for phase, stats in data["phases"].items():
+                for k, v in stats.items():
+                    data_file[name][f"{phase} {k}"] = v
+        self.write_data_file(data_file, f"multiqc_{ASSAY}_perf")
+
+        headers = {
+            "Wall Time": {"title": "Wall Time", "description": "Elapsed time of the script", "suffix": " s", "format": "{:,.1f}"},
+            "CPU Time": {"title": "CPU Time", "description": "CPU time of the main process", "suffix": " s", "format": "{:,.1f}"},
+            "Peak RSS": {"title": "Peak RSS", "description": "Peak resident memory of the main process", "suffix": " MB", "format": "{:,.0f}"},
+            "Workers Peak RSS": {"title": "Workers Peak RSS", "description": "Peak resident memory of the largest worker process", "suffix": " MB", "format": "{:,.0f}", "hidden": True},
+        }
+        self.add_section(
+            name = "Performance",
+            anchor = f"{ASSAY}_perf",
+            description = "Run time and memory of the pipeline scripts. Counters and per phase figures are in multiqc_data.",
+            plot = table.plot(table_data, headers=headers, pconfig={
+                "id": f"{ASSAY}_perf_table",
+                "title": "Performance",
+                "col1_header": "Script",
+            }),
+        )
+        phases = []
+        for data in phase_data.values():
+            phases.extend(k for k in data if k not in phases)
+        self.add_section(
+            name = "Performance phases",
+            anchor = f"{ASSAY}_perf_phases",
+            description = "Wall time of the phases of each script.",
+            plot = bargraph.plot(phase_data, {k: {"name": k} for k in phases}, pconfig={
+                "id": f"{ASSAY}_perf_phases_plot",
+                "title": "Performance phases",
+                "ylab": "Seconds",
+                "cpswitch": False,
+            }),
+        )
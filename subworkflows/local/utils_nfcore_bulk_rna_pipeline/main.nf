@@ -215,3 +215,135 @@ def methodsDescriptionText(mqc_methods_yaml) {
 
     return description_html.toString()
 }
+
+//
+// Content-addressed cache of STAR genome indices
+//
+def sha256Hex(Closure update) {
+    def md = java.security.MessageDigest.getInstance('SHA-256')
+    update(md)
+    return md.digest().encodeHex().toString()
+}
+
+// Content hash of a file. Hashes of local files are kept under the cache root by path, size and modification time,
+// so a large fasta is read only once.
+def genomeCacheFileHash(path, cache_root) {
+    def f = file(path, checkIfExists: true)
+    def memo = null
+    if (f.scheme == 'file') {
+        def stamp = "${f.toUriString()}\t${f.size()}\t${f.lastModified()}"
+        memo = cache_root.resolve(".hashes/${sha256Hex { it.update(stamp.bytes) }}")
+        if (memo.exists()) {
+            return memo.text.trim()
+        }
+    }
+    def hash = sha256Hex { md ->
+        f.withInputStream { stream ->
+            byte[] buf = new byte[1 << 20]
+            int n
+            while ((n = stream.read(buf)) > 0) {
+                md.update(buf, 0, n)
+            }
+        }
+    }
+    if (memo) {
+        memo.parent.mkdirs()
+        memo.text = hash
+    }
+    return hash
+}
+
+// STAR image of the STAR_GENOME module, e.g. star:2.7.11b--h43eeafb_0. The index format depends on the STAR version,
+// so upgrading the container of the module changes the cache key.
+def genomeCacheStarImage() {
+    def module = file("${projectDir}/modules/local/star_genome.nf").text
+    def match = module =~ /'biocontainers\/(star:[^']+)'/
+    if (!match.find()) {
+        error("Can not find the STAR container in modules/local/star_genome.nf for the genome cache key")
+    }
+    return match.group(1)
+}
+
+// The filtered gtf only depends on the gtf, the filter rules and filter_gtf.py.
+// They are hashed instead of the filtered gtf, so that a cache hit skips FILTER_GTF as well.
+def genomeCacheKey(cache_root) {
+    def inputs = [
+        fasta                      : genomeCacheFileHash(params.fasta, cache_root),
+        gtf                        : genomeCacheFileHash(params.gtf, cache_root),
+        filter_gtf                 : genomeCacheFileHash("${projectDir}/bin/filter_gtf.py", cache_root),
+        keep_attributes            : params.keep_attributes,
+        gtf_gene_level             : params.gtf_gene_level,
+        star                       : genomeCacheStarImage(),
+        star_genome_additional_args: params.star_genome_additional_args ?: '',
+    ]
+    def key = sha256Hex { md -> md.update(inputs.collect { k, v -> "${k}=${v}" }.join('\n').bytes) }
+    return [key: key[0..<32], inputs: inputs]
+}
+
+//
+// Look up the STAR genome of this run in the cache.
+// On a miss, a lock is taken before returning, so a concurrent run with the same genome does not build the index
+// again. A run that finds the lock of another run fails at launch instead of waiting on the head node.
+// Locks older than --genome_cache_lock_timeout hours are from killed runs and are taken over.
+//
+def genomeCacheLookup(cache_dir) {
+    def root = file(cache_dir)
+    root.mkdirs()
+    def cache = genomeCacheKey(root)
+    cache.root = root
+    cache.entry = root.resolve(cache.key)
+    cache.lock = root.resolve("${cache.key}.lock")
+    cache.owner = false
+    def timeout_ms = params.genome_cache_lock_timeout * 3600 * 1000
+    // written last, before the atomic rename
+    if (cache.entry.resolve('cache_key.json').exists()) {
+        log.info "STAR genome cache hit: ${cache.entry}"
+        cache.hit = true
+        return cache
+    }
+    if (cache.lock.exists() && System.currentTimeMillis() - cache.lock.lastModified() > timeout_ms) {
+        log.warn "Removing stale STAR genome cache lock ${cache.lock}"
+        // only one run succeeds in moving the lock away
+        try {
+            java.nio.file.Files.move(cache.lock, root.resolve(".${cache.key}.lock.${workflow.sessionId}"))
+            root.resolve(".${cache.key}.lock.${workflow.sessionId}").delete()
+        } catch (java.io.IOException ignored) {
+        }
+    }
+    try {
+        java.nio.file.Files.createFile(cache.lock)
+    } catch (java.nio.file.FileAlreadyExistsException e) {
+        error("""\
+            The STAR genome of this run is being built for the cache by another run, lock: ${cache.lock}
+            ${cache.lock.text.trim()}
+            Run again when it has finished. If that run was killed, remove the lock, or wait ${params.genome_cache_lock_timeout} hours(--genome_cache_lock_timeout) until it is taken over.
+            """.stripIndent())
+    }
+    cache.lock.text = "${workflow.sessionId}\t${workflow.runName}\t${java.net.InetAddress.localHost.hostName}\n"
+    cache.owner = true
+    cache.hit = false
+    log.info "STAR genome cache miss: the index will be published to ${cache.entry}"
+    return cache
+}
+
+//
+// Inputs of the index, written to {key}/cache_key.json by GENOME_CACHE_PUBLISH
+//
+def genomeCacheInfo(cache) {
+    def info = cache.inputs + [
+        key       : cache.key,
+        fasta_path: params.fasta,
+        gtf_path  : params.gtf,
+        run_name  : workflow.runName,
+        created   : new Date().format("yyyy-MM-dd'T'HH:mm:ss"),
+    ]
+    // one line, it is written with a heredoc
+    return groovy.json.JsonOutput.toJson(info)
+}
+
+def genomeCacheRelease(cache) {
+    if (cache.owner) {
+        cache.lock.delete()
+        cache.owner = false
+    }
+}
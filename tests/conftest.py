@@ -0,0 +1,5 @@
+import os
+import sys
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+sys.path.insert(0, BIN)
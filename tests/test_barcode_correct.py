@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+import barcode_correct
+from barcode_correct import AMBIGUOUS, CORRECTED, EXACT, NO_MATCH
+
+
+def brute_force(whitelist, seq, n_mismatch):
+    """
+    Closest whitelist barcodes by comparing seq with every barcode.
+    """
+    if seq in whitelist:
+        return EXACT, seq
+    distances = {
+        bc: barcode_correct.hamming(seq, bc) for bc in whitelist if len(bc) == len(seq)
+    }
+    hits = [bc for bc, d in distances.items() if d <= n_mismatch]
+    if not hits:
+        return NO_MATCH, None
+    best = min(distances[bc] for bc in hits)
+    matched = [bc for bc in hits if distances[bc] == best]
+    if len(matched) > 1:
+        return AMBIGUOUS, None
+    return CORRECTED, matched[0]
+
+
+def random_seq(rng, length, bases="ACGT"):
+    return "".join(rng.choice(bases) for _ in range(length))
+
+
+def queries(rng, whitelist, n_mismatch, n):
+    """
+    Whitelist barcodes with 0 to n_mismatch + 1 substitutions(including N), and random sequences.
+    """
+    length = len(whitelist[0])
+    out = []
+    for _ in range(n):
+        seq = list(rng.choice(whitelist))
+        for pos in rng.sample(
+            range(length), rng.randint(0, min(n_mismatch + 1, length))
+        ):
+            seq[pos] = rng.choice("ACGTN")
+        out.append("".join(seq))
+        out.append(random_seq(rng, length, "ACGTN"))
+    return out
+
+
+@pytest.mark.parametrize("method", ["auto", "pigeonhole", "masked"])
+@pytest.mark.parametrize(
+    "n_barcode, length, n_mismatch",
+    [
+        # dense short whitelists, many ambiguous barcodes
+        (200, 5, 1),
+        (500, 6, 2),
+        (384, 9, 1),
+        (500, 12, 2),
+        (50, 16, 3),
+    ],
+)
+def test_corrector_matches_brute_force(method, n_barcode, length, n_mismatch):
+    rng = random.Random(f"{n_barcode}-{length}-{n_mismatch}")
+    whitelist = list(dict.fromkeys(random_seq(rng, length) for _ in range(n_barcode)))
+    corrector = barcode_correct.BarcodeCorrector(
+        whitelist, n_mismatch=n_mismatch, method=method
+    )
+    status = set()
+    for seq in queries(rng, whitelist, n_mismatch, 300):
+        expected = brute_force(whitelist, seq, n_mismatch)
+        assert corrector.lookup(seq) == expected, seq
+        assert corrector.correct(seq) == expected[1]
+        status.add(expected[0])
+    if length <= 6:
+        assert status == {EXACT, CORRECTED, AMBIGUOUS, NO_MATCH}
+
+
+def test_corrector_all_single_variants():
+    whitelist = ["AAAA", "AATT", "CCCC", "GGGA"]
+    corrector = barcode_correct.BarcodeCorrector(whitelist)
+    for bc in whitelist:
+        for pos in range(4):
+            for base in "ACGTN":
+                seq = bc[:pos] + base + bc[pos + 1 :]
+                assert corrector.lookup(seq) == brute_force(whitelist, seq, 1)
+    # 1 mismatch from both AAAA and AATT
+    assert corrector.lookup("AAAT") == (AMBIGUOUS, None)
+    assert corrector.lookup("AANA") == (CORRECTED, "AAAA")
+    assert corrector.lookup("NAAAA") == (NO_MATCH, None)
+
+
+def test_corrector_whitelist_errors():
+    with pytest.raises(ValueError):
+        barcode_correct.BarcodeCorrector(["", " "])
+    with pytest.raises(ValueError):
+        barcode_correct.BarcodeCorrector(["AAAA", "CCC"])
+    with pytest.raises(ValueError):
+        barcode_correct.BarcodeCorrector(["AAAA"], method="other")
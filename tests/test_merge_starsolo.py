@@ -0,0 +1,215 @@
+import os
+import random
+
+import pytest
+
+import barcode_correct
+import merge_starsolo
+import shard_fastq
+import utils
+from conftest import BIN
+
+WHITELIST = os.path.join(BIN, "..", "assets", "whitelist", "AccuraCode-V1", "bclist384")
+N_GENE = 20
+# CellReads.stats columns read by merge_starsolo and starsolo_summary
+READ_STATS_COLUMNS = ["CB", "cbMatch", "cbPerfect", "countedU", "nUMIunique"]
+
+
+def plate_reads(n_reads, seed=0):
+    """
+    Read pairs(name, R1, R2) of the pattern C9U12: whitelist barcodes, barcodes with one or two substitutions and
+    random barcodes. UMIs are drawn from a small pool, so that reads of a well and gene share UMIs.
+    """
+    rng = random.Random(seed)
+    whitelist = utils.read_one_col(WHITELIST)[:40]
+    reads = []
+    for i in range(n_reads):
+        bc = list(rng.choice(whitelist))
+        status = rng.random()
+        if status < 0.05:
+            bc = [rng.choice("ACGT") for _ in range(9)]
+        elif status < 0.3:
+            for pos in rng.sample(range(9), 1 if status < 0.25 else 2):
+                bc[pos] = rng.choice("ACGTN")
+        umi = rng.choice(["AAAACCCCGGGG", "ACGTACGTACGT", "TTTTGGGGCCCC"])
+        seq2 = "".join(rng.choice("ACGT") for _ in range(30))
+        reads.append((f"r{i}", "".join(bc) + umi, seq2))
+    return reads
+
+
+def to_block(records):
+    return "".join(f"@{name}\n{seq}\n+\n{'F' * len(seq)}\n" for name, seq in records)
+
+
+def shard_reads(reads, n_shard):
+    """
+    Return:
+    reads of each shard, from shard_fastq.shard_block
+    """
+    route_table = shard_fastq.get_route_table(utils.read_one_col(WHITELIST), n_shard)
+    block1 = to_block((name, seq1) for name, seq1, _seq2 in reads).encode()
+    block2 = to_block((name, seq2) for name, _seq1, seq2 in reads).encode()
+    out = shard_fastq.shard_block(block1, block2, 0, route_table, slice(0, 9), n_shard)
+    by_name = {name: (name, seq1, seq2) for name, seq1, seq2 in reads}
+    shards = []
+    for shard in range(n_shard):
+        lines = out[shard][0].decode().splitlines() if shard in out else []
+        shards.append([by_name[name[1:]] for name in lines[0::4]])
+        assert out[shard][2] == len(shards[-1])
+    return shards
+
+
+def solo_count(reads, corrector):
+    """
+    STARsolo of one shard: barcodes are corrected within 1 mismatch, the gene is given by R2 and UMIs are collapsed
+    per well and gene.
+
+    Return:
+    matrix {(gene, well): UMI}, CellReads.stats rows {CB: [cbMatch, cbPerfect, countedU, nUMIunique]}
+    """
+    whitelist = corrector.whitelist
+    molecules = set()
+    stats = {"CBnotInPasslist": [0, 0, 0, 0]}
+    for _name, seq1, seq2 in reads:
+        status, seq_bc = corrector.lookup(seq1[:9])
+        if seq_bc is None:
+            stats["CBnotInPasslist"][0] += 1
+            continue
+        well = whitelist.index(seq_bc)
+        gene = sum(map(ord, seq2)) % N_GENE
+        row = stats.setdefault(seq_bc, [0, 0, 0, 0])
+        row[0] += 1
+        row[1] += status == barcode_correct.EXACT
+        row[2] += 1
+        molecules.add((gene, well, seq1[9:21]))
+    matrix = {}
+    for gene, well, _umi in molecules:
+        matrix[(gene, well)] = matrix.get((gene, well), 0) + 1
+    for (gene, well), umi in matrix.items():
+        stats[whitelist[well]][3] += umi
+    return matrix, stats
+
+
+def write_mtx(fn, matrix, n_col, field="integer"):
+    entries = sorted(matrix.items(), key=lambda x: (x[0][1], x[0][0]))
+    with open(fn, "w") as f:
+        f.write(f"%%MatrixMarket matrix coordinate {field} general\n%\n")
+        f.write(f"{N_GENE} {n_col} {len(entries)}\n")
+        for (gene, well), value in entries:
+            f.write(f"{gene + 1} {well + 1} {value}\n")
+
+
+def read_mtx_file(fn):
+    with open(fn) as f:
+        lines = [line for line in f if not line.startswith("%")]
+    return lines[0], {
+        (int(row), int(col)): float(value)
+        for row, col, value in (line.split() for line in lines[1:])
+    }
+
+
+def write_read_stats(fn, stats):
+    with open(fn, "w") as f:
+        f.write("\t".join(READ_STATS_COLUMNS) + "\n")
+        for cb, values in stats.items():
+            f.write("\t".join([cb] + [str(x) for x in values]) + "\n")
+
+
+def write_summary(fn, reads, stats):
+    valid = sum(values[0] for cb, values in stats.items() if cb != "CBnotInPasslist")
+    umi = sum(values[3] for cb, values in stats.items() if cb != "CBnotInPasslist")
+    with open(fn, "w") as f:
+        f.write(f"Number of Reads,{len(reads)}\n")
+        f.write(f"Reads With Valid Barcodes,{valid / len(reads)!r}\n")
+        f.write(f"Sequencing Saturation,{1 - umi / valid:.6f}\n")
+        f.write("Estimated Number of Cells,3\n")
+
+
+@pytest.fixture(scope="module")
+def sharded(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("sharded")
+    reads = plate_reads(3000)
+    corrector = barcode_correct.BarcodeCorrector(utils.read_one_col(WHITELIST))
+    n_col = len(corrector.whitelist)
+    shards = shard_reads(reads, 2)
+    dirs = []
+    for name, part in [("single", reads), ("shard1", shards[0]), ("shard2", shards[1])]:
+        matrix, stats = solo_count(part, corrector)
+        out = tmp / name
+        out.mkdir()
+        write_mtx(out / "matrix.mtx", matrix, n_col)
+        write_read_stats(out / "CellReads.stats", stats)
+        write_summary(out / "Summary.csv", part, stats)
+        dirs.append(out)
+    return reads, shards, dirs
+
+
+def test_shard_assignment(sharded):
+    reads, shards, _dirs = sharded
+    whitelist = utils.read_one_col(WHITELIST)
+    corrector = barcode_correct.BarcodeCorrector(whitelist)
+    index = {read[0]: i for i, read in enumerate(reads)}
+    for shard, part in enumerate(shards):
+        # input order is kept in each shard
+        assert [index[x[0]] for x in part] == sorted(index[x[0]] for x in part)
+        for name, seq1, _seq2 in part:
+            seq_bc = corrector.correct(seq1[:9])
+            # every read of a well is in the shard of the well, the others are spread by read index
+            expected = whitelist.index(seq_bc) if seq_bc else index[name]
+            assert shard == expected % 2
+    assert sorted(sum(shards, [])) == sorted(reads)
+    assert all(len(part) > 0 for part in shards)
+
+
+def test_merged_matrix_and_stats_match_single_run(sharded, tmp_path):
+    _reads, _shards, (single, *shard_dirs) = sharded
+    out = tmp_path / "merged.mtx"
+    merge_starsolo.merge_mtx([str(x / "matrix.mtx") for x in shard_dirs], str(out))
+    assert read_mtx_file(out) == read_mtx_file(single / "matrix.mtx")
+
+    merged, header = merge_starsolo.merge_read_stats(
+        [str(x / "CellReads.stats") for x in shard_dirs],
+        str(tmp_path / "CellReads.stats"),
+    )
+    assert header == READ_STATS_COLUMNS
+    with open(single / "CellReads.stats") as f:
+        expected = {
+            cb: [int(x) for x in values]
+            for cb, *values in (line.rstrip("\n").split("\t") for line in f)
+            if cb != "CB"
+        }
+    assert merged == expected
+
+    summary = merge_starsolo.merge_summary(
+        [str(x / "Summary.csv") for x in shard_dirs],
+        str(tmp_path / "Summary.csv"),
+        (merged, header),
+    )
+    single_summary = utils.csv2dict(str(single / "Summary.csv"))
+    # reads weighted fractions and the saturation of the merged stats are those of the single run, cell rows are
+    # left out
+    assert list(summary) == [
+        "Number of Reads",
+        "Reads With Valid Barcodes",
+        "Sequencing Saturation",
+    ]
+    assert summary["Number of Reads"] == single_summary["Number of Reads"]
+    assert float(summary["Reads With Valid Barcodes"]) == pytest.approx(
+        float(single_summary["Reads With Valid Barcodes"]), abs=1e-6
+    )
+    assert summary["Sequencing Saturation"] == single_summary["Sequencing Saturation"]
+
+
+def test_merge_real_matrix_in_float64(tmp_path):
+    # not representable in float32
+    values = [16777217.25, 0.1, 1e-7]
+    fns = []
+    for i, value in enumerate(values):
+        fns.append(str(tmp_path / f"{i}.mtx"))
+        write_mtx(fns[-1], {(0, 0): value, (i, 1): value}, 2, field="real")
+    merge_starsolo.merge_mtx(fns, str(tmp_path / "merged.mtx"))
+    size, entries = read_mtx_file(tmp_path / "merged.mtx")
+    assert size == f"{N_GENE} 2 4\n"
+    assert entries[(1, 1)] == float(f"{sum(values):.10g}")
+    assert entries[(1, 2)] == values[0]
+    assert entries[(3, 2)] == values[2]
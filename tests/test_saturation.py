@@ -0,0 +1,59 @@
+import collections
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import saturation
+from conftest import BIN
+
+
+def random_reads(rng, n):
+    umi_bases = "ACGTN"
+    return [
+        (
+            f"W{rng.integers(0, 5)}",
+            "".join(umi_bases[x] for x in rng.integers(0, 5, 4)),
+            f"G{rng.integers(0, 7)}",
+        )
+        for _ in range(n)
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 100000])
+def test_molecule_counter_matches_counter(chunk_size):
+    rng = np.random.default_rng(chunk_size)
+    reads = random_reads(rng, 3000)
+    counter = saturation.MoleculeCounter(chunk_size)
+    for cb, umi, gene in reads:
+        counter.add(cb, umi, gene)
+    counter.flush()
+
+    expected = collections.Counter(
+        (counter.well_index[cb], counter.gene_index[gene], saturation.pack_umi(umi))
+        for cb, umi, gene in reads
+    )
+    molecules = list(
+        zip(counter.wells.tolist(), counter.genes.tolist(), counter.umis.tolist())
+    )
+    assert molecules == sorted(expected)
+    assert counter.counts.tolist() == [expected[x] for x in molecules]
+
+
+def test_pack_umi_does_not_depend_on_hash_seed():
+    code = "import saturation; print(saturation.pack_umi('ACNGT'), saturation.pack_umi('A' * 40))"
+    outputs = set()
+    for seed in ["1", "2"]:
+        env = dict(os.environ, PYTHONPATH=BIN, PYTHONHASHSEED=seed)
+        outputs.add(
+            subprocess.run(
+                [sys.executable, "-c", code],
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        )
+    assert len(outputs) == 1
@@ -0,0 +1,374 @@
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+
+import pytest
+
+import barcode_correct
+import fastq_io
+import split_fastq
+import utils
+from conftest import BIN
+
+ASSETS = os.path.join(BIN, "..", "assets")
+WHITELIST = os.path.join(ASSETS, "whitelist", "AccuraCode-V1", "bclist384")
+SPLIT_INF = {"subA": "1-100", "subB": "101-150,200,384", "subC": "300-310"}
+
+
+def plate_reads(n_reads, seed=0, comments=True):
+    """
+    Read pairs(name, R1, R2) of the AccuraCode-V1 pattern C9U12: whitelist barcodes, barcodes with one or two
+    substitutions(including N) and random barcodes.
+    """
+    rng = random.Random(seed)
+    whitelist = utils.read_one_col(WHITELIST)
+    reads = []
+    for i in range(n_reads):
+        bc = list(rng.choice(whitelist))
+        status = rng.random()
+        if status < 0.05:
+            bc = [rng.choice("ACGT") for _ in range(9)]
+        elif status < 0.3:
+            for pos in rng.sample(range(9), 1 if status < 0.25 else 2):
+                bc[pos] = rng.choice("ACGTN")
+        seq1 = "".join(bc) + "".join(rng.choice("ACGT") for _ in range(12)) + "T" * 10
+        seq2 = "".join(rng.choice("ACGT") for _ in range(rng.randint(30, 60)))
+        # comments are dropped from names
+        name = f"r{i}" + (" 1:N:0:ACGT" if comments and i % 3 == 0 else "")
+        reads.append(
+            (
+                name,
+                (seq1, "F" * len(seq1)),
+                (seq2, "".join(rng.choice("F:,") for _ in seq2)),
+            )
+        )
+    return reads
+
+
+def write_reads(reads, fq1, fq2, plus_name=True):
+    with open(fq1, "w") as f1, open(fq2, "w") as f2:
+        for name, (seq1, qual1), (seq2, qual2) in reads:
+            plus = name if plus_name else ""
+            f1.write(f"@{name}\n{seq1}\n+{plus}\n{qual1}\n")
+            f2.write(f"@{name}\n{seq2}\n+\n{qual2}\n")
+
+
+def write_split_inf(fn, sample):
+    with open(fn, "w") as f:
+        f.write("raw_sample\twell\tsub_sample\n")
+        for sub_sample, wells in SPLIT_INF.items():
+            f.write(f"{sample}\t{wells}\t{sub_sample}\n")
+
+
+def expected_outputs(reads, sample, split_to_well):
+    """
+    Outputs of the original split_fastq.py: every barcode within 1 mismatch of a well of a sub-sample is written to
+    the sub-sample, records are written as @name, sequence, bare plus line and quality.
+    No two whitelist barcodes are within 2 mismatches, so a barcode matches at most one well.
+    """
+    whitelist = utils.read_one_col(WHITELIST)
+    out = {}
+    for sub_sample, wells in split_fastq_dict(sample).items():
+        for well in wells:
+            out[whitelist[well - 1]] = (sub_sample, f"well{well}")
+    files = {}
+    for sub_sample, wells in split_fastq_dict(sample).items():
+        for read in ("R1", "R2"):
+            files[f"{sample}/{sub_sample}/{sub_sample}_{read}.fastq"] = []
+            if split_to_well:
+                for well in wells:
+                    files[f"{sample}/{sub_sample}/well/well{well}_{read}.fastq"] = []
+    hits = {}
+    for name, (seq1, qual1), (seq2, qual2) in reads:
+        bc = seq1[:9]
+        if bc not in hits:
+            hits[bc] = [x for x in whitelist if barcode_correct.hamming(bc, x) <= 1]
+        if len(hits[bc]) != 1 or hits[bc][0] not in out:
+            continue
+        sub_sample, well = out[hits[bc][0]]
+        name = name.split()[0]
+        for read, seq, qual in (("R1", seq1, qual1), ("R2", seq2, qual2)):
+            record = f"@{name}\n{seq}\n+\n{qual}\n"
+            files[f"{sample}/{sub_sample}/{sub_sample}_{read}.fastq"].append(record)
+            if split_to_well:
+                files[f"{sample}/{sub_sample}/well/{well}_{read}.fastq"].append(record)
+    return {fn: "".join(records).encode() for fn, records in files.items()}
+
+
+def split_fastq_dict(sample):
+    out = {}
+    for sub_sample, wells in SPLIT_INF.items():
+        out[sub_sample] = []
+        for part in wells.split(","):
+            start, _, end = part.partition("-")
+            out[sub_sample].extend(range(int(start), int(end or start) + 1))
+    return out
+
+
+def run_split(work_dir, sample, fq1, fq2, split_inf, *args, check=True):
+    cmd = [
+        sys.executable,
+        os.path.join(BIN, "split_fastq.py"),
+        "--sample",
+        sample,
+        "--fq1",
+        fq1,
+        "--fq2",
+        fq2,
+        "--split_inf",
+        split_inf,
+        "--assets_dir",
+        ASSETS,
+        "--protocol",
+        "AccuraCode-V1",
+        "--well",
+        "384",
+        *args,
+    ]
+    return subprocess.run(
+        cmd, cwd=work_dir, check=check, capture_output=True, text=True
+    )
+
+
+def read_outputs(work_dir, sample):
+    out = {}
+    for root, _dirs, files in os.walk(os.path.join(work_dir, sample)):
+        for fn in files:
+            path = os.path.join(root, fn)
+            with open(path, "rb") as f:
+                out[os.path.relpath(path, work_dir)] = f.read()
+    return out
+
+
+# records with name comments and plus line names, and plain records that are copied as they are
+@pytest.fixture(scope="module", params=["comments", "plain"])
+def plate(tmp_path_factory, request):
+    tmp = tmp_path_factory.mktemp("plate")
+    plain = request.param == "plain"
+    reads = plate_reads(5000, comments=not plain)
+    fq1, fq2 = str(tmp / "R1.fastq"), str(tmp / "R2.fastq")
+    write_reads(reads, fq1, fq2, plus_name=not plain)
+    split_inf = str(tmp / "split_inf.tsv")
+    write_split_inf(split_inf, "S1")
+    return reads, fq1, fq2, split_inf
+
+
+@pytest.mark.parametrize("split_to_well", [False, True])
+@pytest.mark.parametrize("threads", [1, 3])
+def test_split_matches_original(plate, tmp_path, threads, split_to_well):
+    reads, fq1, fq2, split_inf = plate
+    args = ["--threads", str(threads), "--chunk_size", "100"]
+    if split_to_well:
+        args.append("--split_to_well")
+    run_split(tmp_path, "S1", fq1, fq2, split_inf, *args)
+    expected = expected_outputs(reads, "S1", split_to_well)
+    assert read_outputs(tmp_path, "S1") == expected
+    assert sum(len(x) > 0 for x in expected.values()) > 0
+
+    # well_bc.json has the barcodes that the corrector routes to each sub-sample
+    with open(tmp_path / "S1.bulk_rna.well_bc.json") as f:
+        well_bc = json.load(f)
+    neighbours = barcode_correct.BarcodeCorrector(
+        utils.read_one_col(WHITELIST)
+    ).neighbours()
+    for sub_sample, bc in well_bc.items():
+        assert bc["sample"] == {
+            seq: seq_bc
+            for seq, (_status, seq_bc) in neighbours.items()
+            if seq_bc in bc["map"]
+        }
+        assert ("well" in bc) == split_to_well
+
+    # wells have the sampled reads of the sub-sample histograms
+    with open(tmp_path / "S1.bulk_rna.demux.json") as f:
+        demux = json.load(f)
+    total = 0
+    for sub in demux["sub_sample"].values():
+        sampled = sum(x.get("R2 Sampled Reads", 0) for x in sub["well"].values())
+        assert sampled == sum(sub["R2 Length"].values())
+        total += sampled
+    assert total > 0
+
+
+def test_route_table_matches_corrector():
+    whitelist = utils.read_one_col(WHITELIST)
+    well_route = {bc: (("sub", "sample"),) for bc in whitelist[:10]}
+    corrector = barcode_correct.BarcodeCorrector(whitelist)
+    table = split_fastq.RouteTable(well_route, corrector, max_size=0)
+    n_fixed = len(table)
+    rng = random.Random(0)
+    seqs = []
+    for bc in whitelist[:20]:
+        for pos in range(9):
+            for base in "ACGTN.":
+                seqs.append(bc[:pos] + base + bc[pos + 1 :])
+    seqs += ["".join(rng.choice("ACGT") for _ in range(9)) for _ in range(100)]
+    seqs += [
+        "".join(rng.choice("ACGTN.") for _ in range(rng.randint(8, 10)))
+        for _ in range(100)
+    ]
+    for seq in seqs:
+        status, seq_bc = corrector.lookup(seq)
+        routes = well_route.get(seq_bc, ())
+        for _ in range(2):
+            # cached and uncached lookups agree
+            assert table.info[table[seq.encode()]] == (routes, status, seq_bc)
+    # only the precomputed barcodes are kept with max_size 0
+    assert len(table) == n_fixed
+    assert table.max_size == n_fixed
+
+
+def test_route_table_cache_is_bounded():
+    whitelist = utils.read_one_col(WHITELIST)
+    corrector = barcode_correct.BarcodeCorrector(whitelist)
+    n_fixed = len(split_fastq.RouteTable({}, corrector, max_size=0))
+    table = split_fastq.RouteTable({}, corrector, max_size=n_fixed + 5)
+    for i in range(20):
+        table[f"{whitelist[i][:8]}.".encode()]
+    assert len(table) == table.max_size == n_fixed + 5
+
+
+# kill split_fastq.py at its third checkpoint, after the outputs of the blocks since the second one were written
+KILL_AT_CHECKPOINT = """
+import os, runpy, signal, sys
+
+import fastq_io
+
+checkpoint = fastq_io.FastqWriter.checkpoint
+calls = []
+
+
+def kill(self):
+    calls.append(1)
+    if len(calls) == 3:
+        # half written outputs, like a task killed while writing
+        for f in self.files[::2]:
+            f.flush()
+        os.kill(os.getpid(), signal.SIGKILL)
+    return checkpoint(self)
+
+
+fastq_io.FastqWriter.checkpoint = kill
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+@pytest.fixture(scope="module")
+def two_files(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("two_files")
+    reads = plate_reads(6000, seed=1)
+    fq1, fq2 = [], []
+    for i, part in enumerate([reads[:3500], reads[3500:]]):
+        fq1.append(str(tmp / f"L{i}_R1.fastq"))
+        fq2.append(str(tmp / f"L{i}_R2.fastq"))
+        write_reads(part, fq1[-1], fq2[-1])
+    split_inf = str(tmp / "split_inf.tsv")
+    write_split_inf(split_inf, "S1")
+    return ",".join(fq1), ",".join(fq2), split_inf
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+@pytest.mark.parametrize("compression", ["none", "gzip", "bgzf"])
+def test_split_resumes_from_checkpoint(two_files, tmp_path, compression, threads):
+    fq1, fq2, split_inf = two_files
+    args = [
+        "--split_to_well",
+        "--threads",
+        str(threads),
+        "--chunk_size",
+        "50",
+        "--compression",
+        compression,
+        "--checkpoint_every",
+        "1000",
+    ]
+    clean, resumed = tmp_path / "clean", tmp_path / "resumed"
+    clean.mkdir()
+    resumed.mkdir()
+    run_split(
+        clean,
+        "S1",
+        fq1,
+        fq2,
+        split_inf,
+        "--checkpoint_dir",
+        str(tmp_path / "clean_checkpoint"),
+        *args,
+    )
+
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    cmd = [
+        sys.executable,
+        "-c",
+        KILL_AT_CHECKPOINT,
+        os.path.join(BIN, "split_fastq.py"),
+        "--sample",
+        "S1",
+        "--fq1",
+        fq1,
+        "--fq2",
+        fq2,
+        "--split_inf",
+        split_inf,
+        "--assets_dir",
+        ASSETS,
+        "--protocol",
+        "AccuraCode-V1",
+        "--well",
+        "384",
+        "--checkpoint_dir",
+        checkpoint_dir,
+        *args,
+    ]
+    env = dict(os.environ, PYTHONPATH=BIN)
+    killed = subprocess.run(cmd, cwd=resumed, env=env, capture_output=True, text=True)
+    assert killed.returncode == -signal.SIGKILL, killed.stderr
+    assert os.path.exists(os.path.join(checkpoint_dir, "checkpoint.json"))
+    assert not os.path.exists(resumed / "S1")
+
+    run = run_split(
+        resumed, "S1", fq1, fq2, split_inf, "--checkpoint_dir", checkpoint_dir, *args
+    )
+    assert "Resume from file" in run.stderr
+    assert not os.path.exists(checkpoint_dir)
+    assert read_outputs(resumed, "S1") == read_outputs(clean, "S1")
+    for fn in ["S1.bulk_rna.demux.json", "S1.bulk_rna.fastq_inf.json"]:
+        assert (resumed / fn).read_bytes() == (clean / fn).read_bytes()
+
+
+def test_record_block_matches_split():
+    reads = plate_reads(500, seed=2)
+    # short sequences are clipped like bytes slicing
+    reads.append(("short\ttab", ("ACG", "FFF"), ("", "")))
+    block = "".join(
+        f"@{name}\n{seq1}\n+{name}\n{qual1}\n" for name, (seq1, qual1), _r2 in reads
+    ).encode()
+    records = fastq_io.RecordBlock(block)
+    lines = block[:-1].split(b"\n")
+    assert records.n == len(reads)
+    assert records.fields(1, slice(2, 11)) == [x[2:11] for x in lines[1::4]]
+    index = [3, 0, 500, 7]
+    assert records.join(index) == b"".join(
+        b"%s\n%s\n+\n%s\n"
+        % (lines[4 * i].split()[0], lines[4 * i + 1], lines[4 * i + 3])
+        for i in index
+    )
+    assert records.line(500, 3) == b"FFF"
+
+
+def test_read_pair_blocks_check_last_names(tmp_path):
+    reads = plate_reads(300, seed=3)
+    fq1, fq2 = str(tmp_path / "R1.fastq"), str(tmp_path / "R2.fastq")
+    write_reads(reads, fq1, fq2)
+    blocks = list(fastq_io.read_pair_blocks(fq1, fq2, block_size=4000))
+    assert len(blocks) > 1
+    assert sum(n for _block1, _block2, n in blocks) == len(reads)
+    # one block, R2 is out of step after its fifth record, only the last names differ
+    unsorted = reads[:5] + reads[6:] + reads[5:6]
+    write_reads(unsorted, str(tmp_path / "R1_unsorted.fastq"), fq2)
+    with pytest.raises(SystemExit, match="do not match: @r299 @r5"):
+        list(fastq_io.read_pair_blocks(fq1, fq2))
@@ -0,0 +1,38 @@
+import gzip
+import os
+import threading
+
+import pytest
+
+import utils
+
+RECORD = b"@r1\nACGT\n+\nFFFF\n"
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs mkfifo")
+@pytest.mark.parametrize(
+    "name, data", [("in.fastq", RECORD), ("in.fastq.gz", gzip.compress(RECORD))]
+)
+def test_openfile_reads_fifo(tmp_path, name, data):
+    fifo = str(tmp_path / name)
+    os.mkfifo(fifo)
+
+    def write():
+        with open(fifo, "wb") as f:
+            f.write(data)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    with utils.openfile(fifo) as f:
+        assert f.read() == RECORD.decode()
+    writer.join()
+
+
+@pytest.mark.parametrize("compress", [lambda x: x, gzip.compress])
+def test_openfile_detects_by_magic(tmp_path, compress):
+    # no extension
+    fn = str(tmp_path / "reads")
+    with open(fn, "wb") as f:
+        f.write(compress(RECORD))
+    with utils.openfile(fn, "rb") as f:
+        assert f.read() == RECORD
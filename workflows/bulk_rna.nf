@@ -6,15 +6,27 @@
 include { FASTQC                 } from '../modules/nf-core/fastqc/main'
 include { FILTER_GTF             } from '../modules/local/filter_gtf'
 include { STAR_GENOME            } from '../modules/local/star_genome'
+include { GENOME_CACHE_PUBLISH   } from '../modules/local/genome_cache_publish'
+include { PREFILTER_BARCODE      } from '../modules/local/prefilter_barcode'
 include { PROTOCOL_CMD           } from '../modules/local/protocol_cmd'
 include { STARSOLO               } from '../modules/local/starsolo'
+include { STARSOLO as STARSOLO_SHARD } from '../modules/local/starsolo'
+include { SHARD_FASTQ            } from '../modules/local/shard_fastq'
+include { MERGE_STARSOLO         } from '../modules/local/merge_starsolo'
 include { STARSOLO_SUMMARY       } from '../modules/local/starsolo_summary'
+include { STARSOLO_SUMMARY_BATCH } from '../modules/local/starsolo_summary_batch'
+include { WELL_MATRIX            } from '../modules/local/well_matrix'
+include { SPLIT_MATRIX           } from '../modules/local/split_matrix'
+include { SATURATION             } from '../modules/local/saturation'
 include { MULTIQC                } from '../modules/local/multiqc_sgr'
 
 include { paramsSummaryMap       } from 'plugin/nf-validation'
 include { paramsSummaryMultiqc   } from '../subworkflows/nf-core/utils_nfcore_pipeline'
 include { softwareVersionsToYAML } from '../subworkflows/nf-core/utils_nfcore_pipeline'
 include { methodsDescriptionText } from '../subworkflows/local/utils_nfcore_bulk_rna_pipeline'
+include { genomeCacheLookup      } from '../subworkflows/local/utils_nfcore_bulk_rna_pipeline'
+include { genomeCacheInfo        } from '../subworkflows/local/utils_nfcore_bulk_rna_pipeline'
+include { genomeCacheRelease     } from '../subworkflows/local/utils_nfcore_bulk_rna_pipeline'
 
 
 /*
@@ -24,11 +36,12 @@ include { methodsDescriptionText } from '../subworkflows/local/utils_nfcore_bulk
 */
 workflow BULK_RNA {
     take:
-    ch_samplesheet // channel: samplesheet read in from --input
+    ch_samplesheet     // channel: samplesheet read in from --input
+    ch_multiqc_extra   // channel: extra files for MultiQC, e.g. demux stats of split_fastq
 
     main:
     ch_versions = Channel.empty()
-    ch_multiqc_files = Channel.empty()
+    ch_multiqc_files = ch_multiqc_extra
 
     // FastQC
     if (params.run_fastqc) {
@@ -43,8 +56,12 @@ workflow BULK_RNA {
     def star_genome = null
     genome_name = null
     genome_dir = "${workDir}/temp_dir/genome"
+    // content-addressed cache of STAR genomes, a hit skips FILTER_GTF and STAR_GENOME
+    def genome_cache = (!params.star_genome && params.genome_cache) ? genomeCacheLookup(params.genome_cache) : null
     if (params.star_genome) {
         star_genome = params.star_genome
+    } else if (genome_cache?.hit) {
+        star_genome = genome_cache.entry
     } else {
         FILTER_GTF(
             params.gtf,
@@ -52,6 +69,7 @@ workflow BULK_RNA {
         )
         
         ch_gtf = FILTER_GTF.out.filtered_gtf
+        ch_multiqc_files = ch_multiqc_files.mix(FILTER_GTF.out.perf)
         if(params.genome_name.contains('/')){
             genome_name = params.genome_name.split('/').last()
             genome_dir = params.genome_name
@@ -68,36 +86,159 @@ workflow BULK_RNA {
         )
         ch_versions = ch_versions.mix(STAR_GENOME.out.versions.first())
         star_genome = STAR_GENOME.out.index
+        if (genome_cache) {
+            // copied in a task instead of on the head node
+            GENOME_CACHE_PUBLISH(
+                STAR_GENOME.out.index,
+                genome_cache.root,
+                genome_cache.key,
+                genomeCacheInfo(genome_cache)
+            )
+            // the task removes the lock when published, this is for failed runs
+            workflow.onComplete { genomeCacheRelease(genome_cache) }
+        }
+    }
+
+    // remove reads with barcodes not in whitelist before alignment
+    ch_reads = ch_samplesheet
+    ch_prefilter_stats = ch_samplesheet.map{ [it[0], []] }
+    if (params.prefilter_barcode) {
+        PREFILTER_BARCODE (
+            ch_samplesheet,
+            "${projectDir}/assets/",
+            params.protocol,
+        )
+        ch_reads = PREFILTER_BARCODE.out.reads
+        ch_prefilter_stats = PREFILTER_BARCODE.out.json
+        ch_multiqc_files = ch_multiqc_files.mix(PREFILTER_BARCODE.out.json.collect{it[1]})
     }
 
     // create cmd
     PROTOCOL_CMD (
-        ch_samplesheet,
+        ch_reads,
         "${projectDir}/assets/",
         params.protocol,
     )
     ch_multiqc_files = ch_multiqc_files.mix(PROTOCOL_CMD.out.json.collect{it[1]})
 
     // starsolo
-    ch_merge = ch_samplesheet.join(PROTOCOL_CMD.out.protocol_cmd.map{ [it[0], it[1].text] })
-    STARSOLO (
-        ch_merge,
-        star_genome,
-        "${projectDir}/assets/"
-    )
-    ch_versions = ch_versions.mix(STARSOLO.out.versions.first())
+    ch_protocol_cmd = PROTOCOL_CMD.out.protocol_cmd.map{ [it[0], it[1].text] }
+    if (params.starsolo_shards > 1) {
+        // scatter: reads of each well go to one shard, so the merged counts are the same as from one STARsolo run
+        SHARD_FASTQ (
+            ch_reads,
+            "${projectDir}/assets/",
+            params.protocol,
+            params.starsolo_shards,
+        )
+        ch_multiqc_files = ch_multiqc_files.mix(SHARD_FASTQ.out.perf)
+        ch_shard_reads = SHARD_FASTQ.out.reads
+            .flatMap{ meta, reads ->
+                reads.groupBy{ it.parent.name }.collect{ dir, fq -> [meta + [shard: dir.tokenize('.').last()], fq.sort{ it.name }] }
+            }
+        ch_merge = ch_shard_reads
+            .map{ meta, reads -> [meta.findAll{ it.key != 'shard' }, meta, reads] }
+            .combine(ch_protocol_cmd, by: 0)
+            .map{ meta, shard_meta, reads, protocol_cmd -> [shard_meta, reads, protocol_cmd] }
+        STARSOLO_SHARD (
+            ch_merge,
+            star_genome,
+            "${projectDir}/assets/"
+        )
+        ch_versions = ch_versions.mix(STARSOLO_SHARD.out.versions.first())
+
+        // gather: Solo.out and matrix of all shards, in shard order
+        ch_shard_out = STARSOLO_SHARD.out.solo_out.join(STARSOLO_SHARD.out.matrix)
+            .map{ meta, solo_out, matrix -> [meta.findAll{ it.key != 'shard' }, meta.shard, solo_out, matrix] }
+            .groupTuple(size: params.starsolo_shards)
+            .map{ meta, shards, solo_outs, matrices ->
+                def order = (0..<shards.size()).sort{ shards[it].replace('shard', '') as int }
+                [meta, order.collect{ solo_outs[it] }, order.collect{ matrices[it] }]
+            }
+        MERGE_STARSOLO (
+            ch_shard_out
+        )
+        ch_multiqc_files = ch_multiqc_files.mix(MERGE_STARSOLO.out.perf)
+        ch_bam = STARSOLO_SHARD.out.bam_sorted
+            .map{ meta, bam -> [meta.findAll{ it.key != 'shard' }, bam] }
+            .groupTuple(size: params.starsolo_shards)
+        ch_matrix = MERGE_STARSOLO.out.matrix
+        ch_read_stats = MERGE_STARSOLO.out.read_stats
+        ch_summary = MERGE_STARSOLO.out.summary
+    } else {
+        ch_merge = ch_reads.join(ch_protocol_cmd)
+        STARSOLO (
+            ch_merge,
+            star_genome,
+            "${projectDir}/assets/"
+        )
+        ch_versions = ch_versions.mix(STARSOLO.out.versions.first())
+        ch_bam = STARSOLO.out.bam_sorted
+        ch_matrix = STARSOLO.out.matrix
+        ch_read_stats = STARSOLO.out.read_stats
+        ch_summary = STARSOLO.out.summary
+    }
 
     // statsolo summary
-    ch_merge = STARSOLO.out.read_stats.join(STARSOLO.out.summary)
-    STARSOLO_SUMMARY (
-        ch_merge,
+    ch_merge = ch_read_stats.join(ch_summary).join(ch_prefilter_stats)
+    if (params.starsolo_summary_batch) {
+        // one task for all samples
+        ch_batch = ch_merge
+            .toSortedList{ a, b -> a[0].id <=> b[0].id }
+            .map{ rows -> [ rows.collect{ it[0].id }, rows.collect{ it[1] }, rows.collect{ it[2] }, rows.collect{ it[3] }.flatten() ] }
+        STARSOLO_SUMMARY_BATCH (
+            ch_batch.map{ it[0] },
+            ch_batch.map{ it[1] },
+            ch_batch.map{ it[2] },
+            ch_batch.map{ it[3] },
+            "${projectDir}/assets/",
+            params.protocol,
+            params.umi_cutoff,
+            params.read_cutoff,
+            params.gene_cutoff,
+        )
+        ch_multiqc_files = ch_multiqc_files.mix(STARSOLO_SUMMARY_BATCH.out.json)
+    } else {
+        STARSOLO_SUMMARY (
+            ch_merge,
+            "${projectDir}/assets/",
+            params.protocol,
+            params.umi_cutoff,
+            params.read_cutoff,
+            params.gene_cutoff,
+        )
+        ch_multiqc_files = ch_multiqc_files.mix(STARSOLO_SUMMARY.out.json.collect{it[1]})
+    }
+
+    // per well metrics and binary matrix
+    WELL_MATRIX (
+        ch_matrix,
         "${projectDir}/assets/",
         params.protocol,
-        params.umi_cutoff,
-        params.read_cutoff,
-        params.gene_cutoff,
     )
-    ch_multiqc_files = ch_multiqc_files.mix(STARSOLO_SUMMARY.out.json.collect{it[1]})
+
+    // saturation and downsampling curves from the BAM
+    if (params.run_saturation) {
+        SATURATION (
+            ch_bam,
+            "${projectDir}/assets/",
+            params.protocol,
+        )
+        ch_multiqc_files = ch_multiqc_files.mix(SATURATION.out.json, SATURATION.out.perf)
+    }
+
+    // sub-samples from the matrix of the sample, without splitting fastq and aligning again
+    if (params.split_matrix) {
+        // samples not in split_inf are not split
+        def split_samples = file(params.split_inf, checkIfExists: true).readLines().drop(1).collect{ it.tokenize('\t')[0] }
+        SPLIT_MATRIX (
+            ch_matrix.join(ch_read_stats).filter{ it[0].id in split_samples },
+            "${projectDir}/assets/",
+            params.protocol,
+            params.split_inf,
+        )
+        ch_multiqc_files = ch_multiqc_files.mix(SPLIT_MATRIX.out.json, SPLIT_MATRIX.out.perf)
+    }
 
     //
     // Collate and save software versions
@@ -17,13 +17,16 @@ process split_fastq {
     path split_inf
 
     output:
-    tuple val(meta), path("${meta.id}/")
-    tuple val(meta), path("${meta.id}.*.json")
+    tuple val(meta), path("${meta.id}/")               , emit: out_dir
+    tuple val(meta), path("${meta.id}.*.json")         , emit: json
+    tuple val(meta), path("${meta.id}.*.prof")         , optional: true, emit: profile
 
     script:
     def prefix = "${meta.id}"
     def (forward, reverse) = reads.collate(2).transpose()
     def args = task.ext.args ?: ''
+    // outside of the task directory, so that a retried task resumes from the last checkpoint
+    def checkpoint = params.split_checkpoint ? "--checkpoint_dir ${workDir}/temp_dir/split_checkpoint/${prefix}" : ""
     """
     split_fastq.py \\
         --sample $prefix \\
@@ -35,6 +38,8 @@ process split_fastq {
         --well ${params.well} \\
         --pattern ${params.pattern} \\
         --whitelist \"${params.whitelist}\" \\
+        --threads ${task.cpus} \\
+        $checkpoint \\
         $args
     """
 }
@@ -51,4 +56,23 @@ workflow SPLITFASTQ {
         params.protocol,
         params.split_inf,
     )
+
+    // one element per sub-sample: {sample}/{sub_sample}/{sub_sample}_R{1,2}.fastq*
+    ch_reads = split_fastq.out.out_dir
+        .flatMap{ meta, out_dir ->
+            out_dir.listFiles().findAll{ it.isDirectory() }.collect{ sub_dir ->
+                // sub-sample names are user input, quoted so that regex characters in them match literally
+                def pattern = java.util.regex.Pattern.quote(sub_dir.name) + /_R[12]\.fastq.*/
+                def reads = sub_dir.listFiles().findAll{ it.name ==~ pattern }.sort{ it.name }
+                // sub-sample names can repeat across raw samples
+                [ meta + [ id: "${meta.id}_${sub_dir.name}", raw_sample: meta.id ], reads ]
+            }
+        }
+    ch_multiqc_files = split_fastq.out.json
+        .flatMap{ meta, json -> json instanceof List ? json : [json] }
+        .filter{ it.name.endsWith('.demux.json') || it.name.endsWith('.perf.json') }
+
+    emit:
+    reads         = ch_reads         // channel: [ val(meta), [ reads ] ]
+    multiqc_files = ch_multiqc_files // channel: [ path(json) ]
 }
\ No newline at end of file